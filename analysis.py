@@ -0,0 +1,646 @@
+"""
+Analyses of scheme source code, used by the compiler to choose cheaper
+expressions. They work on the scheme data structures produced by the parser,
+before compilation. Malformed forms are left alone; the compiler reports them
+when it gets to them.
+"""
+
+from stypes import *
+from utils import is_list
+
+IF, COND, BEGIN = map(Symbol, ('if', 'cond', 'begin'))
+LET, LETSTAR, LETREC = map(Symbol, ('let', 'let*', 'letrec'))
+LAMBDA, DEFINE, QUOTE = map(Symbol, ('lambda', 'define', 'quote'))
+SET, DO = Symbol('set!'), Symbol('do')
+DEFINE_MEMOIZED = Symbol('define-memoized')
+MEMOIZE = Symbol('memoize')
+DELAY, CONS_STREAM = Symbol('delay'), Symbol('cons-stream')
+
+# the head of the internal form (%hoisted-lambda params body...): a lambda
+# without free local variables, created once instead of every time it is
+# evaluated (see exprs.HoistedLambdaExpr)
+HOISTED_LAMBDA = Symbol.uninterned('%hoisted-lambda')
+
+# the head of the internal form (%flat-lambda (captured...) params body...): a
+# lambda whose procedures keep only the values of the local variables
+# (captured...) (see exprs.FlatLambdaExpr)
+FLAT_LAMBDA = Symbol.uninterned('%flat-lambda')
+
+# the head of the internal form (%inline var params expansion call): a call of
+# the top-level procedure @var with parameters @params, where @expansion is the
+# procedure's body with the arguments substituted for the parameters (see
+# exprs.InlineExpr)
+INLINE = Symbol.uninterned('%inline')
+
+
+def is_form(sds, head, min_length=1):
+    """Returns True if @sds is a list with at least @min_length elements whose
+    first element is the symbol @head."""
+    return (type(sds) is Cons and sds.car is head and is_list(sds)
+            and len(sds) >= min_length)
+
+
+def binding_names(bindings):
+    """Returns the list of variables bound by the bindings list of a let form,
+    or None if @bindings is malformed."""
+    if not is_list(bindings):
+        return None
+    names = []
+    for binding in bindings:
+        if type(binding) is not Cons or type(binding.car) is not Symbol:
+            return None
+        names.append(binding.car)
+    return names
+
+
+def defined_names(body):
+    """Returns the set of variables defined by the internal definitions of the
+    sequence of expressions @body."""
+    names = set()
+    for expr in body:
+        if is_form(expr, DEFINE, 3) or is_form(expr, DEFINE_MEMOIZED, 3):
+            target = expr.cadr
+            if type(target) is Cons:
+                target = target.car
+            names.add(target)
+        elif is_form(expr, BEGIN):
+            names |= defined_names(expr.cdr)
+    return names
+
+
+def replace_tail_calls(body, var, replace):
+    """@body must be a scheme list of expressions forming the body of a lambda
+    or a let. Returns an equivalent list in which every application of the
+    variable @var in tail position, where @var refers to the binding visible
+    outside of @body, is replaced by replace(application). Parts without such
+    applications are shared with @body, and @body itself is returned if there
+    are none."""
+
+    if not is_list(body) or var in defined_names(body):
+        return body
+    return replace_last(body, var, replace)
+
+
+def replace_last(exprs, var, replace):
+    """Like replace_tail_calls, but for a sequence of expressions which does not
+    introduce a scope (the rest of a begin form or a cond clause)."""
+
+    if not is_list(exprs) or exprs is nil:
+        return exprs
+    exprs_list = exprs.pylist
+    last = replace_in_tail(exprs_list[-1], var, replace)
+    if last is exprs_list[-1]:
+        return exprs
+    exprs_list[-1] = last
+    return Cons.from_iter(exprs_list)
+
+
+def replace_in_tail(expr, var, replace):
+    """Like replace_tail_calls, but for a single expression in tail position."""
+
+    if type(expr) is not Cons or not is_list(expr):
+        return expr
+
+    head = expr.car
+    if head is var:
+        return replace(expr)
+
+    if head is IF and len(expr) in (3, 4):
+        parts = expr.pylist
+        parts[2:] = [replace_in_tail(part, var, replace) for part in parts[2:]]
+        return Cons.from_iter(parts)
+    elif head is BEGIN:
+        return Cons(head, replace_last(expr.cdr, var, replace))
+    elif head is COND:
+        clauses = []
+        for clause in expr.cdr:
+            if type(clause) is Cons and is_list(clause):
+                clause = Cons(clause.car, replace_last(clause.cdr, var, replace))
+            clauses.append(clause)
+        return Cons(head, Cons.from_iter(clauses))
+    elif head in (LET, LETSTAR, LETREC) and len(expr) >= 3:
+        if type(expr.cadr) is Symbol:
+            # a named let: (let name bindings body...)
+            if head is not LET or len(expr) < 4 or expr.cadr is var:
+                return expr
+            prefix, bindings, body = (head, expr.cadr), expr.caddr, expr.nthcdr(3)
+        else:
+            prefix, bindings, body = (head,), expr.cadr, expr.cddr
+        names = binding_names(bindings)
+        if names is None or var in names:
+            return expr
+        new_body = replace_tail_calls(body, var, replace)
+        if new_body is body:
+            return expr
+        return Cons.from_iter([*prefix, bindings, *new_body])
+    elif head is DO and len(expr) >= 3:
+        # (do bindings (test result...) body...): the results are in tail
+        # position
+        names, clause = binding_names(expr.cadr), expr.caddr
+        if names is None or var in names or type(clause) is not Cons:
+            return expr
+        new_clause = Cons(clause.car, replace_last(clause.cdr, var, replace))
+        return Cons(head, Cons(expr.cadr, Cons(new_clause, expr.nthcdr(3))))
+    return expr
+
+
+# the heads of the forms which create procedures or otherwise capture the
+# environment they are evaluated in
+CLOSURE_FORMS = {LAMBDA, DEFINE_MEMOIZED, DELAY, CONS_STREAM}
+
+
+def creates_closures(sds):
+    """Returns True if evaluating @sds may capture the environments it is
+    evaluated in, which happens when it contains a lambda, a definition of a
+    procedure, a named let or a delayed expression. Quoted data is not
+    inspected."""
+
+    if type(sds) is not Cons:
+        return False
+
+    head = sds.car
+    if head in (QUOTE, HOISTED_LAMBDA, FLAT_LAMBDA):
+        # flat closures copy the values of the variables they capture
+        return False
+    if head in CLOSURE_FORMS:
+        return True
+    if head is DEFINE and type(sds.cdr) is Cons and type(sds.cadr) is Cons:
+        return True
+    if head is LET and type(sds.cdr) is Cons and type(sds.cadr) is Symbol:
+        return True
+
+    while type(sds) is Cons:
+        if creates_closures(sds.car):
+            return True
+        sds = sds.cdr
+    return False
+
+
+def param_names(params):
+    """Returns the list of variables in the parameter list @params of a
+    lambda, or None if @params is malformed."""
+    if not is_list(params) or any(type(param) is not Symbol for param in params):
+        return None
+    return list(params)
+
+
+def free_variables(sds):
+    """Returns the set of variables which occur free in the expression @sds.
+    The result may contain symbols which are not variable references (like
+    the "else" of cond clauses or the names of special forms), but never
+    misses a variable that is."""
+
+    if type(sds) is Symbol:
+        return {sds}
+    if type(sds) is not Cons:
+        return set()
+    if not is_list(sds):
+        return symbols_in(sds)
+
+    head, length = sds.car, len(sds)
+    if head is QUOTE:
+        return set()
+    elif head is INLINE and length == 5:
+        return {sds.cadr} | free_variables(sds[3]) | free_variables(sds[4])
+    elif head is FLAT_LAMBDA and length >= 4:
+        return free_variables(Cons(LAMBDA, sds.cddr))
+    elif head in (LAMBDA, HOISTED_LAMBDA) and length >= 3:
+        params = param_names(sds.cadr)
+        if params is not None:
+            return body_free_variables(sds.cddr) - set(params)
+    elif head in (DEFINE, DEFINE_MEMOIZED) and length >= 3:
+        target = sds.cadr
+        if type(target) is Symbol:
+            return free_variables(sds.caddr)
+        params = param_names(target)
+        if params:
+            free = body_free_variables(sds.cddr) - set(params[1:])
+            return free | {MEMOIZE} if head is DEFINE_MEMOIZED else free
+    elif head is SET and length == 3:
+        return {sds.cadr} | free_variables(sds.caddr)
+    elif head is LET and length >= 3 and type(sds.cadr) is Symbol:
+        names = binding_names(sds.caddr)
+        if names is not None and length >= 4:
+            free = body_free_variables(sds.nthcdr(3)) - set(names) - {sds.cadr}
+            return free.union(*(free_variables(b.cdr) for b in sds.caddr))
+    elif head in (LET, LETSTAR, LETREC) and length >= 3:
+        names = binding_names(sds.cadr)
+        if names is not None:
+            return let_free_variables(head, sds.cadr, sds.cddr)
+    elif head is DO and length >= 3:
+        names = binding_names(sds.cadr)
+        if names is not None:
+            inits = set().union(*(free_variables(b.cadr) for b in sds.cadr
+                                  if type(b.cdr) is Cons))
+            steps = set().union(*(free_variables(b.cddr) for b in sds.cadr
+                                  if type(b.cdr) is Cons))
+            return inits | ((steps | symbols_free_in_all(sds.cddr)) - set(names))
+    return symbols_free_in_all(sds)
+
+
+def let_free_variables(head, bindings, body):
+    if head is LETSTAR:
+        if bindings is nil:
+            return body_free_variables(body)
+        name, init = bindings.car.car, bindings.car.cdr
+        rest = let_free_variables(head, bindings.cdr, body) - {name}
+        return free_variables(init) | rest
+    names = set(binding_names(bindings))
+    inits = set().union(*(free_variables(b.cdr) for b in bindings))
+    free = body_free_variables(body) - names
+    return free | (inits - names if head is LETREC else inits)
+
+
+def body_free_variables(body):
+    """Like free_variables, but for the body of a lambda or a let, in which the
+    internal definitions bind variables."""
+    return symbols_free_in_all(body) - defined_names(body)
+
+
+def symbols_free_in_all(exprs):
+    return set().union(*(free_variables(expr) for expr in exprs))
+
+
+def symbols_in(sds):
+    """Returns the set of all symbols occuring in @sds."""
+    result = set()
+    stack = [sds]
+    while stack:
+        sds = stack.pop()
+        if type(sds) is Symbol:
+            result.add(sds)
+        elif type(sds) is Cons:
+            stack.append(sds.car)
+            stack.append(sds.cdr)
+    return result
+
+
+def assigned_variables(sds):
+    """Returns the set of variables assigned by set! forms anywhere in
+    @sds."""
+    result = set()
+    stack = [sds]
+    while stack:
+        sds = stack.pop()
+        if type(sds) is not Cons or sds.car is QUOTE:
+            continue
+        if sds.car is SET and type(sds.cdr) is Cons:
+            result.add(sds.cadr)
+        while type(sds) is Cons:
+            stack.append(sds.car)
+            sds = sds.cdr
+    return result
+
+
+def convert_closures(sds):
+    """Returns the top-level form @sds with the lambda expressions nested in
+    the scope of local variables rewritten, so that the procedures they create
+    do not keep the whole environment they are created in:
+    - a lambda which refers to no local variable becomes
+      (%hoisted-lambda params body...)
+    - a lambda whose local variables are never changed after it is created
+      becomes (%flat-lambda (captured...) params body...), where (captured...)
+      are the local variables it refers to. The variables are changed after
+      the lambda is created if they are assigned with set!, or are bound by
+      internal definitions or letrec.
+    Other lambdas are left alone. Procedure definitions inside bodies are
+    rewritten to (define name lambda-form). Parts without such lambdas are
+    shared with @sds."""
+    return _convert(sds, None, assigned_variables(sds))
+
+
+def _convert(sds, scope, assigned):
+    """@scope maps the local variables visible at @sds to True if they can be
+    copied into flat closures. It is None at the top level, outside of any
+    procedure or let."""
+
+    if type(sds) is not Cons or not is_list(sds) or sds.car is QUOTE:
+        return sds
+
+    head, length = sds.car, len(sds)
+    if head is LAMBDA and length >= 3 and param_names(sds.cadr) is not None:
+        return _convert_lambda(sds, scope, assigned)
+    elif (head is DEFINE and length >= 3 and type(sds.cadr) is Cons
+          and param_names(sds.cadr)):
+        target = sds.cadr
+        lambda_form = Cons(LAMBDA, Cons(target.cdr, sds.cddr))
+        converted = _convert_lambda(lambda_form, scope, assigned)
+        if converted is lambda_form:
+            return sds
+        return Cons.from_iter([DEFINE, target.car, converted])
+    elif (head is DEFINE_MEMOIZED and length >= 3 and type(sds.cadr) is Cons
+          and param_names(sds.cadr)):
+        inner = _extend(scope, sds.cadr.cdr, True, assigned)
+        return _rebuild(sds, 2, _convert_body(sds.cddr, inner, assigned))
+    elif head is LET and length >= 4 and type(sds.cadr) is Symbol:
+        names = binding_names(sds.caddr)
+        if names is not None:
+            bindings = _convert_inits(sds.caddr, scope, assigned)
+            inner = _extend(scope, [sds.cadr, *names], True, assigned)
+            body = _convert_body(sds.nthcdr(3), inner, assigned)
+            return _rebuild(sds, 2, Cons(bindings, body))
+    elif head in (LET, LETSTAR, LETREC) and length >= 3:
+        names = binding_names(sds.cadr)
+        if names is not None:
+            if head is LET:
+                bindings = _convert_inits(sds.cadr, scope, assigned)
+                inner = _extend(scope, names, True, assigned)
+            elif head is LETSTAR:
+                converted, inner = [], scope
+                for binding in sds.cadr:
+                    converted.append(_convert_inits(Cons(binding, nil), inner,
+                                                    assigned).car)
+                    inner = _extend(inner, [binding.car], True, assigned)
+                bindings = Cons.from_iter(converted)
+            else:
+                inner = _extend(scope, names, False, assigned)
+                bindings = _convert_inits(sds.cadr, inner, assigned)
+            body = _convert_body(sds.cddr, inner, assigned)
+            return _rebuild(sds, 1, Cons(bindings, body))
+    elif head is DO and length >= 3:
+        names = binding_names(sds.cadr)
+        if names is not None:
+            inner = _extend(scope, names, True, assigned)
+            bindings = []
+            for binding in sds.cadr:
+                parts = binding.pylist
+                parts[1:2] = [_convert(part, scope, assigned) for part in parts[1:2]]
+                parts[2:] = [_convert(part, inner, assigned) for part in parts[2:]]
+                bindings.append(Cons.from_iter(parts))
+            rest = [_convert(part, inner, assigned) for part in sds.cddr]
+            return _rebuild(sds, 1, Cons.from_iter([Cons.from_iter(bindings), *rest]))
+
+    parts = sds.pylist
+    new_parts = [_convert(part, scope, assigned) for part in parts]
+    if all(new is old for new, old in zip(new_parts, parts)):
+        return sds
+    return Cons.from_iter(new_parts)
+
+
+def _convert_lambda(sds, scope, assigned):
+    inner = _extend(scope, sds.cadr, True, assigned)
+    body = _convert_body(sds.cddr, inner, assigned)
+    converted = _rebuild(sds, 2, body)
+    if scope is None:
+        return converted
+
+    captured = free_variables(converted) & scope.keys()
+    if not captured:
+        return Cons(HOISTED_LAMBDA, converted.cdr)
+    if all(scope[var] for var in captured):
+        captured = Cons.from_iter(sorted(captured, key=lambda var: var.name))
+        return Cons(FLAT_LAMBDA, Cons(captured, converted.cdr))
+    return converted
+
+
+def _convert_body(body, scope, assigned):
+    scope = _extend(scope, defined_names(body), False, assigned)
+    return _convert_all(body, scope, assigned)
+
+
+def _convert_all(exprs, scope, assigned):
+    exprs_list = exprs.pylist
+    converted = [_convert(expr, scope, assigned) for expr in exprs_list]
+    if all(new is old for new, old in zip(converted, exprs_list)):
+        return exprs
+    return Cons.from_iter(converted)
+
+
+def _convert_inits(bindings, scope, assigned):
+    """Converts the initializers of the let @bindings in @scope."""
+    converted = [Cons(binding.car, _convert_all(binding.cdr, scope, assigned))
+                 for binding in bindings]
+    if all(new.cdr is old.cdr for new, old in zip(converted, bindings)):
+        return bindings
+    return Cons.from_iter(converted)
+
+
+def _extend(scope, names, copyable, assigned):
+    result = {} if scope is None else dict(scope)
+    for name in names:
+        result[name] = copyable and name not in assigned
+    return result
+
+
+def _rebuild(sds, n, rest):
+    """Returns @sds with it's elements after the first @n replaced by the list
+    @rest, or @sds itself if they are the same."""
+    old = sds.nthcdr(n)
+    if rest is old or (len(rest) == len(old)
+                       and all(x is y for x, y in zip(rest, old))):
+        return sds
+    return Cons.from_iter([*sds.pylist[:n], *rest])
+
+
+# the maximum size (see inline_size) of the bodies of inlined procedures
+INLINE_BUDGET = 40
+
+# forms which may not occur in the bodies of inlined procedures, since they
+# bind variables
+BINDING_FORMS = {LAMBDA, HOISTED_LAMBDA, FLAT_LAMBDA, DEFINE, DEFINE_MEMOIZED,
+                 SET, LET, LETSTAR, LETREC, DO}
+
+
+def inline_calls(sds, table):
+    """Returns the top-level form @sds with the calls of small top-level
+    procedures replaced by %inline forms. @table maps the names of the
+    procedures which can be inlined to pairs (params, body) and is updated
+    with the definitions in @sds (including the ones in top-level begins), so
+    that later forms can inline them. The expansion is used only if the
+    variable still refers to the same procedure when the call is made, so
+    redefining a procedure in some other way is safe."""
+    return _inline_toplevel(sds, table, assigned_variables(sds))
+
+
+def _inline_toplevel(sds, table, assigned):
+    if is_form(sds, BEGIN):
+        parts = [BEGIN]
+        parts.extend(_inline_toplevel(part, table, assigned) for part in sds.cdr)
+        if all(new is old for new, old in zip(parts[1:], sds.cdr)):
+            return sds
+        return Cons.from_iter(parts)
+
+    result = _inline(sds, table, frozenset(), assigned)
+    record_definition(result, table)
+    return result
+
+
+def record_definition(sds, table):
+    """Updates @table according to the top-level form @sds."""
+
+    if is_form(sds, SET, 3):
+        table.pop(sds.cadr, None)
+        return
+    if not (is_form(sds, DEFINE, 3) or is_form(sds, DEFINE_MEMOIZED, 3)):
+        return
+
+    target = sds.cadr
+    if type(target) is Cons:
+        var, params, body = target.car, target.cdr, sds.cddr
+    elif len(sds) == 3 and is_form(sds.caddr, LAMBDA, 3):
+        var, params, body = target, sds.caddr.cadr, sds.caddr.cddr
+    else:
+        table.pop(target, None)
+        return
+
+    if sds.car is DEFINE and is_inlinable(var, params, body):
+        table[var] = (params, body)
+    else:
+        table.pop(var, None)
+
+
+def is_inlinable(var, params, body):
+    """Returns True if the procedure named @var with parameters @params and
+    body @body may be inlined: it must be small, not refer to itself and not
+    bind variables."""
+
+    names = param_names(params)
+    if names is None or len(set(names)) != len(names):
+        return False
+    if inline_size(body) > INLINE_BUDGET:
+        return False
+
+    stack = [body]
+    while stack:
+        sds = stack.pop()
+        if sds is var:
+            return False
+        if type(sds) is not Cons or sds.car is QUOTE:
+            continue
+        if sds.car in BINDING_FORMS or sds.car in CLOSURE_FORMS:
+            return False
+        while type(sds) is Cons:
+            stack.append(sds.car)
+            sds = sds.cdr
+        stack.append(sds)
+    return True
+
+
+def inline_size(sds):
+    """Returns the number of pairs and atoms in @sds. Only the expansions of
+    %inline forms are counted."""
+    size, stack = 0, [sds]
+    while stack:
+        sds = stack.pop()
+        if (type(sds) is Cons and sds.car is INLINE and is_list(sds)
+                and len(sds) == 5):
+            # the expansion may be an atom, like the body of (lambda (x) x)
+            stack.append(sds[3])
+            continue
+        size += 1
+        if type(sds) is Cons:
+            stack.append(sds.car)
+            stack.append(sds.cdr)
+    return size
+
+
+def _inline(sds, table, bound, assigned):
+    """@bound is the set of local variables visible at @sds (it may contain
+    more variables than that)."""
+
+    if type(sds) is not Cons or not is_list(sds) or sds.car is QUOTE:
+        return sds
+
+    head = sds.car
+    if head is INLINE:
+        return sds
+    if type(head) is Symbol and head in table and head not in bound:
+        inlined = _inline_call(sds, table, bound, assigned)
+        if inlined is not None:
+            return inlined
+
+    names = local_names(sds)
+    inner = bound if names is None else bound.union(names)
+    parts = sds.pylist
+    start = 2 if head in (DEFINE, DEFINE_MEMOIZED) else 0
+    new_parts = parts[:start] + [_inline(part, table, inner, assigned)
+                                 for part in parts[start:]]
+    if all(new is old for new, old in zip(new_parts, parts)):
+        return sds
+    return Cons.from_iter(new_parts)
+
+
+def _inline_call(call, table, bound, assigned):
+    """Returns the %inline form for the application @call of a procedure in
+    @table, or None if it can not be inlined here."""
+
+    var, args = call.car, call.cdr.pylist
+    params, body = table[var]
+    names = param_names(params)
+    if len(names) != len(args):
+        return None
+    if (body_free_variables(body) - set(names)) & bound:
+        # a local variable at the call site shadows a global of the body
+        return None
+
+    args = [_inline(arg, table, bound, assigned) for arg in args]
+    substitutions = {name: arg for name, arg in zip(names, args)
+                     if type(arg) in (Number, String, Boolean)
+                     or type(arg) is Symbol and arg in bound
+                     and arg not in assigned}
+    # The parameters which are not substituted are bound by a let around the
+    # body, where they would capture substituted arguments of the same name.
+    # substitute replaces all parameters in one pass, so other arguments
+    # naming parameters (like x in (square x) for the parameter x) are fine.
+    while True:
+        let_bound = set(names) - set(substitutions)
+        captured = [name for name, arg in substitutions.items()
+                    if arg in let_bound]
+        if not captured:
+            break
+        for name in captured:
+            del substitutions[name]
+    bindings = [Cons.from_iter([name, arg]) for name, arg in zip(names, args)
+                if name not in substitutions]
+
+    expansion = body.car if body.cdr is nil else Cons(BEGIN, body)
+    expansion = substitute(expansion, substitutions)
+    if bindings:
+        expansion = Cons.from_iter([LET, Cons.from_iter(bindings), expansion])
+    return Cons.from_iter([INLINE, var, params, expansion,
+                           Cons(var, Cons.from_iter(args))])
+
+
+def substitute(sds, substitutions):
+    """Returns @sds with the variables which are keys of @substitutions replaced
+    by their values. @sds must not bind variables."""
+
+    if type(sds) is Symbol:
+        return substitutions.get(sds, sds)
+    if type(sds) is not Cons or not is_list(sds) or sds.car is QUOTE:
+        return sds
+    parts = sds.pylist
+    start = 3 if sds.car is INLINE else 0
+    new_parts = parts[:start] + [substitute(part, substitutions)
+                                 for part in parts[start:]]
+    if all(new is old for new, old in zip(new_parts, parts)):
+        return sds
+    return Cons.from_iter(new_parts)
+
+
+def local_names(sds):
+    """Returns the list of variables which the form @sds binds for it's
+    subexpressions, or None if it binds none. For let forms the variables are
+    included even though they are not visible in the initializers, so the
+    result may be too big, but is never too small."""
+
+    head, length = sds.car, len(sds)
+    if head in (LAMBDA, HOISTED_LAMBDA) and length >= 3:
+        params, body = param_names(sds.cadr), sds.cddr
+    elif head is FLAT_LAMBDA and length >= 4:
+        params, body = param_names(sds.caddr), sds.nthcdr(3)
+    elif head in (DEFINE, DEFINE_MEMOIZED) and length >= 3 and type(sds.cadr) is Cons:
+        params, body = param_names(sds.cadr), sds.cddr
+    elif head is LET and length >= 4 and type(sds.cadr) is Symbol:
+        params, body = binding_names(sds.caddr), sds.nthcdr(3)
+        if params is not None:
+            params.append(sds.cadr)
+    elif head in (LET, LETSTAR, LETREC) and length >= 3:
+        params, body = binding_names(sds.cadr), sds.cddr
+    elif head is DO and length >= 3:
+        params, body = binding_names(sds.cadr), nil
+    else:
+        return None
+    if params is None:
+        return None
+    return params + list(defined_names(body))
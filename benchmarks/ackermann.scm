@@ -0,0 +1,8 @@
+; Ackermann function: mixes tail and non-tail calls.
+
+(define (ack m n)
+  (cond ((= m 0) (+ n 1))
+        ((= n 0) (ack (- m 1) 1))
+        (else (ack (- m 1) (ack m (- n 1))))))
+
+(ack 2 60) ; => 123
@@ -0,0 +1,51 @@
+; Symbolic differentiation in the style of SICP section 2.3.2.
+
+(define (variable? x) (symbol? x))
+
+(define (same-variable? v1 v2)
+  (and (variable? v1) (variable? v2) (eq? v1 v2)))
+
+(define (sum? x) (and (pair? x) (eq? (car x) '+)))
+(define (product? x) (and (pair? x) (eq? (car x) '*)))
+(define (addend s) (car (cdr s)))
+(define (augend s) (car (cdr (cdr s))))
+(define (multiplier p) (car (cdr p)))
+(define (multiplicand p) (car (cdr (cdr p))))
+
+(define (make-sum a1 a2)
+  (cond ((and (number? a1) (= a1 0)) a2)
+        ((and (number? a2) (= a2 0)) a1)
+        ((and (number? a1) (number? a2)) (+ a1 a2))
+        (else (list '+ a1 a2))))
+
+(define (make-product m1 m2)
+  (cond ((or (and (number? m1) (= m1 0))
+             (and (number? m2) (= m2 0)))
+         0)
+        ((and (number? m1) (= m1 1)) m2)
+        ((and (number? m2) (= m2 1)) m1)
+        ((and (number? m1) (number? m2)) (* m1 m2))
+        (else (list '* m1 m2))))
+
+(define (deriv exp var)
+  (cond ((number? exp) 0)
+        ((variable? exp) (if (same-variable? exp var) 1 0))
+        ((sum? exp) (make-sum (deriv (addend exp) var)
+                              (deriv (augend exp) var)))
+        ((product? exp)
+         (make-sum (make-product (multiplier exp)
+                                 (deriv (multiplicand exp) var))
+                   (make-product (deriv (multiplier exp) var)
+                                 (multiplicand exp))))
+        (else 'unknown)))
+
+(define expression
+  '(+ (* 3 (* x x)) (+ (* a (* x (* x x))) (+ (* b x) (* x (* y (+ x 5)))))))
+
+(define (repeat n)
+  (if (= n 1)
+      (deriv expression 'x)
+      (begin (deriv expression 'x)
+             (repeat (- n 1)))))
+
+(repeat 100) ; => (+ (* 3 (+ x x)) (+ (* a (+ (* x (+ x x)) (* x x))) (+ b (+ (* x y) (* y (+ x 5))))))
@@ -0,0 +1,8 @@
+; Doubly recursive Fibonacci: dominated by non-tail procedure calls.
+
+(define (fib n)
+  (if (< n 2)
+      n
+      (+ (fib (- n 1)) (fib (- n 2)))))
+
+(fib 18) ; => 2584
@@ -0,0 +1,12 @@
+; map, filter and foldl over a long list.
+
+(define (interval a b)
+  (define (iter k acc)
+    (if (< k a)
+        acc
+        (iter (- k 1) (cons k acc))))
+  (iter b nil))
+
+(define numbers (interval 1 10000))
+
+(foldl + 0 (filter even? (map (lambda (x) (* x x)) (map add1 numbers)))) ; => 166716670000
@@ -0,0 +1,32 @@
+; Counts the solutions of the n-queens problem by backtracking over lists.
+
+(define (interval a b)
+  (if (> a b)
+      nil
+      (cons a (interval (+ a 1) b))))
+
+(define (ok? row dist placed)
+  (if (null? placed)
+      #t
+      (and (not (= (car placed) (+ row dist)))
+           (not (= (car placed) (- row dist)))
+           (not (= (car placed) row))
+           (ok? row (+ dist 1) (cdr placed)))))
+
+(define (try-rows rows placed n)
+  (if (null? rows)
+      0
+      (+ (if (ok? (car rows) 1 placed)
+             (place (cons (car rows) placed) n)
+             0)
+         (try-rows (cdr rows) placed n))))
+
+(define (place placed n)
+  (if (= (length placed) n)
+      1
+      (try-rows (interval 1 n) placed n)))
+
+(define (length lst)
+  (foldl (lambda (x acc) (+ acc 1)) 0 lst))
+
+(place nil 6) ; => 4
@@ -0,0 +1,20 @@
+; Sieve of Eratosthenes over lists, built from filter.
+
+(define (interval a b)
+  (define (iter k acc)
+    (if (< k a)
+        acc
+        (iter (- k 1) (cons k acc))))
+  (iter b nil))
+
+(define (sieve numbers)
+  (if (null? numbers)
+      nil
+      (cons (car numbers)
+            (sieve (filter (lambda (n) (not (= (remainder n (car numbers)) 0)))
+                           (cdr numbers))))))
+
+(define (count lst)
+  (foldl (lambda (x acc) (+ acc 1)) 0 lst))
+
+(count (sieve (interval 2 1000))) ; => 168
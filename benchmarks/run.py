@@ -0,0 +1,173 @@
+"""
+Runs the Scheme benchmarks in this directory and compares them against a
+stored baseline.
+
+Every benchmark is a .scm file whose last top-level expression is the
+workload. If the last line of the file contains a comment of the form
+"; => <value>", the printed representation of the result is checked against
+<value>. For every benchmark the wall time (the best of several runs), the
+number of steps executed by the interpreter and the peak memory allocated
+during a run are reported.
+
+usage:
+  python benchmarks/run.py                  # run everything, compare to baseline
+  python benchmarks/run.py fib tak          # run only some benchmarks
+  python benchmarks/run.py --save           # store the results as the baseline
+  python benchmarks/run.py --threshold 0.2  # tolerate 20% slowdowns
+
+The exit status is 1 if a benchmark regressed by more than the threshold or
+returned a wrong result, and 0 otherwise.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from interpreter import Interpreter
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+# the measurements compared against the baseline
+METRICS = ('time', 'steps', 'peak_memory')
+
+
+def benchmark_names():
+    return sorted(name[:-len('.scm')] for name in os.listdir(BENCH_DIR)
+                  if name.endswith('.scm'))
+
+
+def expected_value(path):
+    """Returns the expected printed result of the benchmark at @path, or None
+    if the file does not specify one."""
+
+    with open(path) as f:
+        lines = f.read().rstrip().splitlines()
+    marker = '; =>'
+    if not lines or marker not in lines[-1]:
+        return None
+    return lines[-1].split(marker, 1)[1].strip()
+
+
+def run_once(path, mode):
+    """Runs the benchmark at @path in a fresh interpreter. Returns a pair (value,
+    interpreter). In "ifile" mode the statistics of the interpreter describe
+    the whole file, in "istr_all" mode only the last expression."""
+
+    inter = Interpreter()
+    if mode == 'ifile':
+        value = inter.ifile(path)
+    else:
+        with open(path) as f:
+            value = inter.istr_all(f.read())[-1]
+    return value, inter
+
+
+def measure(name, mode, repeat):
+    path = os.path.join(BENCH_DIR, f'{name}.scm')
+
+    best = None
+    for k in range(repeat):
+        start = time.perf_counter()
+        value, inter = run_once(path, mode)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        run_once(path, mode)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    expected = expected_value(path)
+    return {'time': best,
+            'steps': inter.stats.steps,
+            'peak_memory': peak_memory,
+            'correct': expected is None or str(value) == expected,
+            'value': str(value)}
+
+
+def regressions(result, base, threshold):
+    """Returns the list of metrics in which @result is worse than @base by more
+    than @threshold (a fraction)."""
+
+    return [metric for metric in METRICS
+            if metric in base and result[metric] > base[metric] * (1 + threshold)]
+
+
+def format_change(value, base):
+    if not base:
+        return ''
+    return f'{(value - base) / base:+.1%}'
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description='Runs the Scheme benchmarks.')
+    argparser.add_argument('names', nargs='*',
+                           help='the benchmarks to run (default: all of them)')
+    argparser.add_argument('--mode', choices=('ifile', 'istr_all'),
+                           default='ifile',
+                           help='how the benchmark files are evaluated')
+    argparser.add_argument('--repeat', type=int, default=3,
+                           help='the number of timed runs of each benchmark')
+    argparser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                           help='the file holding the baseline results')
+    argparser.add_argument('--threshold', type=float, default=0.10,
+                           help='the tolerated relative slowdown (default 0.10)')
+    argparser.add_argument('--save', action='store_true',
+                           help='store the results as the new baseline')
+    args = argparser.parse_args(argv)
+
+    names = args.names or benchmark_names()
+    unknown = set(names) - set(benchmark_names())
+    if unknown:
+        argparser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    failed = False
+    results = {}
+    print(f'{"benchmark":<12}{"time (s)":>10}{"":>9}{"steps":>11}{"":>9}'
+          f'{"peak mem":>12}{"":>9}')
+    for name in names:
+        result = measure(name, args.mode, args.repeat)
+        results[name] = {metric: result[metric] for metric in METRICS}
+        base = baseline.get(name, {})
+
+        flags = []
+        if not result['correct']:
+            flags.append(f'WRONG RESULT: {result["value"]}')
+        worse = regressions(result, base, args.threshold)
+        if worse:
+            flags.append(f'REGRESSION: {", ".join(worse)}')
+        failed = failed or bool(flags)
+
+        print(f'{name:<12}'
+              f'{result["time"]:>10.3f}'
+              f'{format_change(result["time"], base.get("time")):>9}'
+              f'{result["steps"]:>11}'
+              f'{format_change(result["steps"], base.get("steps")):>9}'
+              f'{result["peak_memory"]:>12}'
+              f'{format_change(result["peak_memory"], base.get("peak_memory")):>9}'
+              f'  {" ".join(flags)}')
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'baseline saved to {args.baseline}')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,25 @@
+; Builds a report of many lines, both through a string port and through
+; repeated string-append.
+
+(define (report-line k)
+  (string-append "item " (number->string k) ": "
+                 (number->string (* k k)) "\n"))
+
+(define (port-report n)
+  (define port (open-output-string))
+  (define (iter k)
+    (if (> k n)
+        (get-output-string port)
+        (begin (write-string (report-line k) port)
+               (iter (+ k 1)))))
+  (iter 1))
+
+(define (append-report n)
+  (define (iter k acc)
+    (if (> k n)
+        acc
+        (iter (+ k 1) (string-append acc (report-line k)))))
+  (iter 1 ""))
+
+(= (string-length (port-report 3000))
+   (string-length (append-report 3000))) ; => #t
@@ -6,8 +6,11 @@ compiling lists with predetermined Symbol heads and compile just dispatches to
 these functions based on the first element of the list to compile.
 """
 
+import os
+
 import exprs
 import stypes
+import analysis
 
 from stypes import *
 from validator import isvalid
@@ -17,7 +20,9 @@ from validator import isvalid
 handlers = {}
 
 def handler(symname):
-    symbol = Symbol(symname)    
+    """@symname is the name of the head symbol, or the symbol itself for
+    internal forms whose head is an uninterned symbol."""
+    symbol = symname if type(symname) is Symbol else Symbol(symname)
     def decorator(func):
         handlers[symbol] = func
         return func    
@@ -47,9 +52,7 @@ def compile_definition(slist):
     funcscm = [('symbol', 'define'), ['rest+', 'symbol'], 'rest+', 'any']
     if isvalid(varscm, slist):
         var, subexpr = slist.extract(1, 2)
-        compiled = (compile_lambda(subexpr, var)
-                    if type(subexpr) is Cons and subexpr.car == Symbol('lambda')
-                    else compile(subexpr))        
+        compiled = compile_procedure(subexpr, var)
     elif isvalid(funcscm, slist):
         var, params, body = slist[1][0], slist[1].cdr, slist.nthcdr(2)
         lexpr = Cons(Symbol('lambda'), Cons(params, body))
@@ -59,6 +62,20 @@ def compile_definition(slist):
     return exprs.DefinitionExpr(var, compiled)
 
 
+@handler('define-memoized')
+def compile_memoized_definition(slist):
+    """(define-memoized (name params...) body...) is compiled like
+    (define name (memoize (lambda (params...) body...)))."""
+    scm = [('symbol', 'define-memoized'), ['rest+', 'symbol'], 'rest+', 'any']
+    if not isvalid(scm, slist):
+        raise ValueError(f'Invalid define-memoized expression: {slist}')
+    var, params, body = slist[1][0], slist[1].cdr, slist.nthcdr(2)
+    lexpr = Cons(Symbol('lambda'), Cons(params, body))
+    memoized = exprs.ApplicationExpr([exprs.VariableExpr(Symbol('memoize')),
+                                      compile_lambda(lexpr, var)])
+    return exprs.DefinitionExpr(var, memoized)
+
+
 @handler('if')
 def compile_if(slist):
     if isvalid([('symbol', 'if'), 'any', 'any', 'any'], slist):
@@ -71,27 +88,175 @@ def compile_if(slist):
 @handler('lambda')
 def compile_lambda(slist, var=None):
     """(var) must be a Symbol or None. It is used as the name of the function
-    being created."""
+    being created. Calls of (var) in tail position of the body become jumps to
+    the beginning of the body (see exprs.SelfCallExpr). The body is compiled
+    lazily, when a procedure created by the lambda is first called, so errors
+    in it are raised then."""
     scm = [('symbol', 'lambda'), ['rest', 'symbol'], 'rest+', 'any']
     if not isvalid(scm, slist):
         raise ValueError(f'Invalid lambda expression: {slist}')
     params, body = slist[1], slist.nthcdr(2)
-    compiled = [compile(sub) for sub in body]
-    return exprs.LambdaExpr(params, compiled, var)
+
+    def compile_body():
+        marked = body
+        if var is not None and var not in params:
+            marked = mark_self_calls(body, var, params)
+        return [compile(sub) for sub in marked]
+
+    return exprs.LambdaExpr(params, compile_body, var)
+
+
+@handler(analysis.HOISTED_LAMBDA)
+def compile_hoisted_lambda(slist, var=None):
+    lexpr = Cons(Symbol('lambda'), slist.cdr)
+    return exprs.HoistedLambdaExpr(compile_lambda(lexpr, var))
+
+
+@handler(analysis.FLAT_LAMBDA)
+def compile_flat_lambda(slist, var=None):
+    lexpr = Cons(Symbol('lambda'), slist.cddr)
+    return exprs.FlatLambdaExpr(list(slist[1]), compile_lambda(lexpr, var))
+
+
+def compile_procedure(sds, var):
+    """Compiles @sds. If it is a lambda expression, @var is used as the name
+    of the procedure it creates."""
+    lambda_heads = (Symbol('lambda'), analysis.HOISTED_LAMBDA,
+                    analysis.FLAT_LAMBDA)
+    if type(sds) is Cons and sds.car in lambda_heads:
+        return handlers[sds.car](sds, var)
+    return compile(sds)
+
+
+@handler('delay')
+def compile_delay(slist):
+    scm = [('symbol', 'delay'), 'any']
+    if not isvalid(scm, slist):
+        raise ValueError(f'Invalid delay expression: {slist}')
+    lexpr = Cons.from_iter([Symbol('lambda'), nil, slist.cadr])
+    return exprs.DelayExpr(compile_lambda(lexpr))
+
+
+@handler('cons-stream')
+def compile_cons_stream(slist):
+    """(cons-stream a b) is compiled like (cons a (delay b))."""
+    scm = [('symbol', 'cons-stream'), 'any', 'any']
+    if not isvalid(scm, slist):
+        raise ValueError(f'Invalid cons-stream expression: {slist}')
+    delayed = Cons.from_iter([Symbol('delay'), slist.caddr])
+    return exprs.ApplicationExpr([exprs.VariableExpr(Symbol('cons')),
+                                  compile(slist.cadr), compile_delay(delayed)])
 
 
 @handler('let')
 def compile_let(slist):
-    """Transforms the let to a lambda application and compiles that."""    
+    """The body of the let is evaluated in a new environment in the current
+    frame, without creating a procedure."""
     scm = [('symbol', 'let'), ['rest', ['symbol', 'any']], 'rest+', 'any']
+    namedscm = [('symbol', 'let'), 'symbol',
+                ['rest', ['symbol', 'any']], 'rest+', 'any']
+    if isvalid(namedscm, slist):
+        return compile_named_let(slist)
     if not isvalid(scm, slist):
         raise ValueError(f'Invalid let expression: {slist}')
     bindings, body = slist[1], slist.nthcdr(2)
+    params = [b[0] for b in bindings]
+    inits = [compile(b[1]) for b in bindings]
+    return exprs.LetExpr(params, inits, [compile(sub) for sub in body])
+
+
+def compile_named_let(slist):
+    """Calls of the let's name in tail position of it's body become jumps to
+    the beginning of the body (see exprs.SelfCallExpr)."""
+    var, bindings, body = slist[1], slist[2], slist.nthcdr(3)
     params = Cons.from_iter(b[0] for b in bindings)
-    args = Cons.from_iter(b[1] for b in bindings)    
-    lambda_expr = Cons(Symbol('lambda'), Cons(params, body))
-    app = Cons(lambda_expr, args)
-    return compile_application(app)
+    inits = [compile(b[1]) for b in bindings]
+    if var not in params:
+        body = mark_self_calls(body, var, params)
+    return exprs.NamedLetExpr(var, params, inits, [compile(sub) for sub in body])
+
+
+@handler('let*')
+def compile_let_star(slist):
+    """Transforms the let* to nested lets and compiles that."""
+    scm = [('symbol', 'let*'), ['rest', ['symbol', 'any']], 'rest+', 'any']
+    if not isvalid(scm, slist):
+        raise ValueError(f'Invalid let* expression: {slist}')
+    bindings, body = slist[1], slist.nthcdr(2)
+    if bindings is nil or bindings.cdr is nil:
+        return compile(Cons(Symbol('let'), slist.cdr))
+    inner = Cons(Symbol('let*'), Cons(bindings.cdr, body))
+    return compile(Cons.from_iter([Symbol('let'), Cons(bindings.car, nil), inner]))
+
+
+@handler('letrec')
+def compile_letrec(slist):
+    scm = [('symbol', 'letrec'), ['rest', ['symbol', 'any']], 'rest+', 'any']
+    if not isvalid(scm, slist):
+        raise ValueError(f'Invalid letrec expression: {slist}')
+    bindings, body = slist[1], slist.nthcdr(2)
+    params = [b[0] for b in bindings]
+    inits = [compile_procedure(b[1], b[0]) for b in bindings]
+    return exprs.LetrecExpr(params, inits, [compile(sub) for sub in body])
+
+
+@handler('do')
+def compile_do(slist):
+    scm = [('symbol', 'do'), ['rest', ['symbol', 'any', 'rest', 'any']],
+           ['any', 'rest', 'any'], 'rest', 'any']
+    if not isvalid(scm, slist) or any(len(b) > 3 for b in slist[1]):
+        raise ValueError(f'Invalid do expression: {slist}')
+    bindings, clause, body = slist[1], slist[2], slist.nthcdr(3)
+    params = [b[0] for b in bindings]
+    inits = [compile(b[1]) for b in bindings]
+    steps = [compile(b[2]) if len(b) == 3 else None for b in bindings]
+    reuse = not analysis.creates_closures(slist)
+    return exprs.DoExpr(params, inits, steps, compile(clause.car),
+                        [compile(expr) for expr in clause.cdr],
+                        [compile(expr) for expr in body], reuse)
+
+
+# the head of the internal form (%self-call params reuse var operands...) which
+# stands for a call of @var in tail position of the body of a procedure with
+# parameters @params. See exprs.SelfCallExpr.
+SELF_CALL = Symbol.uninterned('%self-call')
+
+
+def mark_self_calls(body, var, params):
+    """Returns @body with the calls of @var in tail position replaced by
+    %self-call forms."""
+    reuse = Boolean(not analysis.creates_closures(body))
+    return analysis.replace_tail_calls(
+        body, var, lambda call: Cons(SELF_CALL, Cons(params, Cons(reuse, call))))
+
+
+@handler(SELF_CALL)
+def compile_self_call(slist):
+    params, reuse, var, operands = slist[1], slist[2], slist[3], slist.nthcdr(4)
+    return exprs.SelfCallExpr(var, params, bool(reuse),
+                              [compile(operand) for operand in operands])
+
+
+@handler(analysis.INLINE)
+def compile_inline(slist):
+    var, params, expansion, call = slist.extract(1, 2, 3, 4)
+    return exprs.InlineExpr(var, params, compile(expansion), compile(call))
+
+
+@handler('import')
+def compile_import(slist):
+    """Relative paths are relative to the current directory. In module files
+    they are made relative to the module's directory by the modules module
+    before compilation."""
+    scm = [('symbol', 'import'), 'string']
+    if not isvalid(scm, slist):
+        raise ValueError(f'Invalid import expression: {slist}')
+    return exprs.ImportExpr(os.path.abspath(slist.cadr.chars))
+
+
+@handler('define-module')
+def compile_define_module(slist):
+    raise ValueError('define-module can only be the only form of a module file')
 
 
 @handler('begin')
@@ -161,3 +326,14 @@ def compile(sds):
 
     return compile_application(sds)
 
+
+
+def compile_toplevel(sds, inline_table=None):
+    """Like compile, but for a whole top-level form. Analyses which need to see
+    the scopes enclosing an expression are applied first. If @inline_table is
+    given, calls of the small procedures defined by earlier top-level forms
+    are inlined (see analysis.inline_calls) and the table is updated with the
+    definitions in @sds."""
+    if inline_table is not None:
+        sds = analysis.inline_calls(sds, inline_table)
+    return compile(analysis.convert_closures(sds))
@@ -1,4 +1,17 @@
 class Environment:
+    """
+    * class attributes
+    - Environment.allocated: the number of environments created so far by the
+      process. Used by the interpreter to count the environments allocated
+      during an evaluation.
+    * attributes
+    - self.is_module: True for the environments of modules (see modules.py),
+      which hold the top-level definitions of the module
+    """
+
+    allocated = 0
+    is_module = False
+    
     def __init__(self, variables, values, parent):
         """
         @variables must be an iterable of variables
@@ -6,6 +19,7 @@ class Environment:
         @parent must be an Environment or None
         """
         
+        Environment.allocated += 1
         self.namespace = dict(zip(variables, values))
         self.parent = parent
 
@@ -15,6 +29,7 @@ class Environment:
         @dct must be a dict mapping symbols to scheme values.
         @parent must be an Environment or None.
         """
+        Environment.allocated += 1
         result = Environment.__new__(Environment)
         result.namespace = dct.copy()
         result.parent = parent
@@ -50,6 +65,14 @@ class Environment:
             yield current_env
             current_env = current_env.parent
     
+    def top(self):
+        """Returns the environment of the top-level definitions visible in
+        @self: the closest module environment, or the global environment."""
+        env = self
+        while env.parent is not None and not env.is_module:
+            env = env.parent
+        return env
+
     def first_namespace_that_binds_the_var(self, var):
         for current_env in self:
             if var in current_env.namespace:
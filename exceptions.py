@@ -9,3 +9,27 @@ class SchemeArityError(SchemeException):
 
 class SchemeTypeError(SchemeException):
     pass
+
+
+class SchemeKeyError(SchemeException):
+    pass
+
+
+class SchemeTimeoutError(SchemeException):
+    pass
+
+
+class SchemeFileError(SchemeException):
+    pass
+
+
+class SchemeMemoryError(SchemeException):
+    pass
+
+
+class SchemeRecursionError(SchemeException):
+    pass
+
+
+class SchemeZeroDivisionError(SchemeException):
+    pass
@@ -1,4 +1,5 @@
 import stypes
+import modules
 import steptools
 
 from frame import Frame
@@ -8,13 +9,18 @@ from environment import Environment
 
 class Expr:
     """Base class for all expressions.
+    * class attributes of subclasses
+    - fields: the names of the attributes which hold the arguments of the
+      constructor, in order. The image module rebuilds expressions from them.
     * attributes for instances of subclasses
     - self.main_step: a callable which accepts a single interpreter argument. It
       should be evaluatable an arbitrary number of times."""
-    pass
+    fields = ()
 
 
 class SelfEvaluatingExpr(Expr):
+    fields = ('value',)
+
     def __init__(self, value):
         self.value = value
         self.main_step = steptools.Identity(value)
@@ -24,6 +30,8 @@ class SelfEvaluatingExpr(Expr):
 
     
 class QuoteExpr(Expr):
+    fields = ('slist',)
+
     def __init__(self, slist):
         self.slist = slist
         self.main_step = steptools.Identity(slist)
@@ -33,6 +41,8 @@ class QuoteExpr(Expr):
 
     
 class VariableExpr(Expr):
+    fields = ('var',)
+
     def __init__(self, var):
         self.var = var
         self.main_step = lambda inter: inter.env.lookup(self.var)
@@ -42,6 +52,8 @@ class VariableExpr(Expr):
 
         
 class AssignmentExpr(Expr):
+    fields = ('var', 'subexpr')
+
     def __init__(self, var, subexpr):
         self.var = var
         self.subexpr = subexpr
@@ -65,6 +77,8 @@ class AssignmentExpr(Expr):
 
     
 class DefinitionExpr(Expr):
+    fields = ('var', 'subexpr')
+
     def __init__(self, var, subexpr):
         self.var = var
         self.subexpr = subexpr
@@ -88,6 +102,8 @@ class DefinitionExpr(Expr):
 
     
 class IfExpr(Expr):
+    fields = ('predicate', 'consequent', 'alternative')
+
     def __init__(self, predicate, consequent, alternative=None):
         self.predicate = predicate
         self.consequent = consequent
@@ -121,27 +137,490 @@ class IfExpr(Expr):
 
     
 class LambdaExpr(Expr):
+    fields = ('params', 'body', 'var')
+
     def __init__(self, params, body, var=None):
         """(params) must be a sequence of variables. (body) must be a sequence
-        of expressions. (var) must be either None or a Symbol."""
+        of expressions, or a function without arguments which returns one. In
+        the latter case the body is compiled lazily: the function is called
+        the first time the body is needed, usually by the first call of a
+        procedure created by the expression. Until then self.body_step is a
+        steptools.LazyStep. (var) must be either None or a Symbol."""
         self.params = params
-        self.body = body
+        self.var = var
         self.funcname = None if var is None else String(var.name)
-        self.main_step = self._create_main_step(params, body, self.funcname)
+        self.jit_factory = None # set by the jit module
+        if callable(body):
+            self._body, self._compile = None, body
+            self.body_step = steptools.LazyStep(self)
+        else:
+            self._body, self._compile = body, None
+            self.body_step = BeginExpr(body).main_step
+        self.main_step = self._create_main_step(self)
+
+    @property
+    def body(self):
+        """The list of the Exprs of the body, which is compiled if it is not
+        yet."""
+        if self._body is None:
+            self.compile_body()
+        return self._body
+
+    def compile_body(self):
+        """Compiles the body if it is not compiled yet. Returns the step which
+        evaluates it."""
+        if self._body is None:
+            body = self._compile()
+            self.body_step = BeginExpr(body).main_step
+            self._body, self._compile = body, None
+        return self.body_step
 
     @staticmethod
-    def _create_main_step(params, body, funcname):
-        compiled_body = BeginExpr(body).main_step
+    def _create_main_step(lambda_expr):
+        # the body step is read at every evaluation, since it changes when
+        # the body is compiled
+        params, funcname = lambda_expr.params, lambda_expr.funcname
         return (lambda inter:
-                CompoundProcedure(params, compiled_body, inter.env, funcname))
+                CompoundProcedure(params, lambda_expr.body_step, inter.env,
+                                  funcname, lambda_expr))
 
     def __str__(self):
         params_str = f"({' '.join(str(param) for param in self.params)})"
         body_str = ' '.join(str(expr) for expr in self.body)
         return f'(lambda {params_str} {body_str})'
 
+
+class HoistedLambdaExpr(Expr):
+    fields = ('lambda_expr',)
+
+    def __init__(self, lambda_expr):
+        """A lambda expression without free local variables. The procedure is
+        created in the top-level environment (see Environment.top) the first
+        time the expression is evaluated and the same procedure is the value
+        of every later evaluation in that environment."""
+        self.lambda_expr = lambda_expr
+        self.main_step = self._create_main_step(lambda_expr)
+
+    @staticmethod
+    def _create_main_step(lambda_expr):
+        params, funcname = lambda_expr.params, lambda_expr.funcname
+        # holds a single (top-level environment, procedure) tuple, replaced as
+        # a whole, so that interpreters sharing the expression in different
+        # threads never see the procedure of another environment
+        cache = [(None, None)]
+        
+        def main_step(inter):
+            top = inter.env.top()
+            entry = cache[0]
+            if entry[0] is not top:
+                entry = cache[0] = (top, CompoundProcedure(
+                    params, lambda_expr.body_step, top, funcname, lambda_expr))
+            return entry[1]
+
+        return main_step
+
+    def __str__(self):
+        return str(self.lambda_expr)
+
+
+class FlatLambdaExpr(Expr):
+    fields = ('captured', 'lambda_expr')
+
+    def __init__(self, captured, lambda_expr):
+        """A lambda expression whose free local variables (captured) are not
+        changed after it is evaluated. The procedures it creates get a small
+        environment holding only the current values of (captured), whose
+        parent is the top-level environment (see Environment.top)."""
+        self.captured = captured
+        self.lambda_expr = lambda_expr
+        self.main_step = self._create_main_step(captured, lambda_expr)
+
+    @staticmethod
+    def _create_main_step(captured, lambda_expr):
+        params, funcname = lambda_expr.params, lambda_expr.funcname
+        
+        def main_step(inter):
+            env = inter.env
+            values = [env.lookup(var) for var in captured]
+            closure_env = Environment(captured, values, env.top())
+            return CompoundProcedure(params, lambda_expr.body_step, closure_env,
+                                     funcname, lambda_expr)
+
+        return main_step
+
+    def __str__(self):
+        return str(self.lambda_expr)
+
+    
+class DelayExpr(Expr):
+    fields = ('lambda_expr',)
+
+    def __init__(self, lambda_expr):
+        """(delay expr). (lambda_expr) is the LambdaExpr of a procedure without
+        parameters whose body is expr. The value is a Promise calling a
+        procedure created by (lambda_expr) when it is forced."""
+        self.lambda_expr = lambda_expr
+        self.main_step = self._create_main_step(lambda_expr)
+
+    @staticmethod
+    def _create_main_step(lambda_expr):
+        thunk_step = lambda_expr.main_step
+        return lambda inter: Promise(thunk_step(inter))
+
+    def __str__(self):
+        return f'(delay {self.lambda_expr.body[0]})'
+
     
+class LetExpr(Expr):
+    fields = ('params', 'inits', 'body')
+
+    def __init__(self, params, inits, body):
+        """(params) must be a sequence of variables and (inits) a sequence of
+        expressions of the same length. (body) must be a non-empty sequence of
+        expressions. The body is evaluated in a new environment which extends
+        the current one, in the same frame."""
+        self.params = list(params)
+        self.inits = list(inits)
+        self.body = body
+        self.main_step = self._create_main_step(self.params, self.inits, body)
+
+    @staticmethod
+    def _create_main_step(params, inits, body):
+        body_step = BeginExpr(body).main_step
+        init_steps = [init.main_step for init in inits]
+
+        def values_handler(inter):
+            new_env = Environment(params, inter.last_value, inter.env)
+            steptools.enter_environment(inter, new_env)
+            inter.step_stack.append(body_step)
+
+        def main_step(inter):
+            inter.step_stack.append(values_handler)
+            inter.step_stack.append(steptools.Sequencer(iter(init_steps)))
+
+        return main_step
+
+    def __str__(self):
+        bindings = ' '.join(f'({param} {init})'
+                            for param, init in zip(self.params, self.inits))
+        body_str = ' '.join(str(expr) for expr in self.body)
+        return f'(let ({bindings}) {body_str})'
+
+
+class LetrecExpr(Expr):
+    fields = ('params', 'inits', 'body')
+
+    def __init__(self, params, inits, body):
+        """Like LetExpr, except that (inits) are evaluated in the new
+        environment, so they can refer to (params)."""
+        self.params = list(params)
+        self.inits = list(inits)
+        self.body = body
+        self.main_step = self._create_main_step(self.params, self.inits, body)
+
+    @staticmethod
+    def _create_main_step(params, inits, body):
+        body_step = BeginExpr(body).main_step
+        init_steps = [init.main_step for init in inits]
+
+        def values_handler(inter):
+            namespace = inter.env.namespace
+            for param, value in zip(params, inter.last_value):
+                namespace[param] = value
+
+        def main_step(inter):
+            new_env = Environment(params, [stypes.unspecified] * len(params),
+                                  inter.env)
+            steptools.enter_environment(inter, new_env)
+            inter.step_stack.append(body_step)
+            inter.step_stack.append(values_handler)
+            inter.step_stack.append(steptools.Sequencer(iter(init_steps)))
+
+        return main_step
+
+    def __str__(self):
+        bindings = ' '.join(f'({param} {init})'
+                            for param, init in zip(self.params, self.inits))
+        body_str = ' '.join(str(expr) for expr in self.body)
+        return f'(letrec ({bindings}) {body_str})'
+
+
+class NamedLetExpr(Expr):
+    fields = ('var', 'params', 'inits', 'body')
+
+    def __init__(self, var, params, inits, body):
+        """(let var ((param init) ...) body ...) binds (var) to a procedure with
+        parameters (params) and body (body) and calls it with the values of
+        (inits). The call is made in the current frame. (params) must be a
+        scheme list of variables."""
+        self.var = var
+        self.params = params
+        self.inits = list(inits)
+        self.body = body
+        self.lambda_expr = LambdaExpr(params, body, var)
+        self.main_step = self._create_main_step(var, self.inits, self.lambda_expr)
+
+    @staticmethod
+    def _create_main_step(var, inits, lambda_expr):
+        params, body_step = lambda_expr.params, lambda_expr.body_step
+        funcname = lambda_expr.funcname
+        init_steps = [init.main_step for init in inits]
+
+        def values_handler(inter):
+            loop_env = Environment([var], [stypes.unspecified], inter.env)
+            loop_env.define_variable(
+                var, CompoundProcedure(params, body_step, loop_env, funcname,
+                                       lambda_expr))
+            new_env = Environment(params, inter.last_value, loop_env)
+            steptools.enter_environment(inter, new_env)
+            inter.step_stack.append(body_step)
+
+        def main_step(inter):
+            inter.step_stack.append(values_handler)
+            inter.step_stack.append(steptools.Sequencer(iter(init_steps)))
+
+        return main_step
+
+    def __str__(self):
+        bindings = ' '.join(f'({param} {init})' for param, init
+                            in zip(self.lambda_expr.params, self.inits))
+        body_str = ' '.join(str(expr) for expr in self.lambda_expr.body)
+        return f'(let {self.var} ({bindings}) {body_str})'
+
+
+class DoExpr(Expr):
+    fields = ('params', 'inits', 'steps', 'test', 'results', 'body', 'reuse')
+
+    def __init__(self, params, inits, steps, test, results, body, reuse):
+        """(do ((param init step) ...) (test result ...) body ...)
+        (params) and (inits) must be sequences of the same length. (steps) must
+        be a sequence of the same length whose elements are expressions or None
+        for variables without a step. (results) and (body) are (possibly
+        empty) sequences of expressions. If (reuse) is true the body creates
+        no closures, so the variables are updated in place in a single
+        environment. Otherwise each iteration gets a fresh environment."""
+        self.params = list(params)
+        self.inits = list(inits)
+        self.steps = list(steps)
+        self.test = test
+        self.results = list(results)
+        self.body = list(body)
+        self.reuse = reuse
+        self.main_step = self._create_main_step(
+            self.params, self.inits, self.steps, test, self.results, self.body,
+            reuse)
+
+    @staticmethod
+    def _create_main_step(params, inits, steps, test, results, body, reuse):
+        init_steps = [init.main_step for init in inits]
+        test_step = test.main_step
+        result_step = BeginExpr(results).main_step if results else None
+        body_step = BeginExpr(body).main_step if body else None
+        stepped = [(param, step.main_step) for param, step in zip(params, steps)
+                   if step is not None]
+        stepped_params = [param for param, step in stepped]
+        
+        def values_handler(inter):
+            env = Environment(params, inter.last_value, inter.env)
+            steptools.enter_environment(inter, env)
+            new_values = []
+
+            # The steps of one iteration, created once per loop. Per
+            # iteration only the values of the variables are allocated.
+            def collect(inter):
+                new_values.append(inter.last_value)
+
+            def update(inter):
+                nonlocal env
+                if reuse:
+                    env.namespace.update(zip(stepped_params, new_values))
+                else:
+                    namespace = dict(env.namespace)
+                    namespace.update(zip(stepped_params, new_values))
+                    env = Environment.from_dict(namespace, env.parent)
+                    inter.frame.env = env
+                new_values.clear()
+                inter.step_stack.append(test_handler)
+                inter.step_stack.append(test_step)
+
+            def test_handler(inter):
+                step_stack = inter.step_stack
+                if inter.last_value is not stypes.false:
+                    if result_step is None:
+                        return stypes.unspecified
+                    step_stack.append(result_step)
+                    return
+                step_stack.append(update)
+                for param, step in reversed(stepped):
+                    step_stack.append(collect)
+                    step_stack.append(step)
+                if body_step is not None:
+                    step_stack.append(body_step)
+
+            inter.step_stack.append(test_handler)
+            inter.step_stack.append(test_step)
+
+        def main_step(inter):
+            inter.step_stack.append(values_handler)
+            inter.step_stack.append(steptools.Sequencer(iter(init_steps)))
+
+        return main_step
+
+    def __str__(self):
+        bindings = ' '.join(
+            f'({param} {init})' if step is None else f'({param} {init} {step})'
+            for param, init, step in zip(self.params, self.inits, self.steps))
+        clause = ' '.join(str(expr) for expr in [self.test, *self.results])
+        body_str = ''.join(f' {expr}' for expr in self.body)
+        return f'(do ({bindings}) ({clause}){body_str})'
+
+
+class SelfCallExpr(Expr):
+    fields = ('var', 'params', 'reuse', 'operands')
+
+    def __init__(self, var, params, reuse, operands):
+        """A call of the variable (var) in tail position inside the body of a
+        procedure with parameters (params) (a scheme list, compared by
+        identity). If (var) is bound to such a procedure when the call is made,
+        the call is a jump: the parameters are rebound and the body is
+        restarted in the current frame. If (reuse) is true, the procedure's
+        body creates no closures, so the parameters are rebound in place
+        instead of in a new environment. Otherwise this is an ordinary
+        call."""
+        self.var = var
+        self.params = params
+        self.reuse = reuse
+        self.operands = list(operands)
+        self.main_step = self._create_main_step(var, params, reuse, self.operands)
+
+    @staticmethod
+    def _create_main_step(var, params, reuse, operands):
+        operand_steps = [operand.main_step for operand in operands]
+
+        def values_handler(inter):
+            values = inter.last_value
+            operator = inter.env.lookup(var)
+
+            call_env = None
+            if type(operator) is CompoundProcedure and operator.params is params:
+                # find the environment of the current call of operator
+                for env in inter.env:
+                    if env.parent is operator.env:
+                        call_env = env
+                        break
+
+            if call_env is None:
+                inter.step_stack.append(steptools.Caller(operator, values))
+                return
+                
+            if len(params) != len(values):
+                raise SchemeArityError(f'Expected {len(params)} arguments, '
+                                       f'but got {len(values)}.')
+            if reuse:
+                call_env.namespace.update(zip(params, values))
+            else:
+                call_env = Environment(params, values, operator.env)
+            inter.frame.env = call_env
+            inter.stats.tail_calls += 1
+            inter.step_stack.append(operator.step)
+
+        def main_step(inter):
+            inter.step_stack.append(values_handler)
+            inter.step_stack.append(steptools.Sequencer(iter(operand_steps)))
+
+        return main_step
+
+    def __str__(self):
+        return f"({self.var} {' '.join(str(expr) for expr in self.operands)})"
+
+
+class InlineExpr(Expr):
+    fields = ('var', 'params', 'expansion', 'call')
+
+    def __init__(self, var, params, expansion, call):
+        """A call of the procedure bound to (var), whose body was inlined.
+        (params) is the scheme list of the parameters of the procedure
+        (compared by identity). If (var) is still bound to that procedure, the
+        Expr (expansion) is evaluated in place of the call, without creating a
+        frame. Otherwise the ApplicationExpr (call) is."""
+        self.var = var
+        self.params = params
+        self.expansion = expansion
+        self.call = call
+        self.main_step = self._create_main_step(var, params, expansion, call)
+
+    @staticmethod
+    def _create_main_step(var, params, expansion, call):
+        expansion_step, call_step = expansion.main_step, call.main_step
+
+        def main_step(inter):
+            namespace = inter.env.first_namespace_that_binds_the_var(var)
+            operator = None if namespace is None else namespace[var]
+            if type(operator) is CompoundProcedure and operator.params is params:
+                inter.step_stack.append(expansion_step)
+            else:
+                inter.step_stack.append(call_step)
+
+        return main_step
+
+    def __str__(self):
+        return str(self.call)
+
+
+class ImportExpr(Expr):
+    fields = ('path',)
+
+    def __init__(self, path):
+        """(import path) makes the variables exported by the module at the
+        absolute path (path) (a python string) available in the current
+        environment. The module is instantiated in the interpreter if this is
+        it's first import there. The value is the name of the module."""
+        self.path = path
+        self.main_step = self._create_main_step(path)
+
+    @staticmethod
+    def _create_main_step(path):
+        def bind_exports(inter, instance):
+            module, namespace = instance.module, instance.env.namespace
+            for var in module.exports:
+                if var not in namespace:
+                    raise SchemeException(f'module {module.name} exports {var}, '
+                                          'but does not define it')
+                inter.env.define_variable(var, namespace[var])
+            return module.name
+            
+        def main_step(inter):
+            module = modules.load(path)
+            instance = inter.modules.get(path)
+            if instance is not None and instance.module is module:
+                if instance.ready:
+                    return bind_exports(inter, instance)
+                if any(frame.env is instance.env for frame in inter.frame_stack):
+                    raise SchemeException(f'circular import of "{path}"')
+                # an earlier instantiation failed; start over
+
+            env = Environment([], [], inter.global_env)
+            env.is_module = True
+            instance = inter.modules[path] = modules.Instance(module, env)
+
+            def finish(inter):
+                instance.ready = True
+                return bind_exports(inter, instance)
+
+            inter.step_stack.append(finish)
+            if module.body:
+                inter.frame_stack.append(
+                    Frame(BeginExpr(module.body).main_step, env))
+
+        return main_step
+
+    def __str__(self):
+        return f'(import "{self.path}")'
+
+
 class BeginExpr(Expr):
+    fields = ('exprs',)
+
     def __init__(self, exprs):
         # @exprs must be a non-empty sequence of expressions
         self.exprs = exprs
@@ -159,6 +638,8 @@ class BeginExpr(Expr):
 
     
 class ApplicationExpr(Expr):
+    fields = ('exprs',)
+
     def __init__(self, exprs):
         """(exprs) must be a non-empty iterable of Exprs."""
         self.exprs = list(exprs)
@@ -186,6 +667,8 @@ class ApplicationExpr(Expr):
 
 
 class AndExpr(Expr):
+    fields = ('exprs',)
+
     def __init__(self, exprs):
         """(exprs) must be an iterable of Expr instances."""
         self.exprs = list(exprs)        
@@ -233,6 +716,8 @@ class AndExpr(Expr):
 
 
 class OrExpr(Expr):
+    fields = ('exprs',)
+
     def __init__(self, exprs):
         """(exprs) must be an iterable of Expr instances."""
         self.exprs = list(exprs)
@@ -3,8 +3,13 @@ class Frame:
     * attributes:
     - self.step_stack
     - self.env
+    * class attributes:
+    - Frame.allocated: the number of frames created so far by the process.
     """
+
+    allocated = 0
     
     def __init__(self, main_step, env):
+        Frame.allocated += 1
         self.step_stack = [main_step]
         self.env = env
@@ -1,13 +1,18 @@
 """All of the functions in the global environment are defined here"""
 
+import io
+import sys
 import functools
 import operator
 import itertools
 
 import stypes
 import steptools
+import memo
+import numvec
 
 from stypes import * # for convenience
+from numvec import NumVector
 from environment import Environment
 from exceptions import *
 
@@ -74,6 +79,7 @@ def _(inter, *args):
 @globalfunc('/')
 def _(inter, a, b):
     check_nums([a, b], '/')
+    check_divisor(b, '/')
     return a / b
 
 
@@ -137,6 +143,42 @@ def _(inter, *args):
     return stypes.true
 
 
+def check_ints(args, funcname):
+    for i, arg in enumerate(args, 1):
+        if type(arg) is not Number or not arg.is_int:
+            raise SchemeTypeError(f'Error while evaluating {funcname}: '
+                                  f'argument at position {i} is not an integer: {arg}')
+
+
+def check_divisor(num, funcname):
+    if num.pynum == 0:
+        raise SchemeZeroDivisionError(f'Error while evaluating {funcname}: '
+                                      f'division by zero')
+
+
+@globalfunc('quotient')
+def _(inter, a, b):
+    check_ints([a, b], 'quotient')
+    check_divisor(b, 'quotient')
+    q = abs(a.pynum) // abs(b.pynum)
+    return Number(q if (a.pynum < 0) == (b.pynum < 0) else -q)
+
+
+@globalfunc('remainder')
+def _(inter, a, b):
+    check_ints([a, b], 'remainder')
+    check_divisor(b, 'remainder')
+    r = abs(a.pynum) % abs(b.pynum)
+    return Number(-r if a.pynum < 0 else r)
+
+
+@globalfunc('modulo')
+def _(inter, a, b):
+    check_ints([a, b], 'modulo')
+    check_divisor(b, 'modulo')
+    return Number(a.pynum % b.pynum)
+
+
 @globalfunc('abs')
 def _(inter, num):
     check_num(num, 'abs')
@@ -219,66 +261,885 @@ def _(inter, *args):
 
 @globalfunc('empty?')
 def _(inter, arg):
-    return arg is stypes.nil
+    return Boolean(arg is stypes.nil)
+
+
+@globalfunc('null?')
+def _(inter, arg):
+    return Boolean(arg is stypes.nil)
+
+
+def check_list(lst, funcname):
+    """Raises a SchemeTypeError if @lst is not a proper list. Returns the
+    number of it's elements."""
+    count = 0
+    while type(lst) is Cons:
+        lst = lst.cdr
+        count += 1
+    if lst is not stypes.nil:
+        raise SchemeTypeError(f'Error while evaluating {funcname}: '
+                              f'the argument is not a list')
+    return count
+
+
+@globalfunc('length')
+def _(inter, lst):
+    return Number(check_list(lst, 'length'))
+
+
+@globalfunc('append')
+def _(inter, *lists):
+    """All lists but the last are copied; the result shares the last one."""
+    if not lists:
+        return stypes.nil
+    result = lists[-1]
+    for lst in reversed(lists[:-1]):
+        check_list(lst, 'append')
+        for value in reversed(list(lst)):
+            result = Cons(value, result)
+    return result
+
+
+@globalfunc('reverse')
+def _(inter, lst):
+    check_list(lst, 'reverse')
+    result = stypes.nil
+    while lst is not stypes.nil:
+        result = Cons(lst.car, result)
+        lst = lst.cdr
+    return result
+
+
+@globalfunc('list-tail')
+def list_tail(inter, lst, k):
+    check_ints([k], 'list-tail')
+    if k.pynum < 0:
+        raise SchemeTypeError(f'Error while evaluating list-tail: '
+                              f'index out of range: {k}')
+    for i in range(k.pynum):
+        if type(lst) is not Cons:
+            raise SchemeTypeError(f'Error while evaluating list-tail: '
+                                  f'index out of range: {k}')
+        lst = lst.cdr
+    return lst
+
+
+@globalfunc('list-ref')
+def _(inter, lst, k):
+    pair = list_tail(inter, lst, k)
+    if type(pair) is not Cons:
+        raise SchemeTypeError(f'Error while evaluating list-ref: '
+                              f'index out of range: {k}')
+    return pair.car
+
+
+@globalfunc('last-pair')
+def _(inter, lst):
+    check_pair(lst, 'last-pair')
+    while type(lst.cdr) is Cons:
+        lst = lst.cdr
+    return lst
+
+
+@globalfunc('list-copy')
+def _(inter, lst):
+    """Copies the pairs of the list @lst, which may be improper."""
+    if type(lst) is not Cons:
+        return lst
+    head = last = Cons(lst.car, stypes.nil)
+    lst = lst.cdr
+    while type(lst) is Cons:
+        last.cdr = Cons(lst.car, stypes.nil)
+        last, lst = last.cdr, lst.cdr
+    last.cdr = lst
+    return head
+
+
+def create_member_funcs():
+    # Like create_cmps, this only encapsulates the code. The functions differ
+    # only in the predicate comparing the elements.
+
+    predicates = {'eq': lambda a, b: a is b,
+                  'eqv': lambda a, b: stypes.eqv_key(a) == stypes.eqv_key(b),
+                  'equal': lambda a, b: a == b}
+
+    def create(member_name, assoc_name, same):
+        @globalfunc(member_name)
+        def _(inter, obj, lst):
+            """Returns the first pair of @lst whose car is @obj, or #f."""
+            pair = lst
+            while type(pair) is Cons:
+                if same(obj, pair.car):
+                    return pair
+                pair = pair.cdr
+            check_list(pair, member_name)
+            return stypes.false
+
+        @globalfunc(assoc_name)
+        def _(inter, obj, alist):
+            """Returns the first pair of the association list @alist whose car
+            is @obj, or #f."""
+            pair = alist
+            while type(pair) is Cons:
+                entry = pair.car
+                check_pair(entry, assoc_name)
+                if same(obj, entry.car):
+                    return entry
+                pair = pair.cdr
+            check_list(pair, assoc_name)
+            return stypes.false
+
+    create('memq', 'assq', predicates['eq'])
+    create('memv', 'assv', predicates['eqv'])
+    create('member', 'assoc', predicates['equal'])
+
+create_member_funcs()
 
 
 @globalfunc('filter')
 def _(inter, pred, lst):
-    def values_handler(inter):
-        bool_results = inter.last_value
-        return Cons.from_iter((value for value, include_it in zip(lst, bool_results)
-                                   if include_it))
-    
-    sequencer = steptools.Sequencer(steptools.Caller(pred, [arg]) for arg in lst)
-    inter.step_stack.append(values_handler)
-    inter.step_stack.append(sequencer)
+    result = []
+
+    def handler(args, include_it):
+        if include_it is not stypes.false:
+            result.append(args[0])
+
+    return steptools.call_each(inter, pred, ((value,) for value in lst),
+                               handler, lambda: Cons.from_iter(result))
 
 
 @globalfunc('map')
 def _(inter, func, *lists):
-    def values_handler(inter):
-        return Cons.from_iter(inter.last_value)
+    # the result is built front to back, one pair per value
+    head = last = None
 
-    sequencer = steptools.Sequencer(steptools.Caller(func, args) for args in zip(*lists))
-    inter.step_stack.append(values_handler)
-    inter.step_stack.append(sequencer)
+    def handler(args, value):
+        nonlocal head, last
+        pair = Cons(value, stypes.nil)
+        if last is None:
+            head = pair
+        else:
+            last.cdr = pair
+        last = pair
+
+    return steptools.call_each(inter, func, zip(*lists), handler,
+                               lambda: stypes.nil if head is None else head)
+
+
+def fold(inter, func, init, values):
+    """Folds the python iterable @values with @func, starting with @init."""
+    acc = init
+
+    def handler(args, value):
+        nonlocal acc
+        acc = value
+
+    return steptools.call_each(inter, func, ((value, acc) for value in values),
+                               handler, lambda: acc)
 
 
 @globalfunc('foldl')
 def _(inter, func, init, alist):
-    values = iter(alist)
+    return fold(inter, func, init, alist)
+
+
+@globalfunc('foldr')
+def _(inter, func, init, alist):
+    return fold(inter, func, init, reversed(list(alist)))
     
-    def value_handler(inter):
-        try:
-            value = next(values)
-        except StopIteration:
-            return inter.last_value
+################################################################################
+# promises and streams
 
-        caller = steptools.Caller(func, (value, inter.last_value))
-        inter.step_stack.append(value_handler)
-        inter.step_stack.append(caller)
+# A stream is either nil or a pair whose cdr is a promise of a stream.
+
+def check_stream_pair(stream, funcname):
+    if type(stream) is not Cons:
+        raise SchemeTypeError(f'Error while evaluating {funcname}: '
+                              f'{stream} is not a non-empty stream')
+
+
+def force(inter, obj, then):
+    """Calls @then with the value of @obj, which is the value of the promise
+    @obj, or @obj itself if it is not a promise. The value of the step is the
+    value of @then. The promise is forced if needed, in which case @then is
+    called in a later step."""
+
+    if type(obj) is not Promise:
+        return then(obj)
+    if obj.is_forced:
+        return then(obj.value)
+
+    def value_handler(inter):
+        # the thunk may have forced the promise itself, in which case the
+        # first value stays
+        if not obj.is_forced:
+            obj.value, obj.thunk = inter.last_value, None
+        return then(obj.value)
 
     inter.step_stack.append(value_handler)
-    inter.step_stack.append(steptools.Identity(init))
+    inter.step_stack.append(steptools.Caller(obj.thunk, []))
 
 
-@globalfunc('foldr')
-def _(inter, func, init, alist):
-    values = reversed(list(alist))
-    
+def lazy(func):
+    """Returns a promise whose value is computed by calling @func with the
+    interpreter, as a primitive procedure."""
+    return Promise(PrimitiveProcedure(func))
+
+
+@globalfunc('force')
+def _(inter, obj):
+    return force(inter, obj, lambda value: value)
+
+
+@globalfunc('make-promise')
+def _(inter, obj):
+    """Returns a promise which is already forced to @obj. If @obj already is
+    a promise, it is returned."""
+    if type(obj) is Promise:
+        return obj
+    return Promise(None, obj)
+
+
+@globalfunc('promise?')
+def _(inter, obj):
+    return Boolean(type(obj) is Promise)
+
+
+bind('the-empty-stream', stypes.nil)
+
+
+@globalfunc('stream-pair?')
+def _(inter, obj):
+    return Boolean(type(obj) is Cons and type(obj.cdr) is Promise)
+
+
+@globalfunc('stream-null?')
+def _(inter, obj):
+    return Boolean(obj is stypes.nil)
+
+
+@globalfunc('stream-car')
+def _(inter, stream):
+    check_stream_pair(stream, 'stream-car')
+    return stream.car
+
+
+@globalfunc('stream-cdr')
+def _(inter, stream):
+    check_stream_pair(stream, 'stream-cdr')
+    return force(inter, stream.cdr, lambda value: value)
+
+
+@globalfunc('stream-map')
+def stream_map(inter, func, *streams):
+    """Returns the stream of the values of @func applied to the elements of
+    @streams at the same positions. Only the first pair is computed now; the
+    rest when the promise in it's cdr is forced."""
+
+    if any(stream is stypes.nil for stream in streams):
+        return stypes.nil
+    for stream in streams:
+        check_stream_pair(stream, 'stream-map')
+
+    def rest(inter):
+        cdrs = []
+        return steptools.call_each(
+            inter, namespace[Symbol('force')],
+            ((stream.cdr,) for stream in streams),
+            lambda args, value: cdrs.append(value),
+            lambda: stream_map(inter, func, *cdrs))
+
+    first = []
+    return steptools.call_each(
+        inter, func, iter([[stream.car for stream in streams]]),
+        lambda args, value: first.append(value),
+        lambda: Cons(first[0], lazy(rest)))
+
+
+@globalfunc('stream-filter')
+def stream_filter(inter, pred, stream):
+    """Returns the stream of the elements of @stream which satisfy @pred.
+    Elements are tested only until the first one which does."""
+
+    if stream is stypes.nil:
+        return stypes.nil
+    check_stream_pair(stream, 'stream-filter')
+
+    def rest(inter):
+        return force(inter, stream.cdr,
+                     lambda cdr: stream_filter(inter, pred, cdr))
+
     def value_handler(inter):
+        if inter.last_value is not stypes.false:
+            return Cons(stream.car, lazy(rest))
+        return rest(inter)
+
+    inter.step_stack.append(value_handler)
+    inter.step_stack.append(steptools.Caller(pred, [stream.car]))
+
+
+@globalfunc('stream-take')
+def _(inter, stream, n):
+    """Returns the list of the first @n elements of @stream (all of them if it
+    has fewer). Only the promises before the last of those are forced."""
+
+    check_ints([n], 'stream-take')
+    items = []
+
+    def loop(stream):
+        while len(items) < n.pynum and stream is not stypes.nil:
+            check_stream_pair(stream, 'stream-take')
+            items.append(stream.car)
+            if len(items) == n.pynum:
+                break
+            cdr = stream.cdr
+            if type(cdr) is Promise and not cdr.is_forced:
+                return force(inter, cdr, loop)
+            stream = cdr.value if type(cdr) is Promise else cdr
+        return Cons.from_iter(items)
+
+    return loop(stream)
+
+################################################################################
+# strings
+
+def check_string(arg, funcname):
+    if type(arg) is not String:
+        raise SchemeTypeError(f'Error while evaluating {funcname}: '
+                              f'the argument is not a string: {arg}')
+
+
+@globalfunc('string-append')
+def _(inter, *strings):
+    for string in strings:
+        check_string(string, 'string-append')
+    return String.from_chars(''.join(string.chars for string in strings))
+
+
+@globalfunc('string-length')
+def _(inter, string):
+    check_string(string, 'string-length')
+    return Number(len(string.chars))
+
+
+@globalfunc('substring')
+def _(inter, string, start, end=None):
+    check_string(string, 'substring')
+    check_ints([start] if end is None else [start, end], 'substring')
+    length = len(string.chars)
+    end = length if end is None else end.pynum
+    if not 0 <= start.pynum <= end <= length:
+        raise SchemeTypeError(f'Error while evaluating substring: indices out '
+                              f'of range: {start} {end} for a string of length '
+                              f'{length}')
+    return String.from_chars(string.chars[start.pynum:end])
+
+
+def create_string_cmps():
+    # Like create_cmps, for strings.
+
+    cmp_operators = {'string=?': operator.eq, 'string<?': operator.lt,
+                     'string<=?': operator.le, 'string>?': operator.gt,
+                     'string>=?': operator.ge}
+
+    def create(operator_name):
+        cmp_operator = cmp_operators[operator_name]
+
+        @globalfunc(operator_name)
+        def _(inter, *strings):
+            for string in strings:
+                check_string(string, operator_name)
+            return Boolean(all(cmp_operator(a.chars, b.chars)
+                               for a, b in zip(strings, strings[1:])))
+
+    for operator_name in cmp_operators:
+        create(operator_name)
+
+create_string_cmps()
+
+
+@globalfunc('number->string')
+def _(inter, num):
+    check_num(num, 'number->string')
+    return String.from_chars(str(num))
+
+
+@globalfunc('symbol->string')
+def _(inter, sym):
+    if type(sym) is not Symbol:
+        raise SchemeTypeError(f'Error while evaluating symbol->string: '
+                              f'the argument is not a symbol: {sym}')
+    return String.from_chars(sym.name)
+
+################################################################################
+# output ports
+
+def check_output_port(port, funcname):
+    if not isinstance(port, OutputPort):
+        raise SchemeTypeError(f'Error while evaluating {funcname}: '
+                              f'{port} is not an output port')
+    if port.is_closed:
+        raise SchemeTypeError(f'Error while evaluating {funcname}: '
+                              f'the port is closed')
+
+
+def output_port(inter, port, funcname):
+    """Returns @port, or the current output port of @inter if @port is None."""
+    if port is None:
+        return current_output_port(inter)
+    check_output_port(port, funcname)
+    return port
+
+
+def current_output_port(inter):
+    """The current output port is inter.output_port, or a port which writes to
+    the standard output if it is None. The standard output can not be closed
+    by the program."""
+    if inter.output_port is None:
+        return OutputPort(sys.stdout, closable=False)
+    return inter.output_port
+
+
+def display_chars(obj):
+    """Returns the python string shown by display for @obj."""
+    return obj.chars if type(obj) is String else str(obj)
+
+
+@globalfunc('current-output-port')
+def _(inter):
+    return current_output_port(inter)
+
+
+@globalfunc('open-output-string')
+def _(inter):
+    """Returns a port which accumulates everything written to it in memory.
+    The text is retrieved with get-output-string."""
+    return OutputPort(io.StringIO())
+
+
+@globalfunc('get-output-string')
+def _(inter, port):
+    if not isinstance(port, OutputPort) or type(port.file) is not io.StringIO:
+        raise SchemeTypeError(f'Error while evaluating get-output-string: '
+                              f'{port} is not a string port')
+    return String.from_chars(port.file.getvalue())
+
+
+@globalfunc('write-string')
+def _(inter, string, port=None):
+    check_string(string, 'write-string')
+    output_port(inter, port, 'write-string').write(string.chars)
+
+
+@globalfunc('display')
+def _(inter, obj, port=None):
+    output_port(inter, port, 'display').write(display_chars(obj))
+
+
+@globalfunc('newline')
+def _(inter, port=None):
+    output_port(inter, port, 'newline').write('\n')
+
+################################################################################
+# file ports
+
+def check_input_port(port, funcname):
+    if not isinstance(port, InputPort):
+        raise SchemeTypeError(f'Error while evaluating {funcname}: '
+                              f'{port} is not an input port')
+    if port.is_closed:
+        raise SchemeTypeError(f'Error while evaluating {funcname}: '
+                              f'the port is closed')
+
+
+def input_port(port, funcname):
+    """Returns @port, or a port which reads the standard input if @port is
+    None."""
+    if port is None:
+        return InputPort(sys.stdin, closable=False)
+    check_input_port(port, funcname)
+    return port
+
+
+def open_file(filename, mode, funcname):
+    """Returns the python file object of the file named by the scheme string
+    @filename, opened in @mode."""
+    check_string(filename, funcname)
+    try:
+        return open(filename.chars, mode)
+    except OSError as e:
+        raise SchemeFileError(f'Error while evaluating {funcname}: cannot open '
+                              f'"{filename.chars}": {e.strerror}')
+
+
+def eof_or_string(chars):
+    return stypes.eof if chars is None else String.from_chars(chars)
+
+
+@globalfunc('open-input-file')
+def _(inter, filename):
+    return InputPort(open_file(filename, 'r', 'open-input-file'))
+
+
+@globalfunc('open-output-file')
+def _(inter, filename):
+    return OutputPort(open_file(filename, 'w', 'open-output-file'))
+
+
+@globalfunc('read-line')
+def _(inter, port=None):
+    """Returns the next line of @port without the line terminator, or the eof
+    object at the end of the file."""
+    return eof_or_string(input_port(port, 'read-line').read_line())
+
+
+@globalfunc('read-char')
+def _(inter, port=None):
+    return eof_or_string(input_port(port, 'read-char').read_char())
+
+
+def create_close_funcs():
+    def create(funcname, porttype):
+        @globalfunc(funcname)
+        def _(inter, port):
+            if not isinstance(port, porttype):
+                raise SchemeTypeError(f'Error while evaluating {funcname}: '
+                                      f'{port} is not a suitable port')
+            port.close()
+
+    create('close-port', Port)
+    create('close-input-port', InputPort)
+    create('close-output-port', OutputPort)
+create_close_funcs()
+
+
+@globalfunc('eof-object')
+def _(inter):
+    return stypes.eof
+
+
+@globalfunc('eof-object?')
+def _(inter, obj):
+    return Boolean(obj is stypes.eof)
+
+
+@globalfunc('input-port?')
+def _(inter, obj):
+    return Boolean(isinstance(obj, InputPort))
+
+
+@globalfunc('output-port?')
+def _(inter, obj):
+    return Boolean(isinstance(obj, OutputPort))
+
+
+@globalfunc('file-lines')
+def _(inter, filename):
+    """Returns a generator of the lines of the file: a procedure of no
+    arguments which returns the next line each time it is called, and the eof
+    object after the last one. The file is read lazily and closed when the end
+    is reached, so files of any size are processed in constant memory."""
+    port = InputPort(open_file(filename, 'r', 'file-lines'))
+
+    def next_line(inter):
+        if port.is_closed:
+            return stypes.eof
+        line = port.read_line()
+        if line is None:
+            port.close()
+        return eof_or_string(line)
+
+    return PrimitiveProcedure(next_line)
+
+################################################################################
+# homogeneous numeric vectors
+
+def check_numvec(arg, funcname, kind=None):
+    """If @kind is not None, @arg must also be a vector of that kind."""
+    if type(arg) is not NumVector or kind is not None and arg.kind != kind:
+        raise SchemeTypeError(f'Error while evaluating {funcname}: the argument '
+                              f'is not {"a numeric" if kind is None else "an " + kind}'
+                              f' vector: {arg}')
+
+
+def check_same_length(v1, v2, funcname):
+    if len(v1) != len(v2):
+        raise SchemeTypeError(f'Error while evaluating {funcname}: '
+                              f'the vectors have different lengths')
+
+
+def check_index(vector, index, funcname):
+    check_ints([index], funcname)
+    if not 0 <= index.pynum < len(vector):
+        raise SchemeTypeError(f'Error while evaluating {funcname}: '
+                              f'index out of range: {index}')
+
+
+def element_pynum(kind, num, funcname):
+    """Returns the python number stored in a vector of the given kind for the
+    scheme number @num."""
+    if kind == 's64':
+        check_ints([num], funcname)
+        if not numvec.S64_MIN <= num.pynum <= numvec.S64_MAX:
+            raise SchemeTypeError(f'Error while evaluating {funcname}: {num} '
+                                  f'does not fit in an s64vector')
+        return num.pynum
+    check_num(num, funcname)
+    try:
+        return float(num.pynum)
+    except OverflowError:
+        raise SchemeTypeError(f'Error while evaluating {funcname}: {num} '
+                              f'does not fit in an f64vector')
+
+
+def numvec_op(op, funcname, *args):
+    """Returns @op(*@args), where @op is a bulk operation of numvec, raising a
+    SchemeTypeError if the elements of the resulting s64vector do not fit in
+    64 bits."""
+    try:
+        return op(*args)
+    except OverflowError:
+        raise SchemeTypeError(f'Error while evaluating {funcname}: the result '
+                              f'does not fit in an s64vector')
+
+
+def create_numvec_funcs():
+    # Like create_cmps, this only encapsulates the code. The functions are the
+    # same for all kinds of vectors.
+
+    def create(kind):
+        prefix = f'{kind}vector'
+
+        @globalfunc(f'make-{prefix}')
+        def _(inter, size, fill=Number(0)):
+            check_ints([size], f'make-{prefix}')
+            if size.pynum < 0:
+                raise SchemeTypeError(f'Error while evaluating make-{prefix}: '
+                                      f'negative size {size}')
+            return NumVector.filled(kind, size.pynum,
+                                    element_pynum(kind, fill, f'make-{prefix}'))
+
+        @globalfunc(prefix)
+        def _(inter, *nums):
+            return NumVector.from_iter(kind, [element_pynum(kind, num, prefix)
+                                              for num in nums])
+
+        @globalfunc(f'list->{prefix}')
+        def _(inter, lst):
+            return NumVector.from_iter(
+                kind, [element_pynum(kind, num, f'list->{prefix}') for num in lst])
+
+        @globalfunc(f'{prefix}?')
+        def _(inter, obj):
+            return Boolean(type(obj) is NumVector and obj.kind == kind)
+
+        @globalfunc(f'{prefix}->list')
+        def _(inter, vector):
+            check_numvec(vector, f'{prefix}->list', kind)
+            return Cons.from_iter(Number(x) for x in vector.tolist())
+
+        @globalfunc(f'{prefix}-length')
+        def _(inter, vector):
+            check_numvec(vector, f'{prefix}-length', kind)
+            return Number(len(vector))
+
+        @globalfunc(f'{prefix}-ref')
+        def _(inter, vector, index):
+            check_numvec(vector, f'{prefix}-ref', kind)
+            check_index(vector, index, f'{prefix}-ref')
+            return Number(vector.ref(index.pynum))
+
+        @globalfunc(f'{prefix}-set!')
+        def _(inter, vector, index, num):
+            check_numvec(vector, f'{prefix}-set!', kind)
+            check_index(vector, index, f'{prefix}-set!')
+            vector.set(index.pynum, element_pynum(kind, num, f'{prefix}-set!'))
+
+    for kind in numvec.KINDS:
+        create(kind)
+
+create_numvec_funcs()
+
+
+@globalfunc('vector-add')
+def _(inter, v1, v2):
+    check_numvec(v1, 'vector-add')
+    check_numvec(v2, 'vector-add')
+    check_same_length(v1, v2, 'vector-add')
+    return numvec_op(numvec.add, 'vector-add', v1, v2)
+
+
+@globalfunc('vector-scale')
+def _(inter, vector, num):
+    check_numvec(vector, 'vector-scale')
+    check_num(num, 'vector-scale')
+    pynum = num.pynum if num.is_int else float(num.pynum)
+    return numvec_op(numvec.scale, 'vector-scale', vector, pynum)
+
+
+@globalfunc('vector-sum')
+def _(inter, vector):
+    check_numvec(vector, 'vector-sum')
+    return Number(numvec.total(vector))
+
+
+@globalfunc('vector-dot')
+def _(inter, v1, v2):
+    check_numvec(v1, 'vector-dot')
+    check_numvec(v2, 'vector-dot')
+    check_same_length(v1, v2, 'vector-dot')
+    return Number(numvec.dot(v1, v2))
+
+
+# maps primitives to the names of the numvec.ufuncs vector-map applies in bulk
+# for them
+numvec_ufuncs = {namespace[Symbol(name)]: ufunc
+                 for name, ufunc in (('abs', 'abs'), ('square', 'square'),
+                                     ('-', 'negative'), ('add1', 'add1'),
+                                     ('sub1', 'sub1'))}
+
+
+@globalfunc('vector-map')
+def _(inter, func, vector):
+    """Applies @func to every element of @vector and returns the vector of the
+    results. The result is an s64vector if all results are integers and an
+    f64vector otherwise."""
+    check_numvec(vector, 'vector-map')
+
+    ufunc = numvec_ufuncs.get(func)
+    if ufunc is not None:
+        return numvec_op(numvec.apply, 'vector-map', ufunc, vector)
+
+    def make_vector(results):
+        check_nums(results, 'vector-map')
+        kind = 's64' if all(num.is_int for num in results) else 'f64'
+        return NumVector.from_iter(kind, [element_pynum(kind, num, 'vector-map')
+                                          for num in results])
+
+    results = []
+    return steptools.call_each(inter, func,
+                               ((Number(x),) for x in vector.tolist()),
+                               lambda args, value: results.append(value),
+                               lambda: make_vector(results))
+
+################################################################################
+# sorting
+
+def merge_sort(items):
+    """A generator which sorts the python list @items with a stable bottom-up
+    merge sort. It yields the pairs (a, b) it needs to compare and must be
+    sent True if a is less than b, False otherwise. Returns the sorted
+    list."""
+
+    width, size = 1, len(items)
+    while width < size:
+        merged = []
+        for low in range(0, size, 2 * width):
+            left = items[low:low + width]
+            right = items[low + width:low + 2 * width]
+            i = j = 0
+            while i < len(left) and j < len(right):
+                # equal elements are taken from the left, so the sort is stable
+                if (yield (right[j], left[i])):
+                    merged.append(right[j])
+                    j += 1
+                else:
+                    merged.append(left[i])
+                    i += 1
+            merged.extend(left[i:])
+            merged.extend(right[j:])
+        items, width = merged, 2 * width
+    return items
+
+
+def sort_values(inter, items, less, funcname, finish):
+    """Sorts the python list of scheme values @items with the procedure @less
+    and returns the value of calling @finish with the sorted list. If @less is
+    one of the primitives <, > and string<?, python's sort is used. Otherwise
+    @less is called by the step machine, so @finish may be called in a later
+    step."""
+
+    if less is namespace[Symbol('<')] or less is namespace[Symbol('>')]:
+        check_nums(items, funcname)
+        return finish(sorted(items, key=lambda num: num.pynum,
+                             reverse=less is namespace[Symbol('>')]))
+    if less is namespace[Symbol('string<?')]:
+        for item in items:
+            check_string(item, funcname)
+        return finish(sorted(items, key=lambda string: string.chars))
+
+    sorter = merge_sort(items)
+    answer, result = [None], []
+
+    def comparisons():
         try:
-            value = next(values)
-        except StopIteration:
-            return inter.last_value
+            pair = next(sorter)
+            while True:
+                yield pair
+                pair = sorter.send(answer[0])
+        except StopIteration as stop:
+            result.append(stop.value)
 
-        caller = steptools.Caller(func, (value, inter.last_value))
-        inter.step_stack.append(value_handler)
-        inter.step_stack.append(caller)
+    def handler(args, value):
+        answer[0] = value is not stypes.false
+
+    return steptools.call_each(inter, less, comparisons(), handler,
+                               lambda: finish(result[0]))
+
+
+@globalfunc('sort')
+def _(inter, seq, less):
+    """Returns a sorted copy of the list or vector @seq. The sort is stable."""
+    if type(seq) is NumVector:
+        return sort_values(
+            inter, [Number(x) for x in seq.tolist()], less, 'sort',
+            lambda items: NumVector.from_iter(seq.kind,
+                                              [num.pynum for num in items]))
+    check_list(seq, 'sort')
+    return sort_values(inter, list(seq), less, 'sort', Cons.from_iter)
+
+
+@globalfunc('list-sort')
+def _(inter, less, lst):
+    check_list(lst, 'list-sort')
+    return sort_values(inter, list(lst), less, 'list-sort', Cons.from_iter)
+
+
+@globalfunc('vector-sort!')
+def _(inter, vector, less):
+    check_numvec(vector, 'vector-sort!')
+
+    def finish(items):
+        for index, num in enumerate(items):
+            vector.set(index, num.pynum)
+
+    return sort_values(inter, [Number(x) for x in vector.tolist()], less,
+                       'vector-sort!', finish)
+
+################################################################################
+# type predicates
+
+def create_type_predicates():
+    # Like create_cmps, this only encapsulates the code.
+
+    predicates = {'number?': Number, 'symbol?': Symbol, 'string?': String,
+                  'boolean?': Boolean, 'pair?': Cons}
+
+    def create(name, stype):
+        @globalfunc(name)
+        def _(inter, arg):
+            return Boolean(type(arg) is stype)
+
+    for name, stype in predicates.items():
+        create(name, stype)
+
+create_type_predicates()
+
+
+@globalfunc('procedure?')
+def _(inter, arg):
+    return Boolean(type(arg) in (PrimitiveProcedure, CompoundProcedure))
 
-    inter.step_stack.append(value_handler)
-    inter.step_stack.append(steptools.Identity(init))
-    
 ################################################################################
 
 @globalfunc('apply')
@@ -286,12 +1147,199 @@ def _(inter, func, alist):
     return inter.step_stack.append(steptools.Caller(func, list(alist)))
 
 
+################################################################################
+# memoization
+
+def check_memoized(proc, funcname):
+    if type(proc) is not PrimitiveProcedure or type(proc.proc) is not memo.Memoizer:
+        raise SchemeTypeError(f'Error while evaluating {funcname}: '
+                              f'{proc} is not a memoized procedure')
+
+
+@globalfunc('memoize')
+def _(inter, func, maxsize=Number(memo.DEFAULT_MAXSIZE)):
+    if type(func) not in (PrimitiveProcedure, CompoundProcedure):
+        raise SchemeTypeError(f'Error while evaluating memoize: '
+                              f'{func} is not a procedure')
+    if maxsize is stypes.false:
+        maxsize = None
+    else:
+        check_ints([maxsize], 'memoize')
+        maxsize = maxsize.pynum
+    return PrimitiveProcedure(memo.Memoizer(func, maxsize))
+
+
+@globalfunc('memoize-stats')
+def _(inter, proc):
+    """Returns an association list with the hits, misses and size of the
+    cache of the memoized procedure @proc."""
+    check_memoized(proc, 'memoize-stats')
+    cache = proc.proc.cache
+    return Cons.from_iter(Cons(Symbol(name), Number(value))
+                          for name, value in (('hits', cache.hits),
+                                              ('misses', cache.misses),
+                                              ('size', len(cache))))
+
+
+@globalfunc('memoize-clear!')
+def _(inter, proc):
+    check_memoized(proc, 'memoize-clear!')
+    proc.proc.cache.clear()
+
+################################################################################
+
 @globalfunc('eq?')
 def _(inter, arg1, arg2):
     return Boolean(arg1 is arg2)
 
 
+@globalfunc('eqv?')
+def _(inter, arg1, arg2):
+    return Boolean(stypes.eqv_key(arg1) == stypes.eqv_key(arg2))
+
+
 @globalfunc('equal?')
 def _(inter, arg1, arg2):
     return Boolean(arg1 == arg2) # delegate to the objects
 
+################################################################################
+# hash tables
+
+def check_table(table, funcname):
+    if type(table) is not HashTable:
+        raise SchemeTypeError(f'Error while evaluating {funcname}: '
+                              f'{table} is not a hash table')
+
+
+def create_table_constructors():
+    # Like create_cmps, this only encapsulates the code.
+
+    kinds = ('eq', 'eqv', 'equal')
+    
+    for kind in kinds:
+        bind(f'make-{kind}-hash-table',
+             PrimitiveProcedure(lambda inter, kind=kind: HashTable(kind)))
+
+    # (make-hash-table) compares keys with equal?. The predicate can be given as
+    # an argument: (make-hash-table eq?)
+    kind_of_predicate = {namespace[Symbol(f'{kind}?')]: kind for kind in kinds}
+    
+    @globalfunc('make-hash-table')
+    def _(inter, predicate=None):
+        if predicate is None:
+            return HashTable()
+        kind = kind_of_predicate.get(predicate)
+        if kind is None:
+            raise SchemeTypeError(f'Error while evaluating make-hash-table: '
+                                  f'unsupported equivalence predicate {predicate}')
+        return HashTable(kind)
+
+create_table_constructors()
+
+
+@globalfunc('hash-table?')
+def _(inter, obj):
+    return Boolean(type(obj) is HashTable)
+
+
+@globalfunc('hash-table-ref')
+def _(inter, table, key, fail=None):
+    """If @key is not in @table, returns the result of calling the thunk @fail,
+    or raises an error if there is no thunk."""
+    check_table(table, 'hash-table-ref')
+    try:
+        return table.lookup(key)
+    except KeyError:
+        if fail is None:
+            raise SchemeKeyError(f'Error while evaluating hash-table-ref: '
+                                 f'no value for the key {key}')
+    inter.step_stack.append(steptools.Caller(fail, []))
+
+
+@globalfunc('hash-table-ref/default')
+def _(inter, table, key, default):
+    check_table(table, 'hash-table-ref/default')
+    try:
+        return table.lookup(key)
+    except KeyError:
+        return default
+
+
+@globalfunc('hash-table-set!')
+def _(inter, table, key, value):
+    check_table(table, 'hash-table-set!')
+    table.set(key, value)
+
+
+@globalfunc('hash-table-delete!')
+def _(inter, table, key):
+    check_table(table, 'hash-table-delete!')
+    table.delete(key)
+
+
+@globalfunc('hash-table-contains?')
+def _(inter, table, key):
+    check_table(table, 'hash-table-contains?')
+    return Boolean(key in table)
+
+
+@globalfunc('hash-table-count')
+def _(inter, table):
+    check_table(table, 'hash-table-count')
+    return Number(len(table))
+
+
+@globalfunc('hash-table-update!/default')
+def _(inter, table, key, func, default):
+    """Sets the value of @key in @table to the result of calling @func with
+    its current value (or @default if there is none)."""
+    check_table(table, 'hash-table-update!/default')
+    try:
+        value = table.lookup(key)
+    except KeyError:
+        value = default
+
+    def value_handler(inter):
+        table.set(key, inter.last_value)
+        
+    inter.step_stack.append(value_handler)
+    inter.step_stack.append(steptools.Caller(func, [value]))
+
+
+@globalfunc('hash-table-clear!')
+def _(inter, table):
+    check_table(table, 'hash-table-clear!')
+    table.entries.clear()
+
+
+@globalfunc('hash-table-keys')
+def _(inter, table):
+    check_table(table, 'hash-table-keys')
+    return Cons.from_iter(key for key, value in table.items())
+
+
+@globalfunc('hash-table-values')
+def _(inter, table):
+    check_table(table, 'hash-table-values')
+    return Cons.from_iter(value for key, value in table.items())
+
+
+@globalfunc('hash-table->alist')
+def _(inter, table):
+    check_table(table, 'hash-table->alist')
+    return Cons.from_iter(Cons(key, value) for key, value in table.items())
+
+
+@globalfunc('hash-table-walk')
+def _(inter, table, func):
+    """Calls @func with every key and value of @table. The entries are
+    collected before the first call, so @func may modify @table."""
+    check_table(table, 'hash-table-walk')
+
+    def values_handler(inter):
+        return None
+    
+    sequencer = steptools.Sequencer(steptools.Caller(func, entry)
+                                    for entry in table.items())
+    inter.step_stack.append(values_handler)
+    inter.step_stack.append(sequencer)
@@ -0,0 +1,300 @@
+"""
+Images are files holding the state of an interpreter: it's global environment,
+with everything reachable from it, and it's inline table. Loading an image is
+much faster than evaluating the files which produced the state, because
+nothing is parsed or compiled again.
+
+The objects are written as a flat table of records, one per object, in which
+objects refer to each other by their index in the table. So objects shared by
+several others, and cycles, are restored as they were. Records are tuples
+whose first element is the kind of the record:
+  ('py', value)                      a python constant (None, bool, int, str)
+  ('number', pynum)
+  ('string', chars)
+  ('symbol', name)                   an interned symbol
+  ('internal', name)                 the head of an internal form of the
+                                     compiler (see INTERNAL)
+  ('uninterned', name)               restored as a new uninterned symbol
+  ('constant', name)                 #t, #f, nil, unspecified or eof
+  ('cons', car, cdr)
+  ('list', [item, ...])              a python list of an Expr
+  ('tuple', [item, ...])
+  ('env', [(var, value), ...], parent, is_module)
+  ('primitive', name)                a procedure of global_env.namespace
+  ('memoized', func, maxsize)        the cache is not saved
+  ('procedure', params, env, name, lambda_expr)
+  ('expr', classname, [field, ...])  see Expr.fields
+  ('hash-table', kind, [(key, value), ...])
+  ('promise', thunk, value)
+  ('vector', kind, [pynum, ...])
+Ports, and primitive procedures which are neither global nor memoized, cannot
+be saved. Neither can the instances of modules, so modules imported before the
+image was saved are instantiated again when they are imported after it is
+loaded (their exports are in the saved environments anyway). Compound
+procedures are restored with their call counts reset, so the jit compiles them
+again when they become hot.
+"""
+
+import pickle
+
+import analysis
+import compiler
+import exprs
+import memo
+import global_env
+import stypes
+
+from stypes import *
+from numvec import NumVector
+from environment import Environment
+from exceptions import *
+
+VERSION = 1
+
+CONSTANTS = {'true': stypes.true, 'false': stypes.false, 'nil': nil,
+             'unspecified': stypes.unspecified, 'eof': stypes.eof}
+
+# the uninterned symbols which are the heads of the compiler's internal forms,
+# by name. They must be restored as the same objects, since the analyses and
+# the compiler recognize the forms by identity.
+INTERNAL = {symbol.name: symbol
+            for symbol in (analysis.HOISTED_LAMBDA, analysis.FLAT_LAMBDA,
+                           analysis.INLINE, compiler.SELF_CALL)}
+
+
+def save(inter, path):
+    """Writes the image of the Interpreter @inter to the file at @path."""
+
+    inline_table = [(var, params, body)
+                    for var, (params, body) in inter.inline_table.items()]
+    records = Writer().write((inter.global_env, inline_table))
+    with open(path, 'wb') as f:
+        pickle.dump((VERSION, records), f, pickle.HIGHEST_PROTOCOL)
+
+
+def load(inter, path):
+    """Replaces the global environment and the inline table of the Interpreter
+    @inter by the ones in the image at @path."""
+
+    try:
+        with open(path, 'rb') as f:
+            version, records = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, ValueError) as e:
+        raise SchemeException(f'cannot load the image "{path}": {e}')
+    if version != VERSION:
+        raise SchemeException(f'the image "{path}" has version {version}, '
+                              f'expected {VERSION}')
+
+    global_env, inline_table = Reader(records).read()
+    inter.global_env = global_env
+    inter.inline_table = {var: (params, body)
+                          for var, params, body in inline_table}
+    inter.modules = {}
+
+
+class Writer:
+    """
+    * attributes
+    - self.records: the records written so far
+    - self.indices: maps the ids of the objects written so far to the indices
+      of their records
+    - self.pending: the (object, index) pairs whose records are not written yet
+    - self.primitives: maps the ids of the global primitive procedures to their
+      names
+    """
+
+    def __init__(self):
+        self.records = []
+        self.indices = {}
+        self.pending = []
+        self.objects = [] # keeps the ids in self.indices valid
+        self.primitives = {id(proc): var.name
+                           for var, proc in global_env.namespace.items()
+                           if type(proc) is PrimitiveProcedure}
+
+
+    def write(self, root):
+        """Returns the list of records of @root and the objects reachable from
+        it. The record of @root is the first one."""
+
+        self.ref(root)
+        while self.pending:
+            obj, index = self.pending.pop()
+            self.records[index] = self.record(obj)
+        return self.records
+
+
+    def ref(self, obj):
+        """Returns the index of the record of @obj, reserving it if @obj was
+        not seen before. The object graph is traversed iteratively, so deep
+        structures (like long lists) do not exhaust the python stack."""
+
+        index = self.indices.get(id(obj))
+        if index is None:
+            index = self.indices[id(obj)] = len(self.records)
+            self.records.append(None)
+            self.objects.append(obj)
+            self.pending.append((obj, index))
+        return index
+
+
+    def record(self, obj):
+        ref = self.ref
+        otype = type(obj)
+        if obj is None or otype in (bool, int, str):
+            return ('py', obj)
+        elif otype is Number:
+            return ('number', obj.pynum)
+        elif otype is String:
+            return ('string', obj.chars)
+        elif otype is Symbol:
+            if Symbol._interned_symbols.get(obj.name) is obj:
+                return ('symbol', obj.name)
+            if INTERNAL.get(obj.name) is obj:
+                return ('internal', obj.name)
+            return ('uninterned', obj.name)
+        elif otype is Cons:
+            return ('cons', ref(obj.car), ref(obj.cdr))
+        elif otype is list:
+            return ('list', [ref(item) for item in obj])
+        elif otype is tuple:
+            return ('tuple', [ref(item) for item in obj])
+        elif otype is Environment:
+            return ('env', [(ref(var), ref(value))
+                            for var, value in obj.namespace.items()],
+                    ref(obj.parent), obj.is_module)
+        elif otype is CompoundProcedure:
+            if obj.lambda_expr is None:
+                raise SchemeException(f'cannot save the procedure {obj}')
+            return ('procedure', ref(obj.params), ref(obj.env), ref(obj.name),
+                    ref(obj.lambda_expr))
+        elif otype is PrimitiveProcedure:
+            name = self.primitives.get(id(obj))
+            if name is not None:
+                return ('primitive', name)
+            if type(obj.proc) is memo.Memoizer:
+                return ('memoized', ref(obj.proc.func), obj.proc.cache.maxsize)
+        elif isinstance(obj, exprs.Expr):
+            return ('expr', otype.__name__,
+                    [ref(getattr(obj, field)) for field in otype.fields])
+        elif otype is HashTable:
+            return ('hash-table', obj.kind, [(ref(key), ref(value))
+                                             for key, value in obj.items()])
+        elif otype is NumVector:
+            return ('vector', obj.kind, obj.tolist())
+        elif otype is Promise:
+            return ('promise', ref(obj.thunk), ref(obj.value))
+        else:
+            for name, constant in CONSTANTS.items():
+                if obj is constant:
+                    return ('constant', name)
+        raise SchemeException(f'cannot save {obj!r}')
+
+
+class Reader:
+    """Restores the objects of a list of records written by a Writer.
+    * attributes
+    - self.records: the records
+    - self.objects: the restored objects, by the indices of their records.
+      Objects which are not restored yet are MISSING.
+    """
+
+    MISSING = object()
+
+    def __init__(self, records):
+        self.records = records
+        self.objects = [Reader.MISSING] * len(records)
+
+
+    def read(self):
+        """Returns the object of the first record."""
+
+        # First create all the mutable objects, empty, so that references to
+        # them (possibly cyclic) can be resolved. Then fill them in.
+        records, objects = self.records, self.objects
+        for index, record in enumerate(records):
+            kind = record[0]
+            if kind == 'cons':
+                objects[index] = Cons(None, None)
+            elif kind == 'env':
+                objects[index] = Environment([], [], None)
+            elif kind == 'procedure':
+                objects[index] = CompoundProcedure(None, None, None)
+            elif kind == 'memoized':
+                objects[index] = PrimitiveProcedure(None)
+            elif kind == 'hash-table':
+                objects[index] = HashTable(record[1])
+            elif kind == 'promise':
+                objects[index] = Promise(None)
+
+        value = self.value
+        tables = []
+        for index, record in enumerate(records):
+            kind, obj = record[0], objects[index]
+            if kind == 'cons':
+                obj.car, obj.cdr = value(record[1]), value(record[2])
+            elif kind == 'env':
+                obj.namespace = {value(var): value(val) for var, val in record[1]}
+                obj.parent = value(record[2])
+                if record[3]:
+                    obj.is_module = True
+            elif kind == 'procedure':
+                obj.params, obj.env, obj.name, obj.lambda_expr = map(
+                    value, record[1:])
+                obj.step = obj.lambda_expr.body_step
+            elif kind == 'memoized':
+                obj.proc = memo.Memoizer(value(record[1]), record[2])
+            elif kind == 'hash-table':
+                tables.append((obj, record[2]))
+            elif kind == 'promise':
+                obj.thunk, obj.value = value(record[1]), value(record[2])
+
+        # the keys of equal tables are hashed, so they must be complete
+        for table, entries in tables:
+            for key, val in entries:
+                table.set(value(key), value(val))
+        return value(0)
+
+
+    def value(self, index):
+        """Returns the object of the record at @index, restoring it if
+        needed."""
+
+        obj = self.objects[index]
+        if obj is not Reader.MISSING:
+            return obj
+
+        record = self.records[index]
+        kind = record[0]
+        if kind == 'py':
+            obj = record[1]
+        elif kind == 'number':
+            obj = Number(record[1])
+        elif kind == 'string':
+            obj = String.from_chars(record[1])
+        elif kind == 'symbol':
+            obj = Symbol(record[1])
+        elif kind == 'internal':
+            obj = INTERNAL[record[1]]
+        elif kind == 'uninterned':
+            obj = Symbol.uninterned(record[1])
+        elif kind == 'constant':
+            obj = CONSTANTS[record[1]]
+        elif kind == 'list':
+            obj = [self.value(item) for item in record[1]]
+        elif kind == 'tuple':
+            obj = tuple(self.value(item) for item in record[1])
+        elif kind == 'primitive':
+            obj = global_env.namespace.get(Symbol(record[1]))
+            if obj is None:
+                raise SchemeException(f'the image refers to the unknown '
+                                      f'primitive {record[1]}')
+        elif kind == 'expr':
+            cls = getattr(exprs, record[1])
+            obj = cls(*[self.value(field) for field in record[2]])
+        elif kind == 'vector':
+            obj = NumVector.from_iter(record[1], record[2])
+        else:
+            raise SchemeException(f'invalid image record: {kind}')
+        self.objects[index] = obj
+        return obj
@@ -1,8 +1,114 @@
+import hashlib
+import os
+import sys
+import time
+
+import analysis
 import compiler
+import modules
 import parser
 import global_env
+import image
+
+from exceptions import *
 
 from frame import Frame
+from stypes import Cons, String, Symbol, CompoundProcedure
+from environment import Environment
+
+
+def object_size(obj):
+    return sys.getsizeof(obj) + sys.getsizeof(obj.__dict__)
+
+
+# the counted classes, by the name of their Statistics field, with the
+# estimated size in bytes of their instances
+ALLOCATIONS = {
+    'conses': (Cons, object_size(Cons(None, None))),
+    'strings': (String, object_size(String.from_chars(''))),
+    'environments': (Environment, object_size(Environment([], [], None))),
+    'frames': (Frame, object_size(Frame(None, None))),
+    'closures': (CompoundProcedure, object_size(CompoundProcedure(None, None,
+                                                                  None))),
+}
+
+
+def form_key(form):
+    """Returns a hash of the text of the top-level form @form. Forms which only
+    differ in whitespace and comments have the same key."""
+    return hashlib.sha1(str(form).encode()).hexdigest()
+
+
+def read_file(filename):
+    """Returns the absolute path of the file at @filename and the list of it's
+    top-level forms."""
+    path = os.path.abspath(filename)
+    with open(path) as f:
+        return path, list(parser.parse(f.read()))
+
+
+def definition_dependencies(form):
+    """If @form is a top-level definition, returns the defined variable, the
+    set of variables the definition refers to and whether it defines a
+    procedure (whose body is not evaluated by the definition). Otherwise
+    returns (None, None, None)."""
+    if not (analysis.is_form(form, analysis.DEFINE, 3)
+            or analysis.is_form(form, analysis.DEFINE_MEMOIZED, 3)):
+        return None, None, None
+    target = form.cadr
+    if type(target) is Cons:
+        return target.car, analysis.free_variables(form), True
+    if type(target) is not Symbol:
+        return None, None, None
+    is_procedure = analysis.is_form(form.caddr, analysis.LAMBDA)
+    return target, analysis.free_variables(form.caddr), is_procedure
+
+
+def allocation_counts():
+    """Returns the numbers of objects of the classes in ALLOCATIONS created so
+    far, followed by the number of characters of the strings."""
+    return (*(cls.allocated for cls, size in ALLOCATIONS.values()),
+            String.allocated_chars)
+
+
+class Statistics:
+    """Counters describing the work done by an Interpreter during its last call
+    to evaluate. They are reset at the beginning of every evaluation.
+    * attributes
+    ** steps: the number of steps executed
+    ** frames: the number of frames pushed onto the frame stack
+    ** tail_calls: the number of frames eliminated by tail call optimization
+    ** environments: the number of environments allocated
+    ** conses: the number of pairs allocated
+    ** strings: the number of strings allocated
+    ** closures: the number of compound procedures allocated
+    ** memory: an estimate of the bytes allocated for all of the above
+    ** max_depth: the maximum size reached by the frame stack
+
+    Allocations are counted process-wide while the evaluation runs, so they
+    include objects created by other interpreters running at the same time.
+    """
+
+    fields = ('steps', 'frames', 'tail_calls', 'environments', 'conses',
+              'strings', 'closures', 'memory', 'max_depth')
+
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        for field in self.fields:
+            setattr(self, field, 0)
+
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+
+    def __repr__(self):
+        counters = ', '.join(f'{field}={getattr(self, field)}'
+                             for field in self.fields)
+        return f'Statistics({counters})'
 
 
 class Interpreter:
@@ -12,6 +118,34 @@ class Interpreter:
     ** frame_stack: the frame stack
     ** last_value:
        the value of the last step (may be None if the last step returns no value)
+    ** stats:
+       a Statistics object describing the last evaluation
+    ** inline_table:
+       maps the names of the small procedures defined at the top level, whose
+       calls are inlined by the compiler, to their parameters and bodies
+    ** modules:
+       maps the paths of the modules imported so far to their
+       modules.Instance objects
+    ** loaded_files:
+       maps the absolute paths of the files loaded with ifile or reload to the
+       sets of the keys (see form_key) of their top-level forms which were
+       evaluated
+    ** output_port:
+       the port written to by display and the other output procedures when
+       they are not given a port. If None, they write to the standard output.
+    ** deadline:
+       a time.monotonic() value. When it is passed, the evaluation is
+       interrupted with a SchemeTimeoutError. None means no deadline.
+    ** max_memory:
+       the maximum number of bytes an evaluation may allocate (as estimated by
+       stats.memory), or None. Evaluations which allocate more are interrupted
+       with a SchemeMemoryError. The allocations are counted by the whole
+       process, so while evaluations run concurrently in other threads the
+       counters (and stats) include their allocations too, and the limit
+       should not be used.
+    ** max_depth:
+       the maximum size of the frame stack, or None. Evaluations which
+       exceed it are interrupted with a SchemeRecursionError.
     ** step_stack:
        The step stack of the bottom frame of the frame stack. self.step_stack is
        equivalent to self.frame.step_stack. ValueError is raised if this
@@ -29,6 +163,15 @@ class Interpreter:
         self.global_env = global_env.make()
         self.frame_stack = []
         self.last_value = None
+        self.stats = Statistics()
+        self.inline_table = {}
+        self.modules = {}
+        self.loaded_files = {}
+        self.output_port = None
+        self.deadline = None
+        self.max_memory = None
+        self.max_depth = None
+        self._start_counts = allocation_counts()
 
         
     @property
@@ -62,7 +205,7 @@ class Interpreter:
         environment and returns it's value."""
         
         slist = parser.parse(expr_str).car
-        expr = compiler.compile(slist)
+        expr = compiler.compile_toplevel(slist, self.inline_table)
         return self.evaluate(expr)
 
 
@@ -70,43 +213,173 @@ class Interpreter:
         """Evaluates the sequence of expressions encoded by @exprs_str in the
         global environment and returns a list of their values."""
         
-        exprs = (compiler.compile(slist) for slist in parser.parse(exprs_str))
+        exprs = (compiler.compile_toplevel(slist, self.inline_table)
+                 for slist in parser.parse(exprs_str))
         return [self.evaluate(expr) for expr in exprs]
 
     
     def ifile(self, filename):
         """Interprets the contents of the file at @filename in the global
-        environment. Returns the value of the last expression in the file."""
+        environment. Returns the value of the last expression in the file.
+        Relative paths of imports are resolved against the file's directory,
+        as in modules."""
         
-        with open(filename) as f:
-            text = f.read()
-            
-        begin_slist = parser.parse_begin(text)
-        begin_expr = compiler.compile(begin_slist)
-        return self.evaluate(begin_expr)
+        path, forms = read_file(filename)
+        directory = os.path.dirname(path)
+        begin_slist = Cons(analysis.BEGIN, Cons.from_iter(
+            modules.resolve_import(form, directory) for form in forms))
+        begin_expr = compiler.compile_toplevel(begin_slist, self.inline_table)
+        value = self.evaluate(begin_expr)
+        self.loaded_files[path] = set(map(form_key, forms))
+        return value
 
 
     def ifile_all(self, filename):
         """Interprets the contents of the file at @filename in the global
-        environment. Returns a list of the values of all top-level
+        environment, like ifile. Returns a list of the values of all top-level
         expressions."""
 
-        with open(filename) as f:
-            text = f.read()
+        path, forms = read_file(filename)
+        directory = os.path.dirname(path)
+        return [self.evaluate(compiler.compile_toplevel(
+                    modules.resolve_import(form, directory), self.inline_table))
+                for form in forms]
+
+
+    def reload(self, filename):
+        """Evaluates again the top-level forms of the file at @filename which
+        changed since it was last loaded, with ifile or reload. A form changed
+        if it's text (see form_key) is not the text of any form evaluated then.
+        Definitions of variables whose values are computed from variables
+        defined by the changed forms, directly or through procedures which
+        refer to them, are evaluated again as well, since they would otherwise
+        keep values computed from the old definitions. Forms are evaluated in
+        the order of the file, with imports resolved as by ifile. Definitions
+        which were removed from the file stay in the global environment.
+
+        If the file was not loaded before, all of it's forms are evaluated.
+        Returns the list of the evaluated forms."""
+
+        path, forms = read_file(filename)
+
+        evaluated = self.loaded_files.get(path)
+        keys = [form_key(form) for form in forms]
+        if evaluated is None:
+            selected = [True] * len(forms)
+        else:
+            selected = [key not in evaluated for key in keys]
+
+        # The variables whose values may differ from the ones computed with
+        # the old definitions: those defined by the selected forms, and the
+        # procedures which refer to them. Procedure definitions need not be
+        # evaluated again, since they look the variables up when called, but
+        # value definitions which refer to them do.
+        dirty = analysis.defined_names(
+            [form for form, chosen in zip(forms, selected) if chosen])
+        changed = True
+        while changed:
+            changed = False
+            for i, form in enumerate(forms):
+                var, free, is_procedure = definition_dependencies(form)
+                if (selected[i] or var is None or var in dirty
+                        or not free & dirty):
+                    continue
+                dirty.add(var)
+                changed = True
+                if not is_procedure:
+                    selected[i] = True
+
+        new_keys = {key for key, chosen in zip(keys, selected) if not chosen}
+        self.loaded_files[path] = new_keys
+        reloaded = []
+        directory = os.path.dirname(path)
+        for form, key, chosen in zip(forms, keys, selected):
+            if chosen:
+                self.evaluate(compiler.compile_toplevel(
+                    modules.resolve_import(form, directory), self.inline_table))
+                new_keys.add(key)
+                reloaded.append(form)
+        return reloaded
 
-        return self.istr_all(text)
+
+    def save_image(self, filename):
+        """Saves the global environment and the inline table to the file at
+        @filename (see the image module)."""
+        image.save(self, filename)
+
+
+    def load_image(self, filename):
+        """Replaces the global environment and the inline table by the ones
+        saved to the file at @filename with save_image."""
+        image.load(self, filename)
 
     
     def evaluate(self, expr):
         """Evaluates the Expr @expr in the global environment and returns it's
-        value."""
+        value. The counters in self.stats are reset and then updated to describe
+        this evaluation."""
+
+        stats = self.stats
+        stats.reset()
+        self._start_counts = allocation_counts()
+        steps = 0
+        limited = self.deadline is not None or self.max_memory is not None
         
         self.frame_stack = [Frame(expr.main_step, self.global_env)]
+        stats.max_depth = 1
         
-        # invariant: self.step_stack stack is not empty
-        while self.frame_stack:
-            step = self.step_stack.pop()
-            self.last_value = step(self)
-            if not self.step_stack:
-                self.frame_stack.pop()
+        try:
+            # invariant: self.step_stack stack is not empty
+            while self.frame_stack:
+                step = self.step_stack.pop()
+                steps += 1
+                if limited and not steps % 1024:
+                    self.check_limits()
+                self.last_value = step(self)
+                if not self.step_stack:
+                    self.frame_stack.pop()
+        finally:
+            stats.steps = steps
+            self.count_allocations()
         return self.last_value
+
+
+    def count_allocations(self):
+        """Sets the allocation counters of self.stats to the allocations made
+        since the beginning of the current evaluation. Returns stats.memory."""
+
+        stats = self.stats
+        counts = [now - start for now, start
+                  in zip(allocation_counts(), self._start_counts)]
+        memory = counts.pop() # the characters of the strings
+        for (field, (cls, size)), count in zip(ALLOCATIONS.items(), counts):
+            setattr(stats, field, count)
+            memory += count * size
+        stats.memory = memory
+        return memory
+
+
+    def uncounted(self, func, *args):
+        """Returns func(*args), leaving the objects it allocates out of the
+        allocation counters of the current evaluation. Used for the work the
+        compilers do lazily during evaluations, which is not done by the
+        evaluated code."""
+        before = allocation_counts()
+        try:
+            return func(*args)
+        finally:
+            self._start_counts = tuple(
+                start + now - then for start, now, then
+                in zip(self._start_counts, allocation_counts(), before))
+
+
+    def check_limits(self):
+        """Raises a SchemeTimeoutError if self.deadline has passed and a
+        SchemeMemoryError if the evaluation allocated more than
+        self.max_memory."""
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise SchemeTimeoutError('the evaluation took too long')
+        if (self.max_memory is not None
+                and self.count_allocations() > self.max_memory):
+            raise SchemeMemoryError(f'the evaluation allocated more than '
+                                    f'{self.max_memory} bytes')
@@ -0,0 +1,356 @@
+"""
+A just in time compiler for hot compound procedures. steptools.Caller counts
+the calls of every CompoundProcedure and when a procedure reaches THRESHOLD
+calls, compile_procedure translates the body of it's LambdaExpr to the source
+code of a python generator function and replaces the step of the procedure by
+one which runs that generator.
+
+The generated code evaluates constants, variables, if, begin, and, or, calls
+of primitive procedures, inlined calls and self tail calls directly, with the
+parameters of the procedure in python local variables. Self tail calls become
+iterations of a python loop. For calls of compound procedures the generator
+yields a request to the step machine:
+- (CALL, operator, operands): make the call and resume the generator with it's
+  value
+- (TAIL, operator, operands): make the call in place of the generator, so that
+  tail calls are still optimized
+- (PUSHED, n): a primitive procedure pushed steps onto the step stack at index
+  @n instead of returning a value (like apply does). Resume the generator with
+  the value of those steps.
+
+Bodies using other expressions (let forms, lambdas, assignments, definitions)
+are not compiled; their procedures keep running on the step machine.
+"""
+
+import exprs
+import stypes
+import steptools
+
+from exceptions import *
+from stypes import *
+
+# the number of calls after which a procedure is compiled
+THRESHOLD = 100
+
+CALL, TAIL, PUSHED = 'call', 'tail', 'pushed'
+
+
+class Unsupported(Exception):
+    """Raised by the code generator for expressions it can not translate."""
+    pass
+
+
+def compile_procedure(proc):
+    """Replaces the step of the CompoundProcedure @proc with one which runs
+    python code generated from it's body. The generated code is cached on the
+    LambdaExpr of @proc, so that the other procedures created by the same
+    lambda expression reuse it. Does nothing if the body can not be
+    compiled."""
+
+    lambda_expr = proc.lambda_expr
+    if lambda_expr is None:
+        return
+    if lambda_expr.jit_factory is None:
+        try:
+            lambda_expr.jit_factory = CodeGenerator(lambda_expr).factory()
+        except (Unsupported, SyntaxError, RecursionError):
+            lambda_expr.jit_factory = False
+    if lambda_expr.jit_factory:
+        proc.step = lambda_expr.jit_factory(proc)
+
+
+def run(inter, gen, value):
+    """Resumes the generator @gen with @value and handles the request it yields
+    (see the module's documentation). Returns the value of @gen if it
+    finishes."""
+
+    try:
+        request = gen.send(value)
+    except StopIteration as stop:
+        return stop.value
+
+    step_stack = inter.step_stack
+    kind = request[0]
+    if kind is CALL:
+        step_stack.append(Resumer(gen))
+        step_stack.append(steptools.Caller(request[1], request[2]))
+    elif kind is TAIL:
+        gen.close()
+        step_stack.append(steptools.Caller(request[1], request[2]))
+    else:
+        step_stack.insert(request[1], Resumer(gen))
+
+
+class Resumer:
+    """A step which resumes a generator with the value of the step before
+    it."""
+
+    def __init__(self, gen):
+        self.gen = gen
+
+
+    def __call__(self, inter):
+        return run(inter, self.gen, inter.last_value)
+
+
+def operator_of(env, var):
+    """Returns the value of @var in @env, or None if it is not bound."""
+    namespace = env.first_namespace_that_binds_the_var(var)
+    return None if namespace is None else namespace[var]
+
+
+def pytuple(names):
+    """Returns the source of a python tuple of the variables @names."""
+    return f'({"".join(name + ", " for name in names)})'
+
+
+class CodeGenerator:
+    """Translates a LambdaExpr to python source code.
+    * attributes
+    - self.lambda_expr: the LambdaExpr
+    - self.locals: maps the parameters of the lambda to python variable names
+    - self.constants: maps the names used in the code for scheme values to the
+      values
+    - self.lines: the lines of the body of the generator generated so far
+    - self.depth: the indentation level of the next line
+    """
+
+    def __init__(self, lambda_expr):
+        self.lambda_expr = lambda_expr
+        self.locals = {param: f'v{k}'
+                       for k, param in enumerate(lambda_expr.params)}
+        self.constants = {}
+        self.lines = []
+        self.depth = 3
+        self.temps = 0
+
+
+    def factory(self):
+        """Returns a function which takes a CompoundProcedure created by
+        self.lambda_expr and returns a step which evaluates it's body."""
+
+        for expr in self.lambda_expr.body[:-1]:
+            self.value(expr)
+        self.tail(self.lambda_expr.body[-1])
+
+        header = ['def factory(proc):',
+                  '    lookup = proc.env.lookup',
+                  '    def body(inter):',
+                  '        step_stack = inter.step_stack',
+                  '        namespace = inter.env.namespace']
+        header.extend(f'        {name} = namespace[{self.constant(param)}]'
+                      for param, name in self.locals.items())
+        header.append('        while True:')
+        footer = ['        yield # makes body a generator function',
+                  '    def step(inter):',
+                  '        return run(inter, body(inter), None)',
+                  '    return step']
+        source = '\n'.join(header + self.lines + footer) + '\n'
+
+        namespace = {'run': run, 'operator_of': operator_of,
+                     'CALL': CALL, 'TAIL': TAIL, 'PUSHED': PUSHED,
+                     'PrimitiveProcedure': PrimitiveProcedure,
+                     'CompoundProcedure': CompoundProcedure,
+                     'false': stypes.false, 'true': stypes.true,
+                     'unspecified': stypes.unspecified,
+                     **self.constants}
+        exec(compile(source, f'<jit {self.lambda_expr.funcname}>', 'exec'),
+             namespace)
+        return namespace['factory']
+
+
+    def emit(self, line):
+        self.lines.append('    ' * self.depth + line)
+
+
+    def indented(self, func, *args):
+        """Calls func(*args) with the lines it emits indented one level more.
+        Returns it's result."""
+        self.depth += 1
+        try:
+            return func(*args)
+        finally:
+            self.depth -= 1
+
+
+    def constant(self, value):
+        name = f'k{len(self.constants)}'
+        self.constants[name] = value
+        return name
+
+
+    def temp(self):
+        self.temps += 1
+        return f't{self.temps}'
+
+
+    def value(self, expr):
+        """Emits code which evaluates @expr. Returns the name of a python
+        variable or constant holding the value."""
+
+        etype = type(expr)
+        if etype is exprs.SelfEvaluatingExpr:
+            return self.constant(expr.value)
+        elif etype is exprs.QuoteExpr:
+            return self.constant(expr.slist)
+        elif etype is exprs.VariableExpr:
+            if expr.var in self.locals:
+                return self.locals[expr.var]
+            result = self.temp()
+            self.emit(f'{result} = lookup({self.constant(expr.var)})')
+            return result
+        elif etype is exprs.IfExpr:
+            result = self.temp()
+            self.branch(expr.predicate,
+                        lambda e: self.emit(f'{result} = {self.value(e)}'),
+                        expr.consequent, expr.alternative,
+                        lambda: self.emit(f'{result} = unspecified'))
+            return result
+        elif etype is exprs.BeginExpr:
+            for subexpr in expr.exprs[:-1]:
+                self.value(subexpr)
+            return self.value(expr.exprs[-1])
+        elif etype in (exprs.AndExpr, exprs.OrExpr):
+            result = self.temp()
+            self.connective(
+                expr, lambda e: self.emit(f'{result} = {self.value(e)}'), result)
+            return result
+        elif etype in (exprs.ApplicationExpr, exprs.SelfCallExpr):
+            operator, operands = self.operation(expr)
+            result = self.temp()
+            self.call(operator, operands, result)
+            return result
+        elif etype is exprs.InlineExpr:
+            result = self.temp()
+            self.inline(expr, lambda e: self.emit(f'{result} = {self.value(e)}'))
+            return result
+        raise Unsupported(etype.__name__)
+
+
+    def tail(self, expr):
+        """Emits code which evaluates @expr in tail position: the generator
+        returns it's value, makes a tail call or loops for self calls."""
+
+        etype = type(expr)
+        if etype is exprs.IfExpr:
+            self.branch(expr.predicate, self.tail, expr.consequent,
+                        expr.alternative, lambda: self.emit('return unspecified'))
+        elif etype is exprs.BeginExpr:
+            for subexpr in expr.exprs[:-1]:
+                self.value(subexpr)
+            self.tail(expr.exprs[-1])
+        elif etype in (exprs.AndExpr, exprs.OrExpr):
+            self.connective(expr, self.tail, None)
+        elif etype is exprs.ApplicationExpr:
+            self.tail_call(*self.operation(expr))
+        elif etype is exprs.SelfCallExpr:
+            self.self_call(expr)
+        elif etype is exprs.InlineExpr:
+            self.inline(expr, self.tail)
+        else:
+            self.emit(f'return {self.value(expr)}')
+
+
+    def branch(self, predicate, generate, consequent, alternative, otherwise):
+        """Emits an if statement testing @predicate whose arms are generated by
+        generate(consequent) and generate(alternative), or otherwise() if
+        @alternative is None."""
+
+        self.emit(f'if {self.value(predicate)} is not false:')
+        self.indented(generate, consequent)
+        self.emit('else:')
+        if alternative is None:
+            self.indented(otherwise)
+        else:
+            self.indented(generate, alternative)
+
+
+    def connective(self, expr, generate, result):
+        """Emits code for the AndExpr or OrExpr @expr. The last subexpression is
+        generated by @generate. The values of the others are assigned to the
+        variable @result, or returned if @result is None."""
+
+        is_and = type(expr) is exprs.AndExpr
+        if not expr.exprs:
+            self.emit(f'{result} = {"true" if is_and else "false"}'
+                      if result is not None
+                      else f'return {"true" if is_and else "false"}')
+            return
+
+        def generate_rest(subexprs):
+            if len(subexprs) == 1:
+                generate(subexprs[0])
+                return
+            value = self.value(subexprs[0])
+            test = 'is false' if is_and else 'is not false'
+            self.emit(f'if {value} {test}:')
+            self.indented(self.emit, f'{result} = {value}' if result is not None
+                          else f'return {value}')
+            self.emit('else:')
+            self.indented(generate_rest, subexprs[1:])
+
+        generate_rest(expr.exprs)
+
+
+    def operation(self, expr):
+        """Emits code evaluating the operator and operands of the application
+        @expr. Returns their names."""
+
+        if type(expr) is exprs.SelfCallExpr:
+            operator = self.value(exprs.VariableExpr(expr.var))
+            subexprs = expr.operands
+        else:
+            operator = self.value(expr.exprs[0])
+            subexprs = expr.exprs[1:]
+        return operator, [self.value(subexpr) for subexpr in subexprs]
+
+
+    def call(self, operator, operands, result):
+        args = ''.join(f', {operand}' for operand in operands)
+        self.emit(f'if type({operator}) is PrimitiveProcedure:')
+        self.depth += 1
+        self.emit('size = len(step_stack)')
+        self.emit(f'{result} = {operator}(inter{args})')
+        self.emit('if len(step_stack) != size:')
+        self.indented(self.emit, f'{result} = yield PUSHED, size')
+        self.depth -= 1
+        self.emit('else:')
+        self.indented(self.emit,
+                      f'{result} = yield CALL, {operator}, {pytuple(operands)}')
+
+
+    def tail_call(self, operator, operands):
+        args = ''.join(f', {operand}' for operand in operands)
+        self.emit(f'if type({operator}) is PrimitiveProcedure:')
+        self.indented(self.emit, f'return {operator}(inter{args})')
+        self.emit(f'yield TAIL, {operator}, {pytuple(operands)}')
+        self.emit('return')
+
+
+    def self_call(self, expr):
+        operator, operands = self.operation(expr)
+        params = self.lambda_expr.params
+        if len(operands) == len(params):
+            self.emit(f'if {operator} is proc:')
+            self.depth += 1
+            self.emit('inter.stats.tail_calls += 1')
+            self.emit('if (inter.deadline is not None'
+                      ' or inter.max_memory is not None):')
+            self.indented(self.emit, 'inter.check_limits()')
+            if operands:
+                names = ', '.join(self.locals[param] for param in params)
+                self.emit(f'{names} = {", ".join(operands)}')
+            self.emit('continue')
+            self.depth -= 1
+        self.tail_call(operator, operands)
+
+
+    def inline(self, expr, generate):
+        operator = self.temp()
+        var = self.constant(expr.var)
+        self.emit(f'{operator} = operator_of(inter.env, {var})')
+        self.emit(f'if (type({operator}) is CompoundProcedure'
+                  f' and {operator}.params is {self.constant(expr.params)}):')
+        self.indented(generate, expr.expansion)
+        self.emit('else:')
+        self.indented(generate, expr.call)
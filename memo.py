@@ -0,0 +1,103 @@
+"""Memoization of scheme procedures. A memoized procedure is a
+PrimitiveProcedure whose proc is a Memoizer. The Memoizer keeps the values of
+previous calls in an LRUCache keyed on the arguments of the calls."""
+
+import collections
+
+import steptools
+
+from stypes import *
+
+DEFAULT_MAXSIZE = 1000
+
+
+class LRUCache:
+    """A mapping of bounded size which evicts the least recently used entry when
+    it is full.
+    * attributes
+    - self.maxsize: the maximum number of entries, or None if unbounded
+    - self.hits: the number of successful lookups
+    - self.misses: the number of failed lookups
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+
+    def lookup(self, key):
+        """Returns a pair (found, value). @value is None if @found is False."""
+
+        entries = self._entries
+        if key in entries:
+            self.hits += 1
+            entries.move_to_end(key)
+            return True, entries[key]
+        self.misses += 1
+        return False, None
+
+
+    def store(self, key, value):
+        entries = self._entries
+        entries[key] = value
+        entries.move_to_end(key)
+        if self.maxsize is not None and len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def argkey(value):
+    """Returns a hashable python object such that two scheme values are equal?
+    exactly when their keys are equal."""
+
+    stype = type(value)
+    if stype is Number:
+        return value.pynum
+    elif stype is String:
+        return (String, value.chars)
+    elif stype is Cons:
+        keys = []
+        while type(value) is Cons:
+            keys.append(argkey(value.car))
+            value = value.cdr
+        keys.append(argkey(value))
+        return (Cons, tuple(keys))
+    else:
+        # symbols, booleans, nil and procedures are compared by identity
+        return value
+
+
+class Memoizer:
+    """The proc of a memoized PrimitiveProcedure.
+    * attributes
+    - self.func: the memoized procedure
+    - self.cache: an LRUCache mapping argument keys to values
+    """
+
+    def __init__(self, func, maxsize=DEFAULT_MAXSIZE):
+        self.func = func
+        self.cache = LRUCache(maxsize)
+
+
+    def __call__(self, inter, *args):
+        key = tuple(argkey(arg) for arg in args)
+        found, value = self.cache.lookup(key)
+        if found:
+            return value
+
+        def value_handler(inter):
+            self.cache.store(key, inter.last_value)
+            return inter.last_value
+
+        inter.step_stack.append(value_handler)
+        inter.step_stack.append(steptools.Caller(self.func, args))
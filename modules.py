@@ -0,0 +1,119 @@
+"""
+Modules are scheme files loaded with (import "path"). A module file either
+consists of a single form
+  (define-module name (export var ...) body ...)
+or of any top-level forms, in which case the module is named after the file
+and exports every variable it defines at the top level.
+
+Each module file is parsed and compiled once per process (again only when the
+file changes) and the compiled Module is shared by all interpreters. An
+interpreter instantiates a module the first time it imports it, by evaluating
+it's body in a new module environment whose parent is the global environment.
+Importing defines the exported variables in the environment of the import,
+bound to the values they have in the module at that time.
+"""
+
+import os
+
+import analysis
+import compiler
+import parser
+
+from stypes import *
+from exceptions import *
+
+DEFINE_MODULE, EXPORT, IMPORT = map(Symbol,
+                                    ('define-module', 'export', 'import'))
+
+# maps absolute paths to (modification time, Module) pairs
+_cache = {}
+
+
+class Module:
+    """
+    * attributes
+    - self.path: the absolute path of the module's file
+    - self.name: a Symbol
+    - self.exports: the list of exported variables
+    - self.body: the list of the Exprs of the module's top-level forms
+    """
+
+    def __init__(self, path, name, exports, body):
+        self.path = path
+        self.name = name
+        self.exports = exports
+        self.body = body
+
+
+    def __repr__(self):
+        return f'#[module {self.name}]'
+
+
+def load(path):
+    """Returns the Module compiled from the file at the absolute path @path,
+    compiling it only if it is not cached or the file changed since it was
+    compiled."""
+
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError as e:
+        raise SchemeException(f'cannot import "{path}": {e.strerror}')
+
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(path) as f:
+        forms = parser.parse(f.read())
+    module = compile_module(path, forms)
+    _cache[path] = (mtime, module)
+    return module
+
+
+def compile_module(path, forms):
+    """Compiles the scheme list of top-level forms @forms of the module file at
+    @path to a Module."""
+
+    if (forms is not nil and forms.cdr is nil
+            and analysis.is_form(forms.car, DEFINE_MODULE)):
+        form = forms.car
+        if not (len(form) >= 3 and type(form.cadr) is Symbol
+                and analysis.is_form(form.caddr, EXPORT)
+                and all(type(var) is Symbol for var in form.caddr.cdr)):
+            raise ValueError(f'Invalid define-module expression: {form}')
+        name, exports, forms = form.cadr, list(form.caddr.cdr), form.nthcdr(3)
+    else:
+        name = Symbol(os.path.splitext(os.path.basename(path))[0])
+        exports = sorted(analysis.defined_names(forms), key=lambda var: var.name)
+
+    directory = os.path.dirname(path)
+    inline_table = {}
+    body = [compiler.compile_toplevel(resolve_import(form, directory),
+                                      inline_table)
+            for form in forms]
+    return Module(path, name, exports, body)
+
+
+def resolve_import(form, directory):
+    """If @form is an import of a relative path, returns the import of the
+    path relative to @directory. Otherwise returns @form."""
+
+    if (analysis.is_form(form, IMPORT, 2) and type(form.cadr) is String
+            and not os.path.isabs(form.cadr.chars)):
+        path = os.path.join(directory, form.cadr.chars)
+        return Cons.from_iter([IMPORT, String.from_chars(path)])
+    return form
+
+
+class Instance:
+    """A module instantiated by an interpreter.
+    * attributes
+    - self.module: the Module
+    - self.env: the module environment
+    - self.ready: False while the body of the module is being evaluated
+    """
+
+    def __init__(self, module, env):
+        self.module = module
+        self.env = env
+        self.ready = False
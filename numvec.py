@@ -0,0 +1,193 @@
+"""
+Homogeneous numeric vectors. A NumVector holds machine numbers of a single kind
+('f64' for doubles, 's64' for signed 64 bit integers) in a numpy array when
+numpy is installed and in an array.array otherwise. The bulk operations defined
+here work on the whole vector at once, so they run in C instead of allocating a
+Number for every element.
+
+The elements of s64vectors are checked to fit in 64 bits. array.array raises an
+OverflowError when they do not, while numpy arrays silently wrap around, so the
+operations producing s64vectors check the range themselves and raise an
+OverflowError on both backends.
+"""
+
+import array
+import operator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from stypes import *
+
+# maps kinds to (array.array typecode, numpy dtype, python element type)
+KINDS = {'f64': ('d', 'float64', float),
+         's64': ('q', 'int64', int)}
+
+S64_MIN, S64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+class NumVector(SchemeValue):
+    """
+    * attributes
+    - self.kind: one of the keys of KINDS
+    - self.data: a numpy array or an array.array of the elements
+    """
+
+    def __init__(self, kind, data):
+        self.kind = kind
+        self.data = data
+
+
+    @staticmethod
+    def from_iter(kind, pynums):
+        """Returns a vector of the given kind with the python numbers @pynums as
+        elements."""
+        typecode, dtype, pytype = KINDS[kind]
+        if numpy is not None:
+            return NumVector(kind, numpy.fromiter(pynums, dtype=dtype))
+        return NumVector(kind, array.array(typecode, map(pytype, pynums)))
+
+
+    @staticmethod
+    def filled(kind, size, pynum):
+        typecode, dtype, pytype = KINDS[kind]
+        if numpy is not None:
+            return NumVector(kind, numpy.full(size, pynum, dtype=dtype))
+        return NumVector(kind, array.array(typecode, [pytype(pynum)]) * size)
+
+
+    def ref(self, index):
+        """Returns the element at @index as a python number."""
+        return KINDS[self.kind][2](self.data[index])
+
+
+    def set(self, index, pynum):
+        self.data[index] = pynum
+
+
+    def tolist(self):
+        """Returns the python list of the elements."""
+        return self.data.tolist()
+
+
+    def __len__(self):
+        return len(self.data)
+
+
+    def __eq__(self, other):
+        return (type(other) is NumVector and self.kind == other.kind
+                and self.tolist() == other.tolist())
+
+
+    def __hash__(self):
+        return hash((self.kind, tuple(self.tolist())))
+
+
+    def __repr__(self):
+        return f"#{self.kind}({' '.join(str(x) for x in self.tolist())})"
+
+
+def result_kind(*vectors):
+    """f64 is contagious: the result of combining vectors is an s64vector only
+    if all of them are s64vectors."""
+    return 's64' if all(v.kind == 's64' for v in vectors) else 'f64'
+
+
+def check_s64(*pynums):
+    """Raises an OverflowError unless the python ints @pynums all fit in the
+    element of an s64vector."""
+    for pynum in pynums:
+        if not S64_MIN <= pynum <= S64_MAX:
+            raise OverflowError(f'{pynum} does not fit in 64 bits')
+
+
+def bounds(vector):
+    """Returns the smallest and the largest element of the non-empty @vector
+    as python numbers."""
+    if numpy is not None:
+        return vector.data.min().item(), vector.data.max().item()
+    return min(vector.data), max(vector.data)
+
+
+def magnitude(vector):
+    """Returns the largest absolute value of an element of @vector, or 0 if it
+    is empty."""
+    if not len(vector):
+        return 0
+    low, high = bounds(vector)
+    return max(-low, high)
+
+
+def add(v1, v2):
+    """Returns the elementwise sum of @v1 and @v2, which must have the same
+    length."""
+    kind = result_kind(v1, v2)
+    if numpy is not None:
+        data = (v1.data + v2.data).astype(KINDS[kind][1])
+        # the sum wrapped around iff it's sign differs from the signs of both
+        # operands
+        if kind == 's64' and ((v1.data ^ data) & (v2.data ^ data) < 0).any():
+            raise OverflowError('the sum does not fit in 64 bits')
+        return NumVector(kind, data)
+    return NumVector.from_iter(kind, map(operator.add, v1.data, v2.data))
+
+
+def scale(vector, pynum):
+    """Returns @vector with every element multiplied by @pynum."""
+    kind = 's64' if vector.kind == 's64' and type(pynum) is int else 'f64'
+    if kind == 's64' and len(vector):
+        # the products are extreme at the extreme elements
+        low, high = bounds(vector)
+        check_s64(low * pynum, high * pynum)
+    if numpy is not None:
+        return NumVector(kind, (vector.data * pynum).astype(KINDS[kind][1]))
+    return NumVector.from_iter(kind, (x * pynum for x in vector.data))
+
+
+def total(vector):
+    """Returns the sum of the elements as a python number. The sum of an
+    s64vector is exact even if it does not fit in 64 bits."""
+    if vector.kind == 's64' and magnitude(vector) * len(vector) > S64_MAX:
+        return sum(vector.tolist())
+    if numpy is not None:
+        return vector.data.sum().item()
+    return sum(vector.data, KINDS[vector.kind][2]())
+
+
+def dot(v1, v2):
+    """Returns the dot product of @v1 and @v2 as a python number. The dot
+    product of s64vectors is exact even if it does not fit in 64 bits."""
+    if (result_kind(v1, v2) == 's64'
+            and magnitude(v1) * magnitude(v2) * len(v1) > S64_MAX):
+        return sum(map(operator.mul, v1.tolist(), v2.tolist()))
+    if numpy is not None:
+        return numpy.dot(v1.data, v2.data).item()
+    return sum(map(operator.mul, v1.data, v2.data),
+               KINDS[result_kind(v1, v2)][2]())
+
+
+# elementwise functions which vector-map applies in bulk, by name. Each of them
+# takes it's largest absolute value over a range of elements at one of the
+# ends of the range, so checking the ends is enough to rule out overflow.
+pyfuncs = {'abs': abs, 'square': lambda x: x * x, 'negative': operator.neg,
+           'add1': lambda x: x + 1, 'sub1': lambda x: x - 1}
+if numpy is not None:
+    ufuncs = {'abs': numpy.abs, 'square': numpy.square,
+              'negative': numpy.negative,
+              'add1': lambda data: data + 1, 'sub1': lambda data: data - 1}
+else:
+    ufuncs = pyfuncs
+
+
+def apply(name, vector):
+    """Returns the vector of the results of applying the function named @name
+    in ufuncs to every element of @vector."""
+    func = ufuncs[name]
+    if vector.kind == 's64' and len(vector):
+        low, high = bounds(vector)
+        check_s64(pyfuncs[name](low), pyfuncs[name](high))
+    if numpy is not None:
+        return NumVector(vector.kind, func(vector.data))
+    return NumVector.from_iter(vector.kind, map(func, vector.data))
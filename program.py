@@ -0,0 +1,69 @@
+"""
+Programs are scheme sources which are parsed and compiled once and can then be
+run by any number of interpreters:
+
+  program = compile_program('lib.scm')
+  values = program.run(Interpreter())
+
+Nothing in a Program depends on the interpreter running it. Calls inlined by
+the compiler check at run time that the called variable still holds the
+inlined procedure (see exprs.InlineExpr), and the bodies of procedures are
+compiled the first time one of them is called in any interpreter, and shared.
+"""
+
+import os
+
+import compiler
+import modules
+import parser
+
+from interpreter import Interpreter
+
+
+class Program:
+    """
+    * attributes
+    - self.path: the absolute path of the program's file, or None if it was
+      compiled from a string
+    - self.forms: the list of the program's top-level forms
+    - self.exprs: the list of their Exprs
+    """
+
+    def __init__(self, forms, path=None):
+        """Compiles the top-level forms @forms (a scheme list). If @path is
+        given, the relative paths of imports are resolved against it's
+        directory."""
+        self.path = path
+        self.forms = list(forms)
+        if path is not None:
+            directory = os.path.dirname(path)
+            forms = [modules.resolve_import(form, directory) for form in forms]
+        inline_table = {}
+        self.exprs = [compiler.compile_toplevel(form, inline_table)
+                      for form in forms]
+
+
+    def run(self, inter=None):
+        """Evaluates the program in the global environment of the Interpreter
+        @inter, or of a new one if @inter is None. Returns the list of the
+        values of the top-level forms."""
+        if inter is None:
+            inter = Interpreter()
+        return [inter.evaluate(expr) for expr in self.exprs]
+
+
+    def __repr__(self):
+        where = '' if self.path is None else f' "{self.path}"'
+        return f'#[program{where} {len(self.exprs)}]'
+
+
+def compile_program(source_or_path):
+    """Returns the Program compiled from @source_or_path, which is either the
+    path of a scheme file (a path-like object, or a string naming an existing
+    file) or a string of scheme source."""
+
+    if isinstance(source_or_path, os.PathLike) or os.path.isfile(source_or_path):
+        path = os.path.abspath(source_or_path)
+        with open(path) as f:
+            return Program(parser.parse(f.read()), path)
+    return Program(parser.parse(source_or_path))
@@ -0,0 +1,247 @@
+"""
+A long-lived server which evaluates scheme code for its clients. It keeps a
+pool of interpreters which are created, and have the prelude files loaded,
+when the server starts, so requests do not pay for that.
+
+The protocol is JSON lines: every request and every response is a JSON object
+on a line of it's own. A request is one of
+  {"id": ..., "code": "<scheme source>", "timeout": <seconds>}
+  {"id": ..., "batch": ["<scheme source>", ...], "timeout": <seconds>}
+"id" is optional and returned unchanged. "timeout" is optional and overrides
+the server's default. The response to a "code" request is
+  {"id": ..., "values": ["<printed value>", ...], "output": "<displayed text>"}
+or {"id": ..., "error": "<message>"} if the evaluation failed. The response to
+a "batch" request is {"id": ..., "results": [<response>, ...]}, with one
+response (without "id") for every source in the batch. The timeout applies to
+every source of a batch separately.
+
+Every source is evaluated by a single interpreter of the pool. Afterwards the
+interpreter's global environment is restored to it's state after the prelude
+was loaded, so that definitions do not leak from one request to the next.
+Objects created by the prelude can still be mutated by requests (for example
+with set-car! or hash-table-set!).
+
+usage:
+  python server.py --socket /tmp/scheme.sock --pool 4 --prelude lib.scm
+  python server.py --stdio --prelude lib.scm
+  python server.py --save-image lib.image --prelude lib.scm
+  python server.py --socket /tmp/scheme.sock --image lib.image
+
+With --image the interpreters are restored from an image saved with
+--save-image (see the image module) instead of loading the prelude files.
+
+--max-memory requires a pool of a single interpreter. The allocations of an
+evaluation are measured with counters shared by the whole process (see
+Interpreter.max_memory), so evaluations running concurrently in other threads
+would count against each other's limit.
+"""
+
+import argparse
+import io
+import json
+import os
+import queue
+import socketserver
+import sys
+import time
+
+from interpreter import Interpreter
+from exceptions import *
+from stypes import *
+
+DEFAULT_TIMEOUT = 10.0
+
+
+class Worker:
+    """An interpreter of the pool, together with the state it is reset to after
+    every evaluation.
+    * attributes
+    - self.inter: the Interpreter
+    - self.namespace: a copy of the global namespace after the prelude
+    - self.inline_table: a copy of the inline table after the prelude
+    - self.modules: a copy of the instantiated modules after the prelude
+    """
+
+    def __init__(self, preludes, max_depth=None, max_memory=None, image=None):
+        """@image is the path of an image loaded before @preludes, or None."""
+        self.inter = Interpreter()
+        if image is not None:
+            self.inter.load_image(image)
+        for path in preludes:
+            self.inter.ifile(path)
+        self.inter.max_depth = max_depth
+        self.inter.max_memory = max_memory
+        self.namespace = dict(self.inter.global_env.namespace)
+        self.inline_table = dict(self.inter.inline_table)
+        self.modules = dict(self.inter.modules)
+
+
+    def evaluate(self, code, timeout):
+        """Evaluates the scheme source @code and returns a response (see the
+        module's documentation)."""
+
+        inter = self.inter
+        # the port stands for the standard output, so the code can not close
+        # it before the output is collected
+        port = inter.output_port = OutputPort(io.StringIO(), closable=False)
+        inter.deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            values = inter.istr_all(code)
+        except Exception as e:
+            return {'error': f'{type(e).__name__}: {e}'}
+        finally:
+            inter.output_port = inter.deadline = None
+            self.reset()
+        return {'values': [str(value) for value in values],
+                'output': port.file.getvalue()}
+
+
+    def reset(self):
+        inter = self.inter
+        namespace = inter.global_env.namespace
+        namespace.clear()
+        namespace.update(self.namespace)
+        inter.inline_table = dict(self.inline_table)
+        inter.modules = dict(self.modules)
+
+
+class Pool:
+    """A fixed number of Workers, shared by the threads serving clients. The
+    limits @max_depth and @max_memory apply to every evaluation (see
+    Interpreter). @max_memory can only be given for a pool of size 1 (see the
+    module's documentation)."""
+
+    def __init__(self, size, preludes=(), timeout=DEFAULT_TIMEOUT,
+                 max_depth=None, max_memory=None, image=None):
+        if max_memory is not None and size > 1:
+            raise ValueError('max_memory requires a pool of size 1, since '
+                             'concurrent evaluations share the allocation '
+                             'counters')
+        self.timeout = timeout
+        self.workers = queue.Queue()
+        for k in range(size):
+            self.workers.put(Worker(preludes, max_depth, max_memory, image))
+
+
+    def evaluate(self, code, timeout=None):
+        """Evaluates @code with one of the workers, waiting for one to become
+        available. Returns the response."""
+
+        worker = self.workers.get()
+        try:
+            return worker.evaluate(code, self.timeout if timeout is None
+                                   else timeout)
+        finally:
+            self.workers.put(worker)
+
+
+    def handle(self, request):
+        """Returns the response to the request @request, a python object decoded
+        from JSON."""
+
+        if not isinstance(request, dict):
+            return {'error': 'a request must be a JSON object'}
+        timeout = request.get('timeout')
+        if 'code' in request:
+            response = self.evaluate(request['code'], timeout)
+        elif 'batch' in request:
+            response = {'results': [self.evaluate(code, timeout)
+                                    for code in request['batch']]}
+        else:
+            response = {'error': 'a request must have "code" or "batch"'}
+        if 'id' in request:
+            response['id'] = request['id']
+        return response
+
+
+    def handle_line(self, line):
+        """Returns the JSON line of the response to the JSON line @line."""
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = {'error': f'invalid JSON: {e}'}
+        else:
+            try:
+                response = self.handle(request)
+            except Exception as e:
+                # a bug must not bring down the server for the other requests
+                response = {'error': f'internal error: {type(e).__name__}: {e}'}
+                if isinstance(request, dict) and 'id' in request:
+                    response['id'] = request['id']
+        return json.dumps(response) + '\n'
+
+
+def serve_stdio(pool, infile=sys.stdin, outfile=sys.stdout):
+    """Answers the requests read from @infile, one at a time, until the end of
+    the file."""
+    for line in infile:
+        if line.strip():
+            outfile.write(pool.handle_line(line))
+            outfile.flush()
+
+
+def serve_socket(pool, path):
+    """Serves the clients connecting to the Unix domain socket at @path, each
+    in a thread of it's own, until interrupted."""
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if line.strip():
+                    self.wfile.write(pool.handle_line(line).encode())
+
+    if os.path.exists(path):
+        os.unlink(path)
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(
+        description='Evaluates scheme code for clients.')
+    where = argparser.add_mutually_exclusive_group(required=True)
+    where.add_argument('--socket', help='the path of the Unix domain socket')
+    where.add_argument('--stdio', action='store_true',
+                       help='read requests from stdin, write responses to stdout')
+    where.add_argument('--save-image',
+                       help='save an image of the loaded prelude and exit')
+    argparser.add_argument('--pool', type=int, default=4,
+                           help='the number of interpreters (default 4)')
+    argparser.add_argument('--prelude', action='append', default=[],
+                           help='a file loaded by every interpreter at start up')
+    argparser.add_argument('--image',
+                           help='an image loaded by every interpreter at start up')
+    argparser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                           help='the default timeout of an evaluation in seconds')
+    argparser.add_argument('--max-depth', type=int,
+                           help='the maximum depth of the frame stack')
+    argparser.add_argument('--max-memory', type=int,
+                           help='the maximum bytes allocated by an evaluation '
+                           '(requires --pool 1 with --socket)')
+    args = argparser.parse_args(argv)
+
+    if args.save_image:
+        worker = Worker(args.prelude, image=args.image)
+        worker.inter.save_image(args.save_image)
+        return 0
+    size = 1 if args.stdio else args.pool
+    if args.max_memory is not None and size > 1:
+        argparser.error('--max-memory requires --pool 1 with --socket')
+    pool = Pool(size, args.prelude, args.timeout,
+                args.max_depth, args.max_memory, args.image)
+    if args.stdio:
+        serve_stdio(pool)
+    else:
+        try:
+            serve_socket(pool, args.socket)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
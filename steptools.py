@@ -1,3 +1,4 @@
+import jit
 import stypes
 
 from exceptions import *
@@ -45,26 +46,124 @@ class Caller:
 
         
     def __call__(self, inter):
-        operator = self.operator
-        operands = self.operands
-        
-        if type(operator) is PrimitiveProcedure:
-            return operator(inter, *operands)
-        elif type(operator) is CompoundProcedure:
-            params, step, env = operator.parts
+        return call(inter, self.operator, self.operands)
 
-            if len(params) != len(operands):
-                raise SchemeArityError(f'Expected {len(params)} arguments, '
-                                       f'but got {len(operands)}.')
 
-            new_env = Environment(params, operands, env)
+def call(inter, operator, operands):
+    """Applies @operator to the sequence @operands. Returns the value if
+    @operator is primitive. If it is compound, pushes the frame of the call
+    (replacing the current frame if it has no more steps)."""
 
-            if not inter.step_stack: # tail call optimization
-                inter.frame_stack.pop()
+    if type(operator) is PrimitiveProcedure:
+        return operator(inter, *operands)
+    elif type(operator) is CompoundProcedure:
+        operator.calls += 1
+        if operator.calls == jit.THRESHOLD:
+            inter.uncounted(jit.compile_procedure, operator)
+        params, step, env = operator.parts
+        if type(step) is LazyStep:
+            step = operator.step = inter.uncounted(
+                step.lambda_expr.compile_body)
 
-            inter.frame_stack.append(Frame(step, new_env))
-        else:
-            raise SchemeTypeError(f'{operator} is not applicable')
+        if len(params) != len(operands):
+            raise SchemeArityError(f'Expected {len(params)} arguments, '
+                                   f'but got {len(operands)}.')
+
+        new_env = Environment(params, operands, env)
+
+        frame_stack = inter.frame_stack
+        if not inter.step_stack: # tail call optimization
+            frame_stack.pop()
+            inter.stats.tail_calls += 1
+
+        frame_stack.append(Frame(step, new_env))
+        depth = len(frame_stack)
+        if depth > inter.stats.max_depth:
+            inter.stats.max_depth = depth
+            if inter.max_depth is not None and depth > inter.max_depth:
+                raise SchemeRecursionError(
+                    f'the frame stack exceeded {inter.max_depth} frames')
+    else:
+        raise SchemeTypeError(f'{operator} is not applicable')
+
+
+def call_each(inter, func, arglists, handler, finish):
+    """Calls @func with each of the argument sequences of the iterator
+    @arglists, in order, and passes each sequence and the value of the call
+    to @handler before the next sequence is fetched. The value is the value
+    of finish() after the last call.
+
+    If @func is primitive the calls are made directly in a python loop,
+    unless a call pushes steps (as apply does), in which case the loop goes on
+    when they are done. If @func is compound, the frame of each call is pushed
+    under a single step which resumes the loop, so no step is allocated per
+    call."""
+
+    args = None
+
+    def resume(inter):
+        handler(args, inter.last_value)
+        return loop(inter)
+
+    def loop(inter):
+        nonlocal args
+        step_stack = inter.step_stack
+        for args in arglists:
+            step_stack.append(resume)
+            if type(func) is PrimitiveProcedure:
+                value = func(inter, *args)
+                if step_stack[-1] is not resume:
+                    return # resume gets the value of the pushed steps
+                step_stack.pop()
+                handler(args, value)
+            else:
+                call(inter, func, args)
+                return
+        return finish()
+
+    return loop(inter)
+
+
+class LazyStep:
+    """The step of the body of a procedure which is not compiled yet (see
+    exprs.LambdaExpr). When called it compiles the body and pushes the
+    compiled step. call replaces the LazySteps of the procedures it calls by
+    the compiled steps, so this happens at most once per procedure."""
+
+    def __init__(self, lambda_expr):
+        self.lambda_expr = lambda_expr
+
+
+    def __call__(self, inter):
+        inter.step_stack.append(
+            inter.uncounted(self.lambda_expr.compile_body))
+
+
+class EnvironmentRestorer:
+    """A step which makes self.env the environment of the current frame again.
+    It's value is the value of the step before it."""
+
+    def __init__(self, env):
+        self.env = env
+
+
+    def __call__(self, inter):
+        inter.frame.env = self.env
+        return inter.last_value
+
+
+def enter_environment(inter, env):
+    """Makes @env the environment of the current frame of @inter. The steps
+    pushed after this call run in @env. If the frame has more work to do after
+    them, a step which restores the old environment is pushed first, unless
+    there already is such a step on top of the step stack (as happens in loops
+    whose body is a let). Otherwise nothing is pushed, so tail calls made in
+    @env are still optimized."""
+
+    step_stack = inter.step_stack
+    if step_stack and type(step_stack[-1]) is not EnvironmentRestorer:
+        step_stack.append(EnvironmentRestorer(inter.frame.env))
+    inter.frame.env = env
 
         
 def Identity(value):
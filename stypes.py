@@ -41,6 +41,16 @@ class Symbol(SchemeValue):
             return newsymbol
 
         return symbol
+
+    @staticmethod
+    def uninterned(astr):
+        """Returns a new symbol named @astr which is not interned, so it is
+        different from every symbol produced by the parser. The compiler uses
+        such symbols as the heads of its internal forms."""
+        
+        symbol = object.__new__(Symbol)
+        symbol.name = astr
+        return symbol
         
     def __repr__(self):
         return self.name
@@ -79,6 +89,9 @@ class Number(SchemeValue):
     def __eq__(self, other):
         return type(self) is type(other) and self.pynum == other.pynum
 
+    def __hash__(self):
+        return hash(self.pynum)
+
     def __lt__(self, other):
         return type(self) is type(other) and self.pynum < other.pynum
 
@@ -98,14 +111,27 @@ class Number(SchemeValue):
 @importit    
 class String(SchemeValue):
     """
+    * class attributes
+    - String.allocated: the number of strings created so far by the process
+    - String.allocated_chars: the total length of those strings
     * attributes
     - self.chars: a python string which represents the characters of the string
     """
 
+    allocated = 0
+    allocated_chars = 0
+
     def __init__(self, astr):
         """Converts the python string @astr to a Scheme string having
         the same letters (except that escapes in @astr are actually
         expanded in the resulting scheme string)"""
+
+        String.allocated += 1
+        String.allocated_chars += len(astr)
+        if '\\' not in astr:
+            # nothing to expand
+            self.chars = astr
+            return
         
         chars = []
         escapes = {'t': '\t', 'n': '\n', '\\': '\\', '"': '"'}
@@ -129,11 +155,28 @@ class String(SchemeValue):
                 i += 1
                 
         self.chars = ''.join(chars)
+
+
+    @staticmethod
+    def from_chars(chars):
+        """Returns the scheme string having exactly the characters of the
+        python string @chars. Unlike the constructor, no escapes are
+        expanded, so this is the way to make scheme strings out of text that
+        is already decoded."""
+        String.allocated += 1
+        String.allocated_chars += len(chars)
+        result = String.__new__(String)
+        result.chars = chars
+        return result
         
     
     def __eq__(self, other):
         return type(other) is String and self.chars == other.chars
 
+
+    def __hash__(self):
+        return hash(self.chars)
+
     
     def __repr__(self):
         return f'"{self.chars}"'
@@ -166,7 +209,16 @@ Boolean._objects[False] = false
 
 @importit
 class Cons(SchemeValue):
+    """
+    * class attributes
+    - Cons.allocated: the number of pairs created so far by the process. Used
+      by the interpreter to count the pairs allocated during an evaluation.
+    """
+
+    allocated = 0
+    
     def __init__(self, car, cdr):
+        Cons.allocated += 1
         self.car = car
         self.cdr = cdr
 
@@ -285,9 +337,29 @@ class Cons(SchemeValue):
 
         
     def __eq__(self, other):
-        return (type(other) is type(self)
-                and self.car == other.car
-                and self.cdr == other.cdr)
+        """Like __hash__, follows the cdr direction iteratively."""
+        pair = self
+        while type(pair) is Cons:
+            if type(other) is not Cons:
+                return False
+            if pair is other:
+                return True
+            if not pair.car == other.car:
+                return False
+            pair, other = pair.cdr, other.cdr
+        return pair == other
+
+    
+    def __hash__(self):
+        """Consistent with __eq__: equal pairs have equal hashes. Only the car
+        direction is followed recursively, so long lists are fine."""
+        hashes = []
+        pair = self
+        while type(pair) is Cons:
+            hashes.append(hash(pair.car))
+            pair = pair.cdr
+        hashes.append(hash(pair))
+        return hash(tuple(hashes))
 
     
     def __len__(self):
@@ -311,6 +383,9 @@ class NilType(SchemeValue):
 
     def __iter__(self):
         return iter([])
+
+    def __len__(self):
+        return 0
     
 nil = NilType()
 nil.car = nil.cdr = nil
@@ -324,25 +399,178 @@ class UnspecifiedType(SchemeValue):
 unspecified = UnspecifiedType()
 
 
+class EofType(SchemeValue):
+    """The type of the object returned by input procedures at the end of the
+    input."""
+    def __repr__(self):
+        return '#!eof'
+
+eof = EofType()
+
+
 @importit
 class CompoundProcedure(SchemeValue):
-    def __init__(self, params, step, env, name=None):
+    """
+    * class attributes
+    - CompoundProcedure.allocated: the number of procedures created so far by
+      the process
+    """
+
+    allocated = 0
+    
+    def __init__(self, params, step, env, name=None, lambda_expr=None):
         """
         @params must be a list of symbols
         @step must be a step
         @env must be an environment
-        @name must be a String or None"""
+        @name must be a String or None
+        @lambda_expr is the LambdaExpr which created the procedure, or None
+
+        self.calls counts the calls of the procedure. After enough of them
+        the jit module replaces self.step by a faster equivalent."""
         
         self.params = params
         self.step = step
         self.env = env
         self.name = name
+        CompoundProcedure.allocated += 1
+        self.lambda_expr = lambda_expr
+        self.calls = 0
 
     @property
     def parts(self):
         return (self.params, self.step, self.env)
     
 
+@importit
+class Promise(SchemeValue):
+    """The value of (delay expr): the value of expr, computed the first time
+    the promise is forced.
+    * attributes
+    - self.thunk: the procedure without parameters computing the value, or None
+      once the promise is forced
+    - self.value: the value, or None until the promise is forced
+    """
+
+    def __init__(self, thunk, value=None):
+        self.thunk = thunk
+        self.value = value
+
+    @property
+    def is_forced(self):
+        return self.thunk is None
+
+    def __repr__(self):
+        return '#[promise]'
+
+
+def eqv_key(obj):
+    """Two objects are eqv? exactly when their eqv_keys are equal. Numbers are
+    compared by value, everything else by identity."""
+    return obj if type(obj) is Number else id(obj)
+
+
+@importit
+class HashTable(SchemeValue):
+    """
+    * attributes
+    - self.kind: one of 'eq', 'eqv' and 'equal'; the predicate used to compare
+      keys
+    - self.entries: a dict which maps the python key of every scheme key (see
+      HashTable.keyfuncs) to a (key, value) pair
+    """
+
+    # maps kinds to functions which transform a scheme key to a python dict key
+    keyfuncs = {'eq': id, 'eqv': eqv_key, 'equal': lambda key: key}
+
+    def __init__(self, kind='equal'):
+        self.kind = kind
+        self.keyfunc = HashTable.keyfuncs[kind]
+        self.entries = {}
+
+
+    def lookup(self, key):
+        """Returns the value associated with @key. If there is none, a
+        KeyError is raised."""
+        return self.entries[self.keyfunc(key)][1]
+
+
+    def set(self, key, value):
+        self.entries[self.keyfunc(key)] = (key, value)
+
+
+    def delete(self, key):
+        """Removes the entry for @key if there is one."""
+        self.entries.pop(self.keyfunc(key), None)
+
+
+    def __contains__(self, key):
+        return self.keyfunc(key) in self.entries
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def items(self):
+        """Returns a list of the (key, value) pairs of @self."""
+        return list(self.entries.values())
+
+
+    def __repr__(self):
+        return f'#[hash-table {self.kind} {len(self)}]'
+
+
+@importit
+class Port(SchemeValue):
+    """Base class for ports.
+    * attributes
+    - self.file: the python text file object the port reads or writes
+    - self.closable: False for ports whose file is not owned by the program,
+      like the standard output. Closing them does nothing.
+    """
+
+    def __init__(self, file, closable=True):
+        self.file = file
+        self.closable = closable
+
+    def close(self):
+        if self.closable:
+            self.file.close()
+
+    @property
+    def is_closed(self):
+        return self.file.closed
+
+
+@importit
+class OutputPort(Port):
+    def write(self, chars):
+        """Writes the python string @chars to the port."""
+        self.file.write(chars)
+
+    def __repr__(self):
+        return '#[output-port]'
+
+
+@importit
+class InputPort(Port):
+    def read_line(self):
+        """Returns the next line as a python string without the line
+        terminator, or None at the end of the input."""
+        line = self.file.readline()
+        if not line:
+            return None
+        return line[:-1] if line.endswith('\n') else line
+
+    def read_char(self):
+        """Returns the next character, or None at the end of the input."""
+        return self.file.read(1) or None
+
+    def __repr__(self):
+        return '#[input-port]'
+
+
 @importit    
 class PrimitiveProcedure:
     def __init__(self, proc):
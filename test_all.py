@@ -1,9 +1,19 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
 import unittest
 import math
 import random
 
 from interpreter import *
+import jit
+import program
+import server
 from stypes import *
+from exceptions import *
 
 class TestAll(unittest.TestCase):
     def setUp(self):
@@ -30,6 +40,16 @@ class TestAll(unittest.TestCase):
         self.assertEqual(values, [None, None, None, Number(100),
                                   Boolean(True), Boolean(True), Boolean(True)])
 
+        # square is inlined into sum-of-squares without binding it's argument
+        # again, so sum-of-squares creates no frames for it and can be compiled
+        self.assertEqual(self.i.istr('(sum-of-squares 3 4)'), Number(25))
+        self.assertEqual(self.i.stats.frames, 1)
+        self.assertEqual(self.i.istr('(f 3)'), Number(52))
+        self.assertEqual(self.i.stats.frames, 2) # f and the let of the call
+        sos = self.i.istr('sum-of-squares')
+        jit.compile_procedure(sos)
+        self.assertIsNot(sos.step, sos.lambda_expr.body_step)
+
         
     def test_fact(self):
         code = """
@@ -237,5 +257,858 @@ class TestAll(unittest.TestCase):
                          (* b product))))""")
 
         doit()
+
+
+    def test_stats(self):
+        self.i.istr_all("""
+        (define (fact-rec n)
+          (if (= n 0)
+              1
+              (* n (fact-rec (sub1 n)))))
+
+        (define (fact-iter n acc)
+          (if (= n 0)
+              acc
+              (fact-iter (sub1 n) (* n acc))))""")
+
+        self.i.istr('(fact-rec 20)')
+        stats = self.i.stats
+        self.assertEqual(stats.environments, 21)
+        self.assertEqual(stats.frames, 22)
+        self.assertEqual(stats.tail_calls, 1) # the call from the top level
+        self.assertEqual(stats.max_depth, 21)
+        self.assertGreater(stats.steps, 0)
+
+        self.i.istr('(fact-iter 20 1)')
+        stats = self.i.stats
+        self.assertEqual(stats.environments, 1) # the self calls reuse it
+        self.assertEqual(stats.tail_calls, 21)
+        self.assertEqual(stats.max_depth, 1)
+
+        self.i.istr("(list 1 2 3)")
+        self.assertEqual(self.i.stats.conses, 3)
+        self.assertEqual(self.i.stats.environments, 0)
+
+
+
+    def test_self_tail_calls(self):
+        self.i.istr_all("""
+        (define (sum-to n)
+          (define (iter k acc)
+            (if (= k 0) acc (iter (sub1 k) (+ acc k))))
+          (iter n 0))
+
+        (define (adders n acc)
+          (if (= n 0)
+              acc
+              (adders (sub1 n) (cons (lambda (x) (+ x n)) acc))))
+
+        (define (countdown n)
+          (if (= n 0) 'done (countdown (sub1 n))))
+        (define original countdown)
+        (define (countdown n) 'replaced)""")
+
+        self.assertEqual(self.i.istr('(sum-to 1000)'), Number(500500))
+        self.assertEqual(self.i.stats.environments, 2)
+        self.assertEqual(self.i.stats.max_depth, 1)
+
+        # the lambdas capture a separate environment each
+        self.assertEqual(self.i.istr('(map (lambda (f) (f 0)) (adders 3 nil))'),
+                         Cons.from_iter([Number(1), Number(2), Number(3)]))
+
+        # the name is looked up at run time, so redefining it is respected
+        self.assertEqual(self.i.istr('(original 10)'), Symbol('replaced'))
+
+
+    def test_hoisted_lambdas(self):
+        self.i.istr_all("""
+        (define (small lst) (filter (lambda (x) (< x 10)) lst))
+        (define (below n lst) (filter (lambda (x) (< x n)) lst))
+        (define (getter) (lambda (x) x))
+        (define (adder n) (lambda (x) (+ x n)))""")
+
+        self.assertEqual(self.i.istr("(small '(1 20 3 40))"),
+                         Cons.from_iter([Number(1), Number(3)]))
+        self.assertEqual(self.i.istr("(below 5 '(1 20 3 40))"),
+                         Cons.from_iter([Number(1), Number(3)]))
+
+        # a lambda without free local variables is created once
+        self.assertEqual(self.i.istr('(eq? (getter) (getter))'), Boolean(True))
+        self.assertEqual(self.i.istr('(eq? (adder 1) (adder 1))'),
+                         Boolean(False))
+        self.i.istr('(getter)')
+        self.assertEqual(self.i.stats.environments, 1)
+
+
+    def test_flat_closures(self):
+        self.i.istr_all("""
+        (define (make-adder big n) (lambda (x) (+ x n)))
+        (define add5 (make-adder (list 1 2 3) 5))
+
+        (define (make-counter)
+          (let ((count 0))
+            (lambda () (set! count (+ count 1)) count)))
+        (define counter (make-counter))
+
+        (define (parity n)
+          (define (even? n) (if (= n 0) #t (odd? (- n 1))))
+          (define (odd? n) (if (= n 0) #f (even? (- n 1))))
+          (lambda () (even? n)))""")
+
+        # only the referenced variable is kept
+        add5 = self.i.istr('add5')
+        self.assertEqual(list(add5.env.namespace), [Symbol('n')])
+        self.assertIs(add5.env.parent, self.i.global_env)
+        self.assertEqual(self.i.istr('(add5 10)'), Number(15))
+
+        # assigned and internally defined variables are shared, not copied
+        self.assertEqual(self.i.istr_all('(counter) (counter)'),
+                         [Number(1), Number(2)])
+        self.assertEqual(self.i.istr('((parity 7))'), Boolean(False))
+
+
+    def test_inlining(self):
+        self.i.istr_all("""
+        (define (square x) (* x x))
+        (define (sum-of-squares x y) (+ (square x) (square y)))
+        (define (f n) (sum-of-squares n (+ n 1)))""")
+
+        self.assertEqual(self.i.istr('(f 3)'), Number(25))
+        self.assertEqual(self.i.stats.frames, 2) # f and the let binding y
+
+        # an argument naming a parameter bound by the let is bound too
+        self.i.istr_all('''
+        (define (plus x y) (+ x y))
+        (define (g y) (plus y (* y 2)))''')
+        self.assertEqual(self.i.istr('(g 3)'), Number(9))
+
+        # procedures whose bodies are atoms
+        self.i.istr_all('''
+        (define (id x) x)
+        (define (one) 1)
+        (define (h y) (+ (id y) (one)))''')
+        self.assertEqual(self.i.istr('(h 3)'), Number(4))
+
+        # redefinitions and assignments are respected
+        self.i.istr('(define (square x) (+ x x))')
+        self.assertEqual(self.i.istr('(f 3)'), Number(14))
+        self.i.istr('(set! sum-of-squares -)')
+        self.assertEqual(self.i.istr('(f 3)'), Number(-1))
+        self.assertEqual(self.i.istr('(let ((square 1)) (sum-of-squares 2 3))'),
+                         Number(-1))
+
+
+    def test_jit(self):
+        self.i.istr_all("""
+        (define (fib n)
+          (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+
+        (define (count n acc)
+          (if (= n 0) acc (count (- n 1) (+ acc 1))))
+
+        (define (twice f x) (apply f (list (f x))))
+        (define (double-all lst) (map (lambda (x) (* x offset)) lst))
+        (define offset 2)
+        (define (first x) (car x))""")
+
+        self.assertEqual(self.i.istr('(fib 20)'), Number(6765))
+        fib = self.i.istr('fib')
+        self.assertIsNot(fib.step, fib.lambda_expr.body_step)
+
+        self.assertEqual(self.i.istr('(count 200 0)'), Number(200))
+        self.assertEqual(self.i.istr('(count 20000 0)'), Number(20000))
+        self.assertEqual(self.i.stats.max_depth, 1)
+
+        # calls of compound procedures from primitives
+        for k in range(jit.THRESHOLD + 1):
+            self.assertEqual(self.i.istr('(twice (lambda (x) (* x 3)) 1)'),
+                             Number(9))
+            self.i.istr("(apply first '((1)))") # not inlined
+        self.assertEqual(self.i.istr('(double-all (list 1 2))'),
+                         Cons.from_iter([Number(2), Number(4)]))
+
+        # globals are looked up on every call
+        self.i.istr('(define (fib n) 0)')
+        self.i.istr('(define offset 10)')
+        self.assertEqual(self.i.istr("(double-all '(1))"),
+                         Cons.from_iter([Number(10)]))
+
+        first = self.i.istr('first')
+        self.assertIsNot(first.step, first.lambda_expr.body_step)
+        with self.assertRaises(SchemeTypeError):
+            self.i.istr("(apply first '(1))")
+
+
+    def test_modules(self):
+        directory = tempfile.mkdtemp()
+        def write(name, text):
+            with open(os.path.join(directory, name), 'w') as f:
+                f.write(text)
+
+        write('geometry.scm', """
+        (define-module geometry (export area)
+          (import "square.scm")
+          (define pi 3)
+          (define (area r) (* pi (square r))))""")
+        write('square.scm', """
+        (define calls 0)
+        (define (square x) (set! calls (+ calls 1)) (* x x))""")
+        geometry = os.path.join(directory, 'geometry.scm')
+
+        self.i.istr(f'(import "{geometry}")')
+        self.assertEqual(self.i.istr('(area 2)'), Number(12))
+        with self.assertRaises(LookupError):
+            self.i.istr('pi')
+
+        # the compiled modules are shared, the instances are not
+        other = Interpreter()
+        other.istr(f'(import "{geometry}")')
+        self.assertIs(self.i.modules[geometry].module,
+                      other.modules[geometry].module)
+        self.i.istr('(area 1)')
+        self.i.istr(f'(import "{directory}/square.scm")')
+        self.assertEqual(self.i.istr('calls'), Number(2))
+        other.istr(f'(import "{directory}/square.scm")')
+        self.assertEqual(other.istr('calls'), Number(0))
+
+        # importing again does not evaluate the module again
+        self.i.istr(f'(import "{geometry}")')
+        self.assertEqual(self.i.istr('calls'), Number(2))
+
+        write('cycle.scm', '(import "cycle.scm")')
+        with self.assertRaises(SchemeException):
+            self.i.istr(f'(import "{directory}/cycle.scm")')
+        shutil.rmtree(directory)
+
+
+    def test_server(self):
+        directory = tempfile.mkdtemp()
+        prelude = os.path.join(directory, 'prelude.scm')
+        with open(prelude, 'w') as f:
+            f.write('(define (square x) (* x x))')
+        pool = server.Pool(2, [prelude], timeout=1)
+
+        response = pool.handle({'id': 1, 'code': '(display "hi") (square 3)'})
+        self.assertEqual(response['id'], 1)
+        self.assertEqual(response['values'][1], '9')
+        self.assertEqual(response['output'], 'hi')
+
+        # definitions do not leak between requests
+        pool.handle({'code': '(define square 1) (define leaked 2)'})
+        for k in range(2):
+            self.assertEqual(pool.handle({'code': '(square 2)'})['values'], ['4'])
+            self.assertIn('error', pool.handle({'code': 'leaked'}))
+
+        response = pool.handle({'batch': ['(+ 1 2)', '(car 1)'], 'id': 'b'})
+        self.assertEqual(response['results'][0]['values'], ['3'])
+        self.assertIn('SchemeTypeError', response['results'][1]['error'])
+
+        response = pool.handle({'code': '(define (loop) (loop)) (loop)',
+                                'timeout': 0.1})
+        self.assertIn('SchemeTimeoutError', response['error'])
+
+        output = io.StringIO()
+        requests = io.StringIO('{"code": "(square 5)"}\n\nnot json\n')
+        server.serve_stdio(pool, requests, output)
+        responses = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(responses[0]['values'], ['25'])
+        self.assertIn('error', responses[1])
+
+        # neither closing the output nor a malformed request stops the server
+        output = io.StringIO()
+        requests = io.StringIO(
+            '{"id": 1, "code": "(close-port (current-output-port)) (display 2)"}\n'
+            '{"id": 2, "batch": 5}\n'
+            '{"id": 3, "code": "(square 3)"}\n')
+        server.serve_stdio(pool, requests, output)
+        responses = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(responses[0]['output'], '2')
+        self.assertEqual(responses[1]['id'], 2)
+        self.assertIn('error', responses[1])
+        self.assertEqual(responses[2]['values'], ['9'])
+
+        # concurrent evaluations would count each other's allocations
+        with self.assertRaises(ValueError):
+            server.Pool(2, [prelude], max_memory=100000)
+        pool = server.Pool(1, [prelude], max_memory=100000)
+        response = pool.handle({'code': '(define (loop) (cons 1 (loop))) (loop)'})
+        self.assertIn('SchemeMemoryError', response['error'])
+        shutil.rmtree(directory)
+
+
+    def test_file_ports(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'log.txt')
+        self.i.istr(f'(define path "{path}")')
+
+        values = self.i.istr_all("""
+        (define out (open-output-file path))
+        (output-port? out)
+        (write-string "first line" out)
+        (newline out)
+        (display 42 out)
+        (close-port out)
+
+        (define in (open-input-file path))
+        (read-char in)
+        (read-line in)
+        (read-line in)
+        (eof-object? (read-line in))
+        (close-input-port in)
+
+        (define next-line (file-lines path))
+        (do ((line (next-line) (next-line))
+             (count 0 (+ count 1)))
+            ((eof-object? line) count))
+        (eof-object? (next-line))""")
+
+        self.assertEqual(values[1], Boolean(True))
+        self.assertEqual(values[7:10], [String('f'), String('irst line'),
+                                        String('42')])
+        self.assertEqual(values[10], Boolean(True))
+        self.assertEqual(values[13:], [Number(2), Boolean(True)])
+
+        with self.assertRaises(SchemeFileError):
+            self.i.istr(f'(open-input-file "{directory}/missing")')
+        with self.assertRaises(SchemeTypeError):
+            self.i.istr('(read-line in)')
+
+        # the standard output is not closed by the program
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            self.i.istr_all('(close-port (current-output-port)) (display 1)')
+        self.assertEqual(stdout.getvalue(), '1')
+        shutil.rmtree(directory)
+
+
+    def test_limits(self):
+        self.i.istr_all("""
+        (define (fact-rec n)
+          (if (= n 0) 1 (* n (fact-rec (sub1 n)))))
+        (define (build n acc)
+          (if (= n 0) acc (build (sub1 n) (cons (number->string n) acc))))""")
+
+        self.i.istr('(build 10 nil)')
+        stats = self.i.stats
+        self.assertEqual((stats.conses, stats.strings), (10, 10))
+        self.assertGreater(stats.memory, 0)
+        self.i.istr('(lambda (x) x)')
+        self.assertEqual(self.i.stats.closures, 1)
+
+        self.i.max_depth = 100
+        self.assertEqual(self.i.istr('(fact-rec 50)'), Number(math.factorial(50)))
+        with self.assertRaises(SchemeRecursionError):
+            self.i.istr('(fact-rec 200)')
+        self.assertEqual(self.i.istr('(car (build 1000 nil))'), String('1'))
+
+        self.i.max_memory = 100000
+        with self.assertRaises(SchemeMemoryError):
+            self.i.istr('(build 100000 nil)')
+        self.i.max_memory = None
+        self.assertEqual(self.i.istr('(car (build 1000 nil))'), String('1'))
+
+
+    def test_image(self):
+        self.i.istr_all("""
+        (define (make-counter)
+          (let ((count 0))
+            (lambda () (set! count (+ count 1)) count)))
+        (define counter (make-counter))
+        (counter)
+        (define (adder n) (lambda (x) (+ x n)))
+        (define add5 (adder 5))
+        (define (square x) (* x x))
+        (define (sum-squares n acc)
+          (if (= n 0) acc (sum-squares (- n 1) (+ acc (square n)))))
+        (define-memoized (fib n)
+          (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+        (define table (make-equal-hash-table))
+        (hash-table-set! table (list 1 2) 'pair)
+        (define shared (list 1 2 3))
+        (define both (cons shared shared))
+        (define (build n acc) (if (= n 0) acc (build (- n 1) (cons n acc))))
+        (define long (build 10000 nil))
+        (define vec (f64vector 1 2.5))""")
+        self.i.istr('(sum-squares 10 0)')
+        for k in range(jit.THRESHOLD):
+            self.i.istr('(square 2)') # compiled by the jit before saving
+
+        path = os.path.join(tempfile.mkdtemp(), 'test.image')
+        self.i.save_image(path)
+        inter = Interpreter()
+        inter.load_image(path)
+        self.assertEqual(inter.istr('(counter)'), Number(2))
+        self.assertEqual(inter.istr('(add5 1)'), Number(6))
+        self.assertEqual(inter.istr('(sum-squares 10 0)'), Number(385))
+        self.assertEqual(inter.istr('(fib 60)'), Number(1548008755920))
+        self.assertEqual(inter.istr("(hash-table-ref table (list 1 2))"),
+                         Symbol('pair'))
+        self.assertEqual(inter.istr('(eq? (car both) (cdr both))'), Boolean(True))
+        self.assertEqual(inter.istr('(car (cdr long))'), Number(2))
+        self.assertEqual(inter.istr('(f64vector-ref vec 1)'), Number(2.5))
+        self.assertEqual(inter.istr('(square 3)'), Number(9))
+        self.assertIn(Symbol('square'), inter.inline_table)
+        # the loaded state is independent of the saved interpreter
+        self.assertEqual(self.i.istr('(counter)'), Number(2))
+
+        # inline table bodies holding inlined calls
+        inter = Interpreter()
+        inter.istr_all('''
+        (define (square x) (* x x))
+        (define (sos a b) (+ (square a) (square b)))''')
+        inter.save_image(path)
+        inter = Interpreter()
+        inter.load_image(path)
+        inter.istr('(define (g n) (sos n 1))')
+        self.assertEqual(inter.istr('(g 3)'), Number(10))
+
+        self.i.istr('(define port (open-output-file "/dev/null"))')
+        with self.assertRaises(SchemeException):
+            self.i.save_image(path)
+        shutil.rmtree(os.path.dirname(path))
+        
+
+    def test_higher_order(self):
+        self.i.istr('(define lst (list 1 2 3 4))')
+        def ints(*pynums):
+            return Cons.from_iter(map(Number, pynums))
+
+        # primitive procedures are called in a python loop, without steps
+        self.i.istr('(map + nil nil)')
+        steps = self.i.stats.steps
+        self.assertEqual(self.i.istr('(map + lst lst)'), ints(2, 4, 6, 8))
+        self.assertEqual(self.i.stats.steps, steps)
+        self.assertEqual(self.i.istr('(foldl cons nil lst)'), ints(4, 3, 2, 1))
+        self.assertEqual(self.i.istr('(foldr + 0 lst)'), Number(10))
+        self.assertEqual(self.i.istr('(filter odd? lst)'), ints(1, 3))
+        self.assertEqual(self.i.istr("(map apply (list + -) '((1 2) (5 3)))"),
+                         ints(3, 2))
+        self.assertEqual(self.i.istr('(map car nil)'), nil)
+
+        # compound procedures get no Caller step per element
+        self.assertEqual(self.i.istr('(map (lambda (x) (* x x)) lst)'),
+                         ints(1, 4, 9, 16))
+        self.assertEqual(self.i.stats.frames, 5)
+        self.assertEqual(self.i.istr('(filter (lambda (x) (> x 2)) lst)'),
+                         ints(3, 4))
+        self.assertEqual(self.i.istr('(foldl (lambda (x acc) (- acc x)) 0 lst)'),
+                         Number(-10))
+        self.assertEqual(self.i.istr('(foldr (lambda (x acc) (cons x acc)) nil lst)'),
+                         ints(1, 2, 3, 4))
+        self.assertEqual(self.i.istr(
+            '(map (lambda (x) (map (lambda (y) (* x y)) lst)) (list 1 2))'),
+            Cons.from_iter([ints(1, 2, 3, 4), ints(2, 4, 6, 8)]))
+
+        
+    def test_streams(self):
+        self.i.istr_all("""
+        (define (integers-from n) (cons-stream n (integers-from (+ n 1))))
+        (define nat (integers-from 0))
+        (define forced 0)
+        (define p (delay (begin (set! forced (+ forced 1)) forced)))""")
+        def ints(*pynums):
+            return Cons.from_iter(map(Number, pynums))
+
+        self.assertEqual(self.i.istr('(stream-take nat 5)'), ints(0, 1, 2, 3, 4))
+        self.assertEqual(self.i.istr('(stream-take (stream-map + nat nat) 3)'),
+                         ints(0, 2, 4))
+        self.assertEqual(self.i.istr("""
+        (stream-take (stream-map (lambda (x) (* x x))
+                                 (stream-filter (lambda (x) (= (remainder x 7) 0))
+                                                nat))
+                     3)"""), ints(0, 49, 196))
+        self.assertEqual(self.i.istr('(stream-car (stream-filter odd? nat))'),
+                         Number(1))
+        self.assertEqual(self.i.istr('(stream-car (stream-cdr (stream-cdr nat)))'),
+                         Number(2))
+        self.assertEqual(self.i.istr('(stream-take (cons-stream 1 nil) 3)'),
+                         ints(1))
+
+        # promises are forced once
+        self.assertEqual(self.i.istr_all('(force p) (force p) forced'),
+                         [Number(1)] * 3)
+        self.assertEqual(self.i.istr('(force (make-promise 5))'), Number(5))
+        self.assertEqual(self.i.istr('(force 5)'), Number(5))
+        self.assertEqual(self.i.istr('(promise? p)'), Boolean(True))
+
+        # each iteration's variable is captured
+        self.assertEqual(self.i.istr("""
+        (do ((i 0 (+ i 1)) (ps nil (cons (delay i) ps)))
+            ((= i 3) (map force ps)))"""), ints(2, 1, 0))
+
+        
+    def test_list_library(self):
+        self.i.istr("(define lst '(1 2 3 4))")
+        def ints(*pynums):
+            return Cons.from_iter(map(Number, pynums))
+
+        self.assertEqual(self.i.istr('(length lst)'), Number(4))
+        self.assertEqual(self.i.istr('(length nil)'), Number(0))
+        self.assertEqual(self.i.istr("(append lst '(5) nil '(6))"),
+                         ints(1, 2, 3, 4, 5, 6))
+        self.assertEqual(self.i.istr("(append '(1) 2)"), Cons(Number(1), Number(2)))
+        self.assertEqual(self.i.istr('(eq? (append nil lst) lst)'), Boolean(True))
+        self.assertEqual(self.i.istr('(reverse lst)'), ints(4, 3, 2, 1))
+        self.assertEqual(self.i.istr('(list-ref lst 2)'), Number(3))
+        self.assertEqual(self.i.istr('(list-tail lst 2)'), ints(3, 4))
+        self.assertEqual(self.i.istr('(list-tail lst 4)'), nil)
+        self.assertEqual(self.i.istr('(last-pair lst)'), ints(4))
+        self.assertEqual(self.i.istr('(equal? (list-copy lst) lst)'), Boolean(True))
+        self.assertEqual(self.i.istr('(eq? (list-copy lst) lst)'), Boolean(False))
+        self.assertEqual(self.i.istr('(member 3 lst)'), ints(3, 4))
+        self.assertEqual(self.i.istr("(member '(1) '(a (1) b))").car, ints(1))
+        self.assertEqual(self.i.istr("(memq '(1) '(a (1) b))"), Boolean(False))
+        self.assertEqual(self.i.istr("(memv 2.5 '(1 2.5))"), Cons(Number(2.5), nil))
+        self.assertEqual(self.i.istr("(assq 'b '((a 1) (b 2)))"),
+                         Cons(Symbol('b'), ints(2)))
+        self.assertEqual(self.i.istr('(assoc "b" (list (cons "a" 1) (cons "b" 2)))'),
+                         Cons(String('b'), Number(2)))
+        self.assertEqual(self.i.istr("(assv 3 '((1 2)))"), Boolean(False))
+
+        for code in ('(length 5)', '(length (cons 1 2))', '(list-ref lst 4)',
+                     '(list-tail lst -1)', "(assq 'a '(1))", '(last-pair nil)',
+                     '(append (cons 1 2) nil)'):
+            with self.assertRaises(SchemeTypeError):
+                self.i.istr(code)
+
+        
+    def test_sort(self):
+        def ints(*pynums):
+            return Cons.from_iter(map(Number, pynums))
+
+        self.assertEqual(self.i.istr("(sort '(3 1 2) <)"), ints(1, 2, 3))
+        self.assertEqual(self.i.istr("(sort '(3 1 2) >)"), ints(3, 2, 1))
+        self.assertEqual(self.i.istr("(list-sort < nil)"), nil)
+        self.assertEqual(self.i.istr('(sort (list "b" "c" "a") string<?)'),
+                         Cons.from_iter(map(String, 'abc')))
+        self.assertEqual(self.i.istr('(string<? "a" "b" "c")'), Boolean(True))
+        self.assertEqual(self.i.istr('(string=? "a" "b")'), Boolean(False))
+
+        # compound comparators; the sort is stable
+        pynums = [random.randrange(100) for k in range(200)]
+        self.i.istr(f"(define nums '({' '.join(map(str, pynums))}))")
+        self.assertEqual(self.i.istr('(list-sort (lambda (a b) (< a b)) nums)'),
+                         ints(*sorted(pynums)))
+        self.assertEqual(self.i.istr('(sort nums <=)'), ints(*sorted(pynums)))
+        pairs = self.i.istr("""
+        (sort (map (lambda (n) (list (remainder n 10) n)) nums)
+              (lambda (a b) (< (car a) (car b))))""")
+        expected = sorted(pynums, key=lambda n: n % 10)
+        self.assertEqual([pair.cadr.pynum for pair in pairs], expected)
+
+        self.i.istr('(define vec (f64vector 3 1 2))')
+        self.assertEqual(self.i.istr('(f64vector->list (sort vec <))'),
+                         ints(1, 2, 3))
+        self.i.istr('(vector-sort! vec (lambda (a b) (> a b)))')
+        self.assertEqual(self.i.istr('(f64vector->list vec)'), ints(3, 2, 1))
+
+        with self.assertRaises(SchemeTypeError):
+            self.i.istr("(sort '(1 a) <)")
+
+        
+    def test_lazy_compilation(self):
+        self.i.istr_all("""
+        (define (broken) (quote))
+        (define (square x) (* x x))""")
+        square = self.i.istr('square')
+        self.assertIsNone(square.lambda_expr._body)
+        self.assertEqual(self.i.istr("(apply square '(3))"), Number(9))
+        self.assertIsNotNone(square.lambda_expr._body)
+        self.assertIs(square.step, square.lambda_expr.body_step)
+
+        # errors in bodies are found when they are compiled
+        with self.assertRaises(ValueError):
+            self.i.istr('(apply broken nil)')
+
+        
+    def test_reload(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'rules.scm')
+        def write(text):
+            with open(path, 'w') as f:
+                f.write(text)
+
+        write("""
+        (define (rate x) (* x 2))
+        (define base (rate 10))
+        (define doubled (* base 2))
+        (define (helper) (rate 10))
+        (define indirect (helper))
+        (define log nil)
+        (set! log (cons 'loaded log))""")
+        self.i.ifile(path)
+        self.assertEqual(self.i.istr('doubled'), Number(40))
+
+        write("""
+        (define (rate x) (* x 3)) ; changed
+        (define base (rate 10))
+        (define doubled   (* base 2))
+        (define (helper) (rate 10))
+        (define indirect (helper))
+        (define log nil)
+        (set! log (cons 'loaded log))""")
+        reloaded = self.i.reload(path)
+        self.assertEqual([str(form) for form in reloaded],
+                         ['(define (rate x) (* x 3))', '(define base (rate 10))',
+                          '(define doubled (* base 2))',
+                          '(define indirect (helper))'])
+        self.assertEqual(self.i.istr('doubled'), Number(60))
+        self.assertEqual(self.i.istr('indirect'), Number(30))
+        self.assertEqual(self.i.istr('(length log)'), Number(1))
+        self.assertEqual(self.i.reload(path), [])
+
+        shutil.rmtree(directory)
+
+        
+    def test_programs(self):
+        prog = program.compile_program("""
+        (define (square x) (* x x))
+        (define (sum-squares lst) (foldl + 0 (map square lst)))
+        (sum-squares (list 1 2 3))""")
+        for k in range(2):
+            inter = Interpreter()
+            self.assertEqual(prog.run(inter)[-1], Number(14))
+            self.assertEqual(inter.istr('(square 5)'), Number(25))
+        self.assertEqual(prog.run()[-1], Number(14))
+
+        # inlined calls notice a redefinition in the running interpreter
+        self.i.istr('(define (helper) 1)')
+        prog = program.compile_program('(define (helper) 2) (helper)')
+        self.assertEqual(prog.run(self.i), [None, Number(2)])
+
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, 'lib.scm'), 'w') as f:
+            f.write('(define answer 42)')
+        main = os.path.join(directory, 'main.scm')
+        with open(main, 'w') as f:
+            f.write('(import "lib.scm") answer')
+        prog = program.compile_program(main)
+        self.assertEqual(prog.path, main)
+        self.assertEqual(prog.run(Interpreter())[-1], Number(42))
+
+        # files loaded by the interpreter resolve imports the same way
+        self.assertEqual(Interpreter().ifile(main), Number(42))
+        self.assertEqual(Interpreter().ifile_all(main)[-1], Number(42))
+        inter = Interpreter()
+        inter.reload(main)
+        self.assertEqual(inter.istr('answer'), Number(42))
+        shutil.rmtree(directory)
+
+        
+    def test_division(self):
+        values = self.i.istr_all('''
+        (quotient -7 2)
+        (remainder -7 2)
+        (modulo -7 2)
+        (/ 7 2)''')
+        self.assertEqual(values, [Number(-3), Number(-1), Number(1),
+                                  Number(3.5)])
+        for source in ('(quotient 1 0)', '(remainder 1 0)', '(modulo 1 0)',
+                       '(/ 1 0)', '(/ 1.5 0.0)'):
+            self.assertRaises(SchemeZeroDivisionError, self.i.istr, source)
+
+
+    def test_memoize(self):
+        self.i.istr_all("""
+        (define-memoized (fib n)
+          (if (< n 2)
+              n
+              (+ (fib (- n 1)) (fib (- n 2)))))
+
+        (define (slow-square x) (* x x))
+        (define fast-square (memoize slow-square 2))""")
+
+        self.assertEqual(self.i.istr('(fib 60)'), Number(1548008755920))
+        self.assertLess(self.i.stats.steps, 20000)
+        self.assertEqual(str(self.i.istr("(memoize-stats fib)")),
+                         '((hits . 58) (misses . 61) (size . 61))')
+
+        values = self.i.istr_all("""
+        (fast-square 2) (fast-square 3) (fast-square 2) (fast-square 4)
+        (fast-square 3) (memoize-stats fast-square)""")
+        self.assertEqual(values[:5], [Number(4), Number(9), Number(4),
+                                      Number(16), Number(9)])
+        # 3 was evicted by 4 since the cache holds only 2 entries
+        self.assertEqual(str(values[5]), '((hits . 1) (misses . 4) (size . 2))')
+
+
+
+    def test_hash_tables(self):
+        values = self.i.istr_all("""
+        (define table (make-hash-table))
+        (hash-table-set! table '(1 "two") 'list)
+        (hash-table-set! table "key" 'string)
+        (hash-table-set! table 10 'number)
+        (hash-table-ref table (list 1 "two"))
+        (hash-table-ref table "key")
+        (hash-table-ref/default table 10.0 'none)
+        (hash-table-ref table 'missing (lambda () 'failed))
+        (hash-table-count table)
+        (hash-table-delete! table "key")
+        (hash-table-contains? table "key")
+        (hash-table-count table)""")
+        self.assertEqual(values[4:9], [Symbol('list'), Symbol('string'),
+                                       Symbol('number'), Symbol('failed'),
+                                       Number(3)])
+        self.assertEqual(values[10:], [Boolean(False), Number(2)])
+        self.assertRaises(SchemeKeyError, self.i.istr,
+                          "(hash-table-ref table 'missing)")
+
+        values = self.i.istr_all("""
+        (define eq-table (make-hash-table eq?))
+        (define key (list 1 2))
+        (hash-table-set! eq-table key 'found)
+        (hash-table-ref/default eq-table key 'none)
+        (hash-table-ref/default eq-table (list 1 2) 'none)
+        (define eqv-table (make-eqv-hash-table))
+        (hash-table-set! eqv-table 1 'one)
+        (hash-table-ref/default eqv-table 1 'none)
+        (hash-table-ref/default eqv-table "a" 'none)""")
+        self.assertEqual(values[3:5], [Symbol('found'), Symbol('none')])
+        self.assertEqual(values[7:], [Symbol('one'), Symbol('none')])
+
+        values = self.i.istr_all("""
+        (define counts (make-hash-table))
+        (define (count! word)
+          (hash-table-update!/default counts word add1 0))
+        (count! 'a) (count! 'b) (count! 'a)
+        (define total 0)
+        (hash-table-walk counts (lambda (k v) (set! total (+ total v))))
+        total
+        (hash-table-ref counts 'a)""")
+        self.assertEqual(values[-2:], [Number(3), Number(2)])
+
+        # long keys are hashed and compared without recursing down the list
+        values = self.i.istr_all("""
+        (define (build n)
+          (do ((i 0 (+ i 1)) (lst nil (cons i lst)))
+              ((= i n) lst)))
+        (define long-table (make-hash-table))
+        (hash-table-set! long-table (build 5000) 'long)
+        (hash-table-ref/default long-table (build 5000) 'none)
+        (hash-table-ref/default long-table (build 4999) 'none)""")
+        self.assertEqual(values[3:], [Symbol('long'), Symbol('none')])
+
+
+
+    def test_string_ports(self):
+        values = self.i.istr_all(r"""
+        (define port (open-output-string))
+        (write-string "total:\t" port)
+        (display 42 port)
+        (newline port)
+        (display "done" port)
+        (get-output-string port)
+        (string-append "a" (number->string 1/2) (symbol->string 'b) "")
+        (string-length "a\nb")
+        (substring "report" 2 4)""")
+        self.assertEqual(values[5:], [String.from_chars('total:\t42\ndone'),
+                                      String('a1/2b'), Number(3), String('po')])
+        self.assertEqual(String('a\\nb'), String.from_chars('a\nb'))
+        self.assertEqual(self.i.istr('(substring "report" 2)'), String('port'))
+        self.assertEqual(self.i.istr('(substring "report" 6 6)'), String(''))
+        for source in ('(substring "report" -1 2)', '(substring "report" 3 2)',
+                       '(substring "report" 2 7)', '(substring "report" 7)'):
+            self.assertRaises(SchemeTypeError, self.i.istr, source)
+
+
+
+    def test_numeric_vectors(self):
+        values = self.i.istr_all("""
+        (define xs (list->f64vector (list 1 2 3)))
+        (define ns (s64vector 4 5 6))
+        (vector-sum (vector-add xs ns))
+        (vector-dot xs ns)
+        (s64vector->list (vector-scale ns 2))
+        (f64vector->list (vector-map square xs))
+        (s64vector->list (vector-map (lambda (n) (* n 10)) ns))
+        (f64vector->list (vector-map (lambda (n) (/ n 2)) ns))
+        (f64vector-set! xs 0 10)
+        (f64vector-ref xs 0)
+        (s64vector-length ns)""")
+        self.assertEqual(values[2:4], [Number(21.0), Number(32.0)])
+        self.assertEqual([value.pylist for value in values[4:8]],
+                         [[Number(n) for n in ns] for ns in ([8, 10, 12],
+                                                             [1.0, 4.0, 9.0],
+                                                             [40, 50, 60],
+                                                             [2.0, 2.5, 3.0])])
+        self.assertEqual(values[9:], [Number(10.0), Number(3)])
+        self.assertRaises(SchemeTypeError, self.i.istr, '(s64vector 1.5)')
+        self.assertRaises(SchemeTypeError, self.i.istr,
+                          '(vector-add xs (s64vector 1))')
+        # mappers which push steps instead of returning their values
+        self.assertEqual(self.i.istr(
+            '(s64vector->list (vector-map (memoize (lambda (x) (* x x))) ns))'),
+            Cons.from_iter([Number(16), Number(25), Number(36)]))
+        self.assertEqual(
+            self.i.istr('(vector-sum (s64vector 9223372036854775807 1))'),
+            Number(2 ** 63))
+        for source in ('(s64vector 99999999999999999999)',
+                       '(make-s64vector -1)',
+                       '(vector-add (s64vector 9223372036854775807) (s64vector 1))',
+                       '(vector-scale (s64vector 1 -5000000000) 5000000000)',
+                       '(vector-map square (s64vector 9999999999))',
+                       '(vector-map - (s64vector -9223372036854775808))'):
+            self.assertRaises(SchemeTypeError, self.i.istr, source)
+
+
+
+    def test_let_forms(self):
+        values = self.i.istr_all("""
+        (define x 10)
+        (let ((x 1) (y x)) (+ x y))
+        (let* ((x 1) (y (+ x 1))) (* x y))
+        (letrec ((even? (lambda (n) (if (= n 0) #t (odd? (- n 1)))))
+                 (odd? (lambda (n) (if (= n 0) #f (even? (- n 1))))))
+          (even? 101))
+        (let loop ((i 0) (acc nil))
+          (if (= i 3)
+              (map (lambda (f) (f)) acc)
+              (loop (+ i 1) (cons (lambda () i) acc))))
+        (let loop ((i 0))
+          (if (< i 5) (+ 1 (loop (+ i 1))) 0))
+        (let loop ((i 0))
+          (let ((loop (lambda (x) (* x 100))))
+            (loop 3)))
+        x""")
+        self.assertEqual(values[1:4], [Number(11), Number(2), Boolean(False)])
+        self.assertEqual(values[4].pylist, [Number(2), Number(1), Number(0)])
+        self.assertEqual(values[5:], [Number(5), Number(300), Number(10)])
+
+        # lets and named lets allocate no procedures or frames, and loops run
+        # in constant space
+        self.assertEqual(self.i.istr("""
+        (+ 1 (let loop ((i 0) (acc 0))
+               (let ((next (+ i 1)))
+                 (if (> next 1000)
+                     acc
+                     (loop next (+ acc next))))))"""), Number(500501))
+        self.assertEqual(self.i.stats.frames, 1)
+        self.assertEqual(self.i.stats.tail_calls, 1000)
+
+
+
+    def test_do(self):
+        values = self.i.istr_all("""
+        (do ((i 0 (+ i 1))
+             (acc 0 (+ acc i)))
+            ((= i 1000) acc))
+        (define vec (make-s64vector 5))
+        (do ((i 0 (+ i 1)))
+            ((= i 5) (s64vector->list vec))
+          (s64vector-set! vec i (* i i)))
+        (do ((i 0 (+ i 1))
+             (thunks nil (cons (lambda () i) thunks)))
+            ((= i 3) (map (lambda (f) (f)) thunks)))
+        (+ 1 (do ((i 0 (+ i 1)) (j 10)) ((= i j) i)))""")
+        self.assertEqual(values[0], Number(499500))
+        self.assertEqual(values[2].pylist, [Number(n) for n in (0, 1, 4, 9, 16)])
+        self.assertEqual(values[3].pylist, [Number(2), Number(1), Number(0)])
+        self.assertEqual(values[4], Number(11))
+
+        # the loop runs in a single environment and frame
+        self.i.istr('(do ((i 0 (+ i 1))) ((= i 1000) i))')
+        self.assertEqual(self.i.stats.environments, 1)
+        self.assertEqual(self.i.stats.frames, 1)
             
 unittest.main()
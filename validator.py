@@ -74,6 +74,10 @@ def children(ls):
     else:
         raise ValueError(f'Invalid list schema: {ls}')
 
+@validator('string')
+def str_vldtr(scm, obj):
+    return type(obj) is String
+
 @validator('any')
 def any_vldtr(scm, obj):
     return isinstance(obj, SchemeValue)